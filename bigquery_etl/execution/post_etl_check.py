@@ -1,6 +1,189 @@
-# check whitespaces --> null
-# check nan --> null
-# check NA --> null
-# check duplicates 
-# check "." --> null
-# check entore column --> null
+#!/usr/bin/env python
+
+# Copyright 2015, Institute for Systems Biology.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Post ETL data quality checks on the produced new line delimited JSON shards
+
+Runs offline on local copies of the shards, one shard at a time, with
+vectorized checks:
+    - key columns are unique (across all the shards)
+    - key and not null columns have no nulls
+    - no column is entirely null
+    - no leftover placeholders that should have been nulls
+      (whitespace, 'NA', '.', 'nan', 'None')
+    - numeric columns are within their ranges
+    - the total row count is within the expected bounds
+
+usage:
+    python -m bigquery_etl.execution.post_etl_check 'protein/*.json' \
+        --key AliquotBarcode,Gene_Name,Protein_Name --notnull Study \
+        --range Protein_Expression:-100:100 --min_rows 1
+"""
+import sys
+import glob
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+from bigquery_etl.transform.tools import hash_rows
+
+log = logging.getLogger(__name__)
+
+# values that should have been converted to null during the transform
+null_placeholders = ['', 'NA', '.', 'nan', 'NaN', 'None', 'null']
+
+class PostEtlCheck(object):
+    """Accumulates the checks over the shards; report() lists the failures
+    """
+    def __init__(self, key_columns=[], notnull_columns=[], ranges={}, min_rows=None, max_rows=None):
+        self.key_columns = list(key_columns)
+        self.notnull_columns = list(key_columns) + [column for column in notnull_columns
+                                                    if column not in key_columns]
+        # column -> (min, max); None for no bound
+        self.ranges = ranges
+        self.min_rows = min_rows
+        self.max_rows = max_rows
+        self.row_count = 0
+        self.key_hashes = []
+        # column -> number of non null values
+        self.value_counts = {}
+        self.failures = []
+
+    def fail(self, shard, message):
+        log.error('%s: %s' % (shard, message))
+        self.failures.append((shard, message))
+
+    def check_frame(self, df, shard):
+        """Runs the checks of one shard
+        """
+        self.row_count += len(df)
+
+        missing_columns = [column for column in self.notnull_columns + list(self.ranges) if column not in df]
+        if missing_columns:
+            self.fail(shard, 'missing columns %s' % (missing_columns))
+
+        null_counts = df.isnull().sum()
+        for column in self.notnull_columns:
+            if column in df and null_counts[column]:
+                self.fail(shard, '%s null values in %s' % (null_counts[column], column))
+        for column, count in (len(df) - null_counts).iteritems():
+            self.value_counts[column] = self.value_counts.get(column, 0) + count
+
+        for column in df.columns[(df.dtypes == object).values]:
+            try:
+                placeholders = df[column].str.strip().isin(null_placeholders).sum()
+            except AttributeError:
+                # no strings in the column
+                continue
+            if placeholders:
+                self.fail(shard, '%s null placeholder values in %s' % (placeholders, column))
+
+        for column, (low, high) in self.ranges.iteritems():
+            if column not in df:
+                continue
+            values = pd.to_numeric(df[column], errors='coerce')
+            out_of_range = np.zeros(len(values), dtype=bool)
+            if low is not None:
+                out_of_range |= (values < low).values
+            if high is not None:
+                out_of_range |= (values > high).values
+            if out_of_range.any():
+                self.fail(shard, '%s values of %s out of [%s, %s]' % (out_of_range.sum(), column, low, high))
+
+        if self.key_columns and not missing_columns:
+            self.key_hashes.append(hash_rows(df, self.key_columns))
+
+    def check_shards(self, paths):
+        for path in paths:
+            log.info('checking %s' % (path))
+            self.check_frame(pd.read_json(path, lines=True, dtype=False), path)
+        return self.report()
+
+    def report(self):
+        """Runs the checks over all the shards; returns the failures
+        """
+        if self.key_hashes:
+            key_hashes = pd.Series(np.concatenate(self.key_hashes))
+            duplicates = key_hashes.duplicated().sum()
+            if duplicates:
+                self.fail('all shards', '%s rows with a duplicate %s' % (duplicates, self.key_columns))
+
+        for column, count in sorted(self.value_counts.iteritems()):
+            if not count:
+                self.fail('all shards', 'column %s is entirely null' % (column))
+
+        if self.min_rows is not None and self.row_count < self.min_rows:
+            self.fail('all shards', '%s rows, expected at least %s' % (self.row_count, self.min_rows))
+        if self.max_rows is not None and self.row_count > self.max_rows:
+            self.fail('all shards', '%s rows, expected at most %s' % (self.row_count, self.max_rows))
+        return self.failures
+
+#------------------------------------------
+# Blob existence: one listing diff instead of a call per blob
+#------------------------------------------
+def missing_blobs(expected_names, listed_names):
+    """Returns the expected names that are not in the listing
+    """
+    expected = pd.Series(expected_names).drop_duplicates()
+    return expected[~expected.isin(listed_names)].tolist()
+
+def blob_prefixes(names, depth=2):
+    """The distinct prefixes (first depth path components) of the names
+    """
+    return sorted(set('/'.join(name.split('/')[:depth]) + '/' for name in names))
+
+def find_missing_blobs(bucket_index, names, refresh=False):
+    """Checks the names against the bucket index (see BucketIndex), listing
+       the prefixes of the names when they aren't indexed yet (or expired),
+       or always with refresh
+    """
+    names = pd.Series(names).dropna().tolist()
+    listed_df = bucket_index.list_blobs(blob_prefixes(names), refresh=refresh)
+    return missing_blobs(names, listed_df['name'])
+
+def parse_range(spec):
+    column, low, high = spec.rsplit(':', 2)
+    return column, (float(low) if low else None, float(high) if high else None)
+
+def main(patterns, key_columns, notnull_columns, ranges, min_rows, max_rows):
+    paths = sorted(path for pattern in patterns for path in glob.glob(pattern))
+    if not paths:
+        print 'no shards matching %s' % (patterns)
+        return 1
+    checker = PostEtlCheck(key_columns, notnull_columns, ranges, min_rows, max_rows)
+    failures = checker.check_shards(paths)
+    print '%s shards, %s rows, %s failed checks' % (len(paths), checker.row_count, len(failures))
+    for shard, message in failures:
+        print '\t%s: %s' % (shard, message)
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('patterns', nargs='+', help='Local NDJSON shards (glob patterns)')
+    parser.add_argument('--key', default='', help='Comma separated unique key columns')
+    parser.add_argument('--notnull', default='', help='Comma separated columns that cannot be null')
+    parser.add_argument('--range', action='append', default=[],
+                        help='column:min:max value range (min or max can be empty)')
+    parser.add_argument('--min_rows', type=int, default=None, help='Minimum total rows')
+    parser.add_argument('--max_rows', type=int, default=None, help='Maximum total rows')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main(args.patterns,
+                  [column for column in args.key.split(',') if column],
+                  [column for column in args.notnull.split(',') if column],
+                  dict(parse_range(spec) for spec in args.range),
+                  args.min_rows, args.max_rows))
@@ -18,11 +18,67 @@ import time
 import pandas as pd
 import sqlite3
 import random
+from bigquery_etl.execution.worker_context import run_in_worker
+
+class TaskStatusWriter(object):
+    """Batched writer for the task status table;
+    keeps a single sqlite3 connection open (WAL mode) and flushes the
+    completed-task rows when either batch_size rows are pending or
+    flush_interval seconds have passed since the last flush
+    """
+    def __init__(self, db, table, batch_size=500, flush_interval=10, log=None):
+        self.db_filename = db
+        self.table = table
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.log = log
+        self.pending = []
+        self.last_flush = time.time()
+        self.conn = sqlite3.connect(self.db_filename, check_same_thread=False)
+        # WAL lets the pipeline read the status table while we write to it
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+
+    def add(self, record):
+        """Queue a status row; flushes if the batch is full or stale"""
+        self.pending.append(record)
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        """Flush if the size or time bound has been reached"""
+        if len(self.pending) >= self.batch_size or \
+                time.time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write all the pending rows in one transaction"""
+        self.last_flush = time.time()
+        if not self.pending:
+            return
+        queue_df = pd.DataFrame(self.pending)
+        queue_df.to_sql(con=self.conn, name=self.table, if_exists='append', index=False)
+        self.conn.commit()
+        self.pending = []
+        if self.log:
+            self.log.info('inserted ' + str(len(queue_df)) + ' records.')
+
+    def close(self):
+        """Final flush and close the connection"""
+        try:
+            self.flush()
+        finally:
+            self.conn.close()
 
 class ProcessManager(object):
     """Concurrent futures - Sqlite3 based task queue system;
+    if max_in_flight is set, submit() blocks while that many tasks are
+    outstanding and resumes as soon as futures complete;
+    if initializer is set, initializer(context, *initargs) runs once in each
+    worker process before its first task (see worker_context)
     """
-    def __init__(self, max_workers, db, table, resubmit=False, log=None):
+    def __init__(self, max_workers, db, table, resubmit=False, log=None,
+                 status_batch_size=500, status_flush_interval=10, max_in_flight=None,
+                 initializer=None, initargs=()):
         self.max_workers = max_workers
         self.db_filename = db
         self.table = table
@@ -30,6 +86,13 @@ class ProcessManager(object):
         self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
         self.futures = {}
         self.log = log
+        self.status_batch_size = status_batch_size
+        self.status_flush_interval = status_flush_interval
+        self.max_in_flight = max_in_flight
+        self.initializer = initializer
+        self.initargs = initargs
+        self.exceptions = []
+        self.status_writer = None
 
     def to_db(self, queue_df, conn, table_name):
         """Submit to queue - sqllite database
@@ -45,11 +108,42 @@ class ProcessManager(object):
         conn = sqlite3.connect(self.db_filename, check_same_thread=False)
         return conn
 
+    def get_status_writer(self):
+        """Create the task status writer on first use"""
+        if self.status_writer is None:
+            self.status_writer = TaskStatusWriter(self.db_filename, self.table,
+                                                  batch_size=self.status_batch_size,
+                                                  flush_interval=self.status_flush_interval,
+                                                  log=self.log)
+        return self.status_writer
+
+    def close_status_writer(self):
+        """Flush the remaining status rows and close the connection"""
+        if self.status_writer is not None:
+            self.status_writer.close()
+            self.status_writer = None
+
     def submit(self, f, *args, **kwargs):
-        """Submit the job"""
+        """Submit the job; blocks while max_in_flight jobs are outstanding"""
+        if self.max_in_flight:
+            try:
+                while len(self.futures) >= self.max_in_flight:
+                    self.wait_for_completed()
+            except:
+                # keep the status rows we already have for the resume
+                self.close_status_writer()
+                raise
+        self.submit_to_executor(f, *args, **kwargs)
+
+    def submit_to_executor(self, f, *args, **kwargs):
+        """Submit the job to the executor, with retries"""
         for n in range(4):
             try:
-                future = self.executor.submit(f, *args, **kwargs)
+                if self.initializer:
+                    future = self.executor.submit(run_in_worker, self.initializer, self.initargs,
+                                                  f, *args, **kwargs)
+                else:
+                    future = self.executor.submit(f, *args, **kwargs)
                 self.futures[future] = (f, args, kwargs)
                 break
             except Exception as e:
@@ -60,37 +154,73 @@ class ProcessManager(object):
         else:
             raise ValueError('unable to submit job %s' % (f))
 
-    def start(self):
-        """Start the process manager, check for exceptions
+    def wait_for_completed(self):
+        """Wait for at least one future to complete and record the results
         """
-        exceptions = []
-        while self.futures:
+        status_writer = self.get_status_writer()
 
-            res = concurrent.futures.wait(
-                self.futures,
-                return_when=(concurrent.futures.FIRST_COMPLETED))
+        # wake up at least every flush interval so that the status
+        # table doesn't lag behind while long tasks are running
+        res = concurrent.futures.wait(
+            self.futures,
+            timeout=self.status_flush_interval,
+            return_when=(concurrent.futures.FIRST_COMPLETED))
+        status_writer.flush_if_due()
+        if not res.done:
+            return
 
-            self.log.info('Tasks DONE: %s  NOT_DONE: %s  EXCEPTIONS: %s' % (len(res.done), len(res.not_done), len(exceptions)))
+        self.log.info('Tasks DONE: %s  NOT_DONE: %s  EXCEPTIONS: %s' % (len(res.done), len(res.not_done), len(self.exceptions)))
 
-            for future in res.done:
-                f, args, kwargs = self.futures[future]
-                del self.futures[future]
-                exc = future.exception()
+        for future in res.done:
+            f, args, kwargs = self.futures[future]
+            del self.futures[future]
+            exc = future.exception()
 
-                # save the result to db, including errors
-                df = pd.DataFrame([args[4]])
-                df['errors'] = str(exc)
-                self.to_db(df, self.connect_db(), self.table)
+            # save the result to db, including errors
+            for record in self.status_records(future, exc, args):
+                status_writer.add(record)
 
-                if exc is None:
-                    self.on_success(future, exc, f, *args, **kwargs)
-                else:
-                    exceptions.append((future, exc))
-                    self.on_error(future, exc, f, *args, **kwargs)
-                    if self.resubmit:
-                        self.log.warning('Resubmitting')
-                        self.submit(f, *args, **kwargs)
+            if exc is None:
+                self.on_success(future, exc, f, *args, **kwargs)
+            else:
+                self.exceptions.append((future, exc))
+                self.on_error(future, exc, f, *args, **kwargs)
+                if self.resubmit:
+                    self.log.warning('Resubmitting')
+                    # a slot was just freed, don't block here
+                    self.submit_to_executor(f, *args, **kwargs)
+
+    def status_records(self, future, exc, args):
+        """Status rows of a finished task: its metadata (args[4]) and errors.
+        A batch task has a list of metadata dicts and returns the error of
+        each of them (None for success), so each file gets its own row
+        """
+        metadata = args[4]
+        if not isinstance(metadata, list):
+            record = dict(metadata)
+            record['errors'] = str(exc)
+            return [record]
+
+        file_errors = future.result() if exc is None else [exc] * len(metadata)
+        records = []
+        for file_metadata, file_error in zip(metadata, file_errors):
+            record = dict(file_metadata)
+            record['errors'] = str(file_error)
+            records.append(record)
+        return records
+
+    def start(self):
+        """Start the process manager, check for exceptions
+        """
+        try:
+            while self.futures:
+                self.wait_for_completed()
+        finally:
+            # always write out the remaining rows, the resume logic
+            # (validate_and_get_diff) depends on them
+            self.close_status_writer()
 
+        exceptions = self.exceptions
         if len(exceptions) >= 1:
             self.log.error(("Exceptions: %s" % ("\n".join(map(str, exceptions)))))
             self.log.error("Failed: Found exceptions.")
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+# Copyright 2015, Institute for Systems Biology.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Per-process worker context
+
+The expensive handles a transform task needs (GCS client and bucket,
+logging setup, reference tables) are built once per worker process and
+reused by every task the worker runs.
+"""
+import os
+import logging
+from bigquery_etl.utils import logging_manager
+from bigquery_etl.utils.logging_manager import configure_logging, configure_queue_logging
+
+_context = None
+
+class WorkerContext(object):
+    """Handles shared by all the tasks that run in one process
+    """
+    def __init__(self):
+        self.pid = os.getpid()
+        self.initialized = False
+        # the file the process currently logs into
+        self.log_filename = None
+        self.gcs_connectors = {}
+        self.data = {}
+
+    def get_gcs_connector(self, project_id, bucket_name):
+        """Returns a GcsConnector for the bucket, creating it on first use
+        """
+        key = (project_id, bucket_name)
+        if key not in self.gcs_connectors:
+            # imported here so that the process manager doesn't need google.cloud
+            from bigquery_etl.extract.gcloud_wrapper import GcsConnector
+            self.gcs_connectors[key] = GcsConnector(project_id, bucket_name)
+        return self.gcs_connectors[key]
+
+    def get_logger(self, name, log_filename, level='DEBUG'):
+        """Returns the named logger, logging into log_filename. Through the
+        log listener, every task tags its records with its file (cheap, the
+        queue handler is only set up once); otherwise logging is only
+        configured again (dictConfig) when the file changes
+        """
+        if logging_manager.log_listener is not None:
+            configure_queue_logging(name, log_filename, level)
+        elif log_filename != self.log_filename:
+            configure_logging(name, log_filename, level)
+        self.log_filename = log_filename
+        return logging.getLogger(name)
+
+    def get(self, key, loader, *args, **kwargs):
+        """Returns cached data for key, calling loader(*args, **kwargs) on first use
+        """
+        if key not in self.data:
+            self.data[key] = loader(*args, **kwargs)
+        return self.data[key]
+
+def get_worker_context():
+    """Returns the context of the current process
+    """
+    global _context
+    # a forked child inherits the parent's context; don't reuse its handles
+    if _context is None or _context.pid != os.getpid():
+        _context = WorkerContext()
+    return _context
+
+def initialize_worker(initializer=None, initargs=()):
+    """Calls initializer(context, *initargs) once per process
+    """
+    context = get_worker_context()
+    if initializer and not context.initialized:
+        initializer(context, *initargs)
+        context.initialized = True
+    return context
+
+def run_in_worker(initializer, initargs, f, *args, **kwargs):
+    """Runs the task after making sure the worker is initialized
+    """
+    initialize_worker(initializer, initargs)
+    return f(*args, **kwargs)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+# Copyright 2015, Institute for Systems Biology.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Indexed, cached bucket listing
+
+Lists bucket prefixes in parallel (name, size, md5, updated and
+generation only) and keeps the result in a local sqlite3 index keyed by
+prefix, so later pattern searches don't page through the bucket again.
+A prefix is relisted when its listing is older than max_age (a day by
+default), or when refresh is asked for.
+
+Example:
+    index = BucketIndex('isb-cgc', 'isb-cgc-open', 'bucket_index.db')
+    files_df = index.search_files(['.sdrf'], re.compile('.*'), prefixes=['tcga/brca/'])
+"""
+import time
+import sqlite3
+import logging
+import threading
+import concurrent.futures
+import pandas as pd
+from google.cloud import storage
+
+log = logging.getLogger(__name__)
+
+# only the fields we keep, for smaller listing responses
+LIST_FIELDS = 'items(name,size,md5Hash,updated,generation),prefixes,nextPageToken'
+
+# seconds before a prefix listing is considered stale
+DEFAULT_MAX_AGE = 24 * 60 * 60
+
+class BucketIndex(object):
+    """Local sqlite3 index of the blobs under a set of bucket prefixes
+    """
+    def __init__(self, project, bucket_name, index_db='bucket_index.db', max_workers=16, max_age=DEFAULT_MAX_AGE):
+        self.project = project
+        self.bucket_name = bucket_name
+        self.index_db = index_db
+        self.max_workers = max_workers
+        # seconds before a prefix listing is considered stale (None: never,
+        # for buckets that don't change)
+        self.max_age = max_age
+        self.local = threading.local()
+        self.conn = sqlite3.connect(index_db, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS listings '
+                          '(bucket TEXT, prefix TEXT, listed_at REAL, PRIMARY KEY (bucket, prefix))')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS blobs '
+                          '(bucket TEXT, prefix TEXT, name TEXT, size INTEGER, md5 TEXT, updated TEXT, generation INTEGER)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS blobs_prefix ON blobs (bucket, prefix, name)')
+        self.conn.commit()
+
+    def get_bucket(self):
+        """Bucket handle for the calling thread (the http clients aren't thread safe)
+        """
+        if not hasattr(self.local, 'bucket'):
+            self.local.bucket = storage.Client(self.project).bucket(self.bucket_name)
+        return self.local.bucket
+
+    def list_level(self, prefix):
+        """Lists one level below the prefix; returns the blobs and the sub-prefixes
+        """
+        iterator = self.get_bucket().list_blobs(prefix=prefix, delimiter='/', fields=LIST_FIELDS)
+        blobs = [self.blob_row(blob) for blob in iterator]
+        return blobs, sorted(iterator.prefixes)
+
+    def list_all(self, prefix):
+        """Lists everything below the prefix
+        """
+        iterator = self.get_bucket().list_blobs(prefix=prefix, fields=LIST_FIELDS)
+        return [self.blob_row(blob) for blob in iterator]
+
+    def blob_row(self, blob):
+        return (blob.name, blob.size, blob.md5_hash, str(blob.updated), blob.generation)
+
+    def walk(self, prefix):
+        """Lists the prefix, fanning out over its sub-prefixes in parallel
+        """
+        blobs, sub_prefixes = self.list_level(prefix)
+        if not sub_prefixes:
+            return blobs
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            for sub_blobs in executor.map(self.list_all, sub_prefixes):
+                blobs.extend(sub_blobs)
+        finally:
+            executor.shutdown()
+        return blobs
+
+    def is_indexed(self, prefix):
+        row = self.conn.execute('SELECT listed_at FROM listings WHERE bucket = ? AND prefix = ?',
+                                (self.bucket_name, prefix)).fetchone()
+        if row is None:
+            return False
+        return self.max_age is None or time.time() - row[0] < self.max_age
+
+    def index_prefix(self, prefix):
+        """(Re)lists the prefix and replaces its rows in the index
+        """
+        log.info('Indexing gs://%s/%s' % (self.bucket_name, prefix))
+        blobs = self.walk(prefix)
+        with self.conn:
+            self.conn.execute('DELETE FROM blobs WHERE bucket = ? AND prefix = ?', (self.bucket_name, prefix))
+            self.conn.executemany('INSERT INTO blobs VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                  ((self.bucket_name, prefix) + blob for blob in blobs))
+            self.conn.execute('INSERT OR REPLACE INTO listings VALUES (?, ?, ?)',
+                              (self.bucket_name, prefix, time.time()))
+        log.info('Indexed {0} blobs under gs://{1}/{2}'.format(len(blobs), self.bucket_name, prefix))
+
+    def refresh(self, prefixes, force=False):
+        """Makes sure the prefixes are in the index; force relists them
+        """
+        for prefix in prefixes:
+            if force or not self.is_indexed(prefix):
+                self.index_prefix(prefix)
+
+    def list_blobs(self, prefixes, name_patterns=[], refresh=False):
+        """Returns the indexed blobs under the prefixes, whose names contain all
+           the name_patterns, as a dataframe (name, size, md5, updated, generation)
+        """
+        self.refresh(prefixes, force=refresh)
+        sql = 'SELECT name, size, md5, updated, generation FROM blobs WHERE bucket = ? AND prefix = ?'
+        # instr is case sensitive, like the python 'in' it replaces
+        for _ in name_patterns:
+            sql += ' AND instr(name, ?) > 0'
+        frames = [pd.read_sql_query(sql, self.conn, params=[self.bucket_name, prefix] + list(name_patterns))
+                  for prefix in prefixes]
+        return pd.concat(frames, ignore_index=True)
+
+    def search_files(self, search_patterns, regex_search_pattern, prefixes=["tcga/"], refresh=False):
+        """Same as GcsConnector.search_files, served from the index
+        """
+        blobs_df = self.list_blobs(prefixes, search_patterns, refresh=refresh)
+        if regex_search_pattern is not None:
+            blobs_df = blobs_df[blobs_df['name'].map(lambda name: regex_search_pattern.match(name) is not None)]
+        files_df = pd.DataFrame({
+            'filename': blobs_df['name'],
+            'size': blobs_df['size'],
+            'timestamp': pd.to_datetime(blobs_df['updated'])
+        })
+        log.info('Found {0} files in the index matching the pattern'.format(len(files_df.index)))
+        return files_df.reset_index(drop=True)
+
+    def close(self):
+        self.conn.close()
@@ -16,11 +16,16 @@
 # -*- coding: utf-8 -*-
 import re
 import json
+import google.auth
 from google.cloud import storage
+from google.auth.transport.requests import AuthorizedSession
+from google.resumable_media.requests import ResumableUpload
 from collections import defaultdict
 import pandas as pd
 import numpy as np
 from StringIO import StringIO
+from io import BytesIO, IOBase
+import gzip
 from os.path import basename
 import sys
 import time
@@ -28,15 +33,59 @@ import logging
 import tempfile
 import chardet
 import traceback
+from urllib import quote
+from bigquery_etl.transform.tools import write_df_as_njson
+from bigquery_etl.extract.bucket_index import BucketIndex
 
 log = logging.getLogger(__name__)
 
+DOWNLOAD_URL = 'https://www.googleapis.com/download/storage/v1/b/{bucket}/o/{blob}?alt=media'
+RESUMABLE_UPLOAD_URL = 'https://www.googleapis.com/upload/storage/v1/b/{bucket}/o?uploadType=resumable'
+# resumable upload chunks must be a multiple of 256 KB
+UPLOAD_CHUNK_SIZE = 32 * 256 * 1024
+
+class BlobStream(IOBase):
+    """The content of a streamed download (a urllib3 response, see
+    GcsConnector.open_blob_stream); raises an IOError at the end of the
+    stream when fewer bytes than the Content-Length came through (the
+    connection was closed early) instead of ending the file there
+    (IOBase makes it file-like for pandas, with readline and iteration)
+    """
+    def __init__(self, raw, content_length=None):
+        self.raw = raw
+        self.content_length = content_length
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = self.raw.read()
+            self.check_complete()
+        else:
+            data = self.raw.read(size)
+            if size and not data:
+                self.check_complete()
+        return data
+
+    def readable(self):
+        return True
+
+    def check_complete(self):
+        # tell() counts the bytes received, before the gzip decoding
+        received = self.raw.tell()
+        if self.content_length is not None and received < self.content_length:
+            raise IOError('truncated download: received %s of %s bytes' % (received, self.content_length))
+
+    def close(self):
+        self.raw.close()
+        super(BlobStream, self).close()
+
 class GcsConnector(object):
     """Google Cloud Storage Connector
     """
     def __init__(self, project, bucket_name, tempdir='/tmp'):
-        # connect to the cloud bucket
-        self.client = storage.Client(project)
+        # connect to the cloud bucket; the credentials are kept for the
+        # authorized session of the streams and uploads (see get_transport)
+        self.credentials, _ = google.auth.default(scopes=storage.Client.SCOPE)
+        self.client = storage.Client(project, credentials=self.credentials)
         retry = 0
         while True:
             try:
@@ -49,6 +98,7 @@ class GcsConnector(object):
                 retry += 1
                 time.sleep(1)
         self.tempdir = tempdir
+        self.transport = None
 
     #--------------------------------------
     # uploads a file to the bucket
@@ -92,6 +142,47 @@ class GcsConnector(object):
         return temp_data_file 
 
 
+    #-------------------------------------------
+    # authorized http session, shared by the
+    # streaming downloads and resumable uploads
+    #-------------------------------------------
+    def get_transport(self):
+        if self.transport is None:
+            self.transport = AuthorizedSession(self.credentials)
+        return self.transport
+
+    #-------------------------------------------
+    # Open the blob as a stream (file-like object)
+    # the content is read from the connection as the
+    # caller consumes it, e.g. by pd.read_table
+    # gzip content-encoding is decoded on the fly
+    # only opening the connection is retried: a read that
+    # fails partway raises (see BlobStream), the caller
+    # reads the file again (gcutils.convert_blob_to_dataframe
+    # falls back to download_blob_to_file)
+    #-------------------------------------------
+    def open_blob_stream(self, blobname):
+        url = DOWNLOAD_URL.format(bucket=self.bucket.name, blob=quote(blobname, safe=''))
+        retry = 0
+        while True:
+            try:
+                response = self.get_transport().get(url, stream=True)
+                if response.status_code == 404:
+                    raise LookupError('No blob found for the key:' + str(blobname))
+                response.raise_for_status()
+                break
+            except LookupError:
+                raise
+            except Exception as e:
+                if 3 == retry:
+                    log.exception('problem opening %s, no more retries' % (blobname))
+                    raise e
+                retry += 1
+                time.sleep(1)
+        response.raw.decode_content = True
+        content_length = response.headers.get('Content-Length')
+        return BlobStream(response.raw, int(content_length) if content_length else None)
+
     #-------------------------------------------
     # create a temp file.
     # this create a Named temp file
@@ -102,8 +193,18 @@ class GcsConnector(object):
 
     #------------------------------------------
     # search files in the bucket by pattern
+    # if index_db is given, the listing is cached in
+    # that sqlite3 file and reused by later searches
+    # (refresh relists the prefixes)
     #------------------------------------------
-    def search_files(self, search_patterns, regex_search_pattern, prefixes=["tcga/"]):
+    def search_files(self, search_patterns, regex_search_pattern, prefixes=["tcga/"], index_db=None, refresh=False):
+        if index_db:
+            index = BucketIndex(self.client.project, self.bucket.name, index_db)
+            try:
+                return index.search_files(search_patterns, regex_search_pattern, prefixes, refresh=refresh)
+            finally:
+                index.close()
+
         files_info = []
         for prefix in prefixes:
             log.info("Searching for files with search patters - {0}, {1}, and prefix - {2}".format(search_patterns, regex_search_pattern.pattern, prefix))
@@ -130,92 +231,141 @@ class GcsConnector(object):
         log.info('Found {0} files in the bucket matching the pattern'.format(len(df.index)))
         return df
 
-    def upload_blob_from_string(self, blobname, df_stringIO, metadata={}):
-        # upload the file
-        upload_blob = storage.blob.Blob(blobname, bucket=self.bucket)
-        tries = 0
+    #----------------------------------------
+    # Upload a file-like object through a resumable upload session
+    # sends chunk_size pieces; after a failure the upload resumes
+    # from the last offset the server acknowledged.
+    # metadata and content encoding go with the session request and
+    # the final upload response confirms the object (no patch/exists calls)
+    #----------------------------------------
+    def upload_from_file_resumable(self, blobname, file_obj, metadata={}, content_type='text/plain',
+                                   content_encoding=None, chunk_size=UPLOAD_CHUNK_SIZE, logparam=None):
+        if logparam:
+            log = logparam
+        else:
+            log = logging.getLogger(__name__)
+
+        self.get_transport()
+
+        object_metadata = {'name': blobname}
+        if metadata:
+            object_metadata['metadata'] = metadata
+        if content_encoding:
+            object_metadata['contentEncoding'] = content_encoding
+        upload_url = RESUMABLE_UPLOAD_URL.format(bucket=self.bucket.name)
+
+        # start the upload session
+        retry = 0
         while True:
             try:
-                upload_blob.upload_from_string(df_stringIO)
+                file_obj.seek(0)
+                upload = ResumableUpload(upload_url, chunk_size)
+                upload.initiate(self.transport, file_obj, object_metadata, content_type)
                 break
             except Exception as e:
-                if 3 == tries:
-                    traceback.print_exc(10)
+                if 3 == retry:
+                    log.exception('problem starting the upload of %s, no more retries' % (blobname))
                     raise e
-                time.sleep(1)
-                tries += 1
-                print '\tretry %s for upload of %s' % (tries, blobname)
+                retry += 1
+                log.warning('problem starting the upload of %s, retry %s: %s' % (blobname, retry, e))
+                time.sleep(2 ** retry)
 
-        # set blob metadata
-        if metadata:
-            log.info("Setting object metadata")
-            upload_blob.metadata = metadata
-            upload_blob.patch()
-
-        # check if the uploaded blob exists. Just a sanity check
-        if upload_blob.exists():
-            log.info("The uploaded file {0} has size {1} bytes.".format(blobname, upload_blob.size))
-            return True
-        else:
-            raise Exception('File upload failed - {0}.'.format(blobname))
+        # send the chunks
+        retry = 0
+        response = None
+        while not upload.finished:
+            try:
+                if upload.invalid:
+                    # asks the server for the acknowledged offset and seeks the file there
+                    upload.recover(self.transport)
+                elif file_obj.tell() != upload.bytes_uploaded:
+                    file_obj.seek(upload.bytes_uploaded)
+                response = upload.transmit_next_chunk(self.transport)
+                retry = 0
+            except Exception as e:
+                if 3 == retry:
+                    log.exception('problem with upload to %s at byte %s, no more retries' % (blobname, upload.bytes_uploaded))
+                    raise e
+                retry += 1
+                log.warning('problem with upload to %s at byte %s, retry %s: %s' % (blobname, upload.bytes_uploaded, retry, e))
+                time.sleep(2 ** retry)
+
+        uploaded = response.json()
+        if int(uploaded['size']) != upload.total_bytes:
+            raise Exception('File upload failed - {0}. Uploaded {1} of {2} bytes.'
+                            .format(blobname, uploaded['size'], upload.total_bytes))
+        log.info("The uploaded file {0} has size {1} bytes.".format(blobname, uploaded['size']))
+        return uploaded
+
+    #----------------------------------------
+    # gzip a file-like object into a temp file
+    # (for content-encoding: gzip uploads)
+    #----------------------------------------
+    def gzip_to_tempfile(self, file_obj):
+        gzip_file = tempfile.TemporaryFile(dir=self.tempdir)
+        file_obj.seek(0)
+        with gzip.GzipFile(fileobj=gzip_file, mode='wb') as gzip_stream:
+            while True:
+                data = file_obj.read(UPLOAD_CHUNK_SIZE)
+                if not data:
+                    break
+                gzip_stream.write(data)
+        return gzip_file
+
+    def upload_blob_from_string(self, blobname, df_stringIO, metadata={}, gzip_encode=False, chunk_size=UPLOAD_CHUNK_SIZE):
+        if isinstance(df_stringIO, unicode):
+            df_stringIO = df_stringIO.encode('utf-8')
+        file_to_upload = BytesIO(df_stringIO)
+        if gzip_encode:
+            file_to_upload = self.gzip_to_tempfile(file_to_upload)
+        try:
+            self.upload_from_file_resumable(blobname, file_to_upload, metadata=metadata,
+                                            content_encoding='gzip' if gzip_encode else None,
+                                            chunk_size=chunk_size)
+        finally:
+            file_to_upload.close()
+        return True
 
-  
     #----------------------------------------
-    # Convert a dataframe into newline-delimited JSON string
-    #  -- should work for a small to medium files
-    # if rollover_file is true
+    # Convert a dataframe into newline-delimited JSON
+    # and upload it to the bucket
+    # the JSON is written in row blocks to a temp file
+    # (never the whole document in memory)
+    # optionally gzip the JSON (content-encoding: gzip)
     # works only in a single bucket
     # set the object metadata
     #----------------------------------------
-    def convert_df_to_njson_and_upload(self, df, destination_blobname, metadata={}, logparam = None):
+    def convert_df_to_njson_and_upload(self, df, destination_blobname, metadata={}, logparam = None, chunksize=10000,
+                                       gzip_encode=False, upload_chunk_size=UPLOAD_CHUNK_SIZE):
         if logparam:
             log = logparam
+        else:
+            log = logging.getLogger(__name__)
         log.info("\t\tConverting dataframe into a new-line delimited JSON file to save as %s" % (destination_blobname))
 
         log.info('\t\t\tstart conversion of %s' % (destination_blobname))
-        file_to_upload = StringIO()
-        
-        # look for datetime columns and convert them to string
-        for column in df.columns:
-            if df[column].dtype == 'datetime64[ns]':
-                df[column] = df[column].apply(str)
-        
+        file_to_upload = tempfile.TemporaryFile(dir=self.tempdir)
         try:
-            log.info('\t\t\t\tconverting dataframe as a whole')
-            df_json = df.convert_objects(convert_numeric=False).to_json(orient = 'records', lines = True) + '\n'
-            log.info('\t\t\t\tconverted dataframe as a whole')
+            if gzip_encode:
+                with gzip.GzipFile(fileobj=file_to_upload, mode='wb') as gzip_stream:
+                    write_df_as_njson(df, gzip_stream, chunksize=chunksize)
+            else:
+                write_df_as_njson(df, file_to_upload, chunksize=chunksize)
+            log.info('\t\t\tconverted dataframe in blocks of %s rows' % (chunksize))
         except:
+            file_to_upload.close()
             log.exception('failed to convert dataframe!')
             raise
-        
-        upload_blob = storage.blob.Blob(destination_blobname, bucket=self.bucket)
-        retry = 0
+
         log.info('\t\t\tstart upload of %s' % (destination_blobname))
-        while True:
-            try:
-                upload_blob.upload_from_string(df_json)
-                break
-            except Exception as e:
-                if 3 == retry:
-                    log.exception('problem with upload to %s, no more retries' % (destination_blobname))
-                    raise e
-                retry += 1
-                log.exception('problem with upload to %s, retry %s' % (destination_blobname, retry))
+        try:
+            self.upload_from_file_resumable(destination_blobname, file_to_upload, metadata=metadata,
+                                            content_encoding='gzip' if gzip_encode else None,
+                                            chunk_size=upload_chunk_size, logparam=log)
+        finally:
+            file_to_upload.close()
         log.info('\t\t\tfinished upload of %s' % (destination_blobname))
-
-        # set blob metadata
-        if metadata:
-            log.info("\t\t\tSetting object metadata")
-            upload_blob.metadata = metadata
-            upload_blob.patch()
-        file_to_upload.close()
-
-        # check if the uploaded blob exists. Just a sanity check
-        if upload_blob.exists():
-            log.info("\t\tThe uploaded file {0} has size {1} bytes.".format(destination_blobname, upload_blob.size))
-            return True
-        else:
-            raise Exception('\t\tFile upload failed - {0}.'.format(destination_blobname)) 
+        return True
      
     def check_blob_exists(self, blob):
         """
@@ -13,49 +13,105 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import hashlib
+import threading
+import concurrent.futures
 from bigquery_etl.extract.utils import convert_file_to_dataframe
 from bigquery_etl.extract.gcloud_wrapper import GcsConnector
 from bigquery_etl.transform.tools import cleanup_dataframe, pd
-from google.cloud import storage
+from bigquery_etl.extract.bucket_index import BucketIndex
  
 #------------------------------------------
 # parse SDRF
 # deprecate this to get info from CloudSQL
 #------------------------------------------
-def get_sdrf_info(project_id, bucket_name, disease_codes, header, set_index_col, search_patterns):
+class SdrfCollector(object):
+    """Downloads and parses SDRF files over a thread pool; the parsed frames
+    are cached in cache_dir by blob generation, so unchanged files are only
+    parsed once
+    """
+    def __init__(self, project_id, bucket_name, set_index_col, max_workers=8, cache_dir='sdrf_cache'):
+        self.project_id = project_id
+        self.bucket_name = bucket_name
+        self.set_index_col = set_index_col
+        self.max_workers = max_workers
+        self.cache_dir = cache_dir
+        self.local = threading.local()
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
 
-    client = storage.Client(project_id)
-    bucket = client.get_bucket(bucket_name)
+    def get_gcs(self):
+        """GcsConnector of the calling thread (the http clients aren't thread safe)
+        """
+        if not hasattr(self.local, 'gcs'):
+            self.local.gcs = GcsConnector(self.project_id, self.bucket_name)
+        return self.local.gcs
 
-    # connect to google cloud storage
-    gcs = GcsConnector(project_id, bucket_name)
+    def cache_path(self, sdrf_filename, generation, disease_code):
+        # the parsed frame also depends on the study and the index column
+        name_hash = hashlib.md5('|'.join([sdrf_filename, disease_code, self.set_index_col])).hexdigest()
+        return os.path.join(self.cache_dir, '{0}_{1}.pkl'.format(name_hash, generation))
 
-    sdrf_info = pd.DataFrame()
-    for disease_code in disease_codes:
-        for blob in bucket.list_blobs(prefix=disease_code):
-            sdrf_filename = blob.name
-            if not all(x in sdrf_filename for x in search_patterns):
-               continue
-            print (sdrf_filename)
+    def parse(self, sdrf_filename, disease_code):
+        print (sdrf_filename)
 
-            filebuffer = gcs.download_blob_to_file(sdrf_filename) 
-            # convert to a dataframe
-            sdrf_df = convert_file_to_dataframe(filebuffer, skiprows=0)
-            
-            sdrf_df = cleanup_dataframe(sdrf_df)
+        filebuffer = self.get_gcs().download_blob_to_file(sdrf_filename)
+        # convert to a dataframe
+        sdrf_df = convert_file_to_dataframe(filebuffer, skiprows=0)
 
-            sdrf_df['Study'] = disease_code
+        sdrf_df = cleanup_dataframe(sdrf_df)
 
-            try:
-               sdrf_df =sdrf_df.set_index(set_index_col)
-            except:
-               sdrf_df =sdrf_df.set_index("Derived_Array_Data_File")
+        sdrf_df['Study'] = disease_code
 
-            sdrf_info = sdrf_info.append(sdrf_df)
+        try:
+           sdrf_df =sdrf_df.set_index(self.set_index_col)
+        except:
+           sdrf_df =sdrf_df.set_index("Derived_Array_Data_File")
+        return sdrf_df
 
-    print ("Done loading SDRF files.")
-    return sdrf_info
+    def get(self, sdrf_filename, generation, disease_code):
+        """Parsed SDRF, from the cache when the blob generation didn't change
+        """
+        if not self.cache_dir:
+            return self.parse(sdrf_filename, disease_code)
+        path = self.cache_path(sdrf_filename, generation, disease_code)
+        if os.path.exists(path):
+            return pd.read_pickle(path)
+        sdrf_df = self.parse(sdrf_filename, disease_code)
+        # written aside and renamed, a concurrent run never reads a partial file
+        sdrf_df.to_pickle(path + '.tmp')
+        os.rename(path + '.tmp', path)
+        return sdrf_df
+
+    def collect(self, sdrf_files):
+        """sdrf_files: (filename, generation, disease code) tuples;
+           returns the SDRF frames concatenated, in the same order
+        """
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            sdrf_dfs = list(executor.map(lambda args: self.get(*args), sdrf_files))
+        finally:
+            executor.shutdown()
+        if not sdrf_dfs:
+            return pd.DataFrame()
+        return pd.concat(sdrf_dfs)
 
+def get_sdrf_info(project_id, bucket_name, disease_codes, header, set_index_col, search_patterns,
+                  index_db='bucket_index.db', max_workers=8, cache_dir='sdrf_cache', refresh=False):
 
+    # the bucket listing is cached in index_db for the next runs (refresh relists it)
+    index = BucketIndex(project_id, bucket_name, index_db)
 
+    sdrf_files = []
+    for disease_code in disease_codes:
+        sdrf_blobs = index.list_blobs([disease_code], search_patterns, refresh=refresh)
+        for sdrf_filename, generation in zip(sdrf_blobs['name'], sdrf_blobs['generation']):
+            sdrf_files.append((sdrf_filename, generation, disease_code))
+    index.close()
+
+    collector = SdrfCollector(project_id, bucket_name, set_index_col, max_workers, cache_dir)
+    sdrf_info = collector.collect(sdrf_files)
 
+    print ("Done loading SDRF files.")
+    return sdrf_info
@@ -23,9 +23,13 @@ import logging
 
 log = logging.getLogger(__name__)
 
-def convert_file_to_dataframe(filepath_or_buffer, sep="\t", skiprows=0, rollover=False, nrows=None, header = 'infer'):
+def convert_file_to_dataframe(filepath_or_buffer, sep="\t", skiprows=0, rollover=False, nrows=None, header = 'infer',
+                              usecols=None, chunksize=None):
     """does some required data cleaning and
       then converts into a dataframe
+      usecols: only parse these columns
+      chunksize: returns an iterator of dataframes of chunksize rows;
+        the caller closes the buffer when done
     """
 
     log.info("Converting  file to a dataframe")
@@ -38,12 +42,16 @@ def convert_file_to_dataframe(filepath_or_buffer, sep="\t", skiprows=0, rollover
         # read the table/file
         data_df = pd.read_table(filepath_or_buffer, sep=sep, skiprows=skiprows, lineterminator='\n',
                                 comment='#', na_values=na_values, dtype='object', nrows=nrows, header = header,
-                                encoding='utf-8')
+                                encoding='utf-8', usecols=usecols, chunksize=chunksize)
 
     except Exception as exp:
         log.exception('problem converting to dataframe: %s' % (exp.message))
         raise
 
+    if chunksize:
+        # the buffer is still being read by the iterator
+        return data_df
+
     filepath_or_buffer.close() # close  StringIO
 
     return data_df
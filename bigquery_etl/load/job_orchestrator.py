@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+# Copyright 2015, Institute for Systems Biology.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Submit and poll loop shared by the BigQuery job orchestrators
+
+JobOrchestrator keeps up to max_concurrent jobs running with one client
+and a single poller, backing off exponentially while nothing changes.
+Subclasses (QueryOrchestrator, LoadOrchestrator) decide which jobs to
+submit next (submit_ready, through insert_job) and what a finished job
+means (job_done).
+"""
+import time
+import uuid
+import logging
+from googleapiclient import discovery
+from googleapiclient.errors import HttpError
+from oauth2client.client import GoogleCredentials
+
+log = logging.getLogger(__name__)
+
+def new_job_id(prefix):
+    """A job id of our own, so a retried insert doesn't run the job twice
+    """
+    return prefix + '_' + str(uuid.uuid4()).replace('-', '_')
+
+class JobOrchestrator(object):
+    """Runs BigQuery jobs concurrently, with one client and one poller
+    """
+    def __init__(self, project_id, bigquery=None, max_concurrent=10, min_poll_interval=1,
+                 max_poll_interval=30, num_retries=5, log=log, sleep=time.sleep):
+        if bigquery is None:
+            credentials = GoogleCredentials.get_application_default()
+            bigquery = discovery.build('bigquery', 'v2', credentials=credentials)
+        self.bigquery = bigquery
+        self.project_id = project_id
+        self.max_concurrent = max_concurrent
+        self.min_poll_interval = min_poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.num_retries = num_retries
+        self.log = log
+        # time.sleep, or the clock of a fake job service
+        self.sleep = sleep
+        # job id -> what the subclass tracks for the job
+        self.running = {}
+
+    def has_capacity(self):
+        return len(self.running) < self.max_concurrent
+
+    def insert_job(self, body, item):
+        """Inserts the job (body has its own jobReference.jobId) and tracks it
+           as running with item; returns False when it could not be submitted
+        """
+        job_id = body['jobReference']['jobId']
+        try:
+            self.bigquery.jobs().insert(projectId=self.project_id, body=body)\
+                                .execute(num_retries=self.num_retries)
+        except HttpError as err:
+            if err.resp.status != 409:
+                self.log.error('could not submit job %s: %s' % (job_id, err.content))
+                return False
+            # the insert went through but its response was lost, and the
+            # retry found the job already there: it is ours, track it
+            try:
+                self.bigquery.jobs().get(projectId=self.project_id, jobId=job_id)\
+                                    .execute(num_retries=self.num_retries)
+            except HttpError as err:
+                self.log.error('could not submit job %s: %s' % (job_id, err.content))
+                return False
+            self.log.info('\tjob %s already exists, tracking it' % (job_id))
+        self.running[job_id] = item
+        return True
+
+    def submit_ready(self):
+        """Submits jobs (insert_job) until max_concurrent are running; returns the number submitted
+        """
+        raise NotImplementedError
+
+    def job_done(self, job_id, item, status):
+        """Called once per finished job with its final status
+        """
+        raise NotImplementedError
+
+    def poll_running(self):
+        """Checks all the running jobs once; returns the number that finished
+        """
+        finished = 0
+        for job_id in list(self.running):
+            try:
+                result = self.bigquery.jobs().get(projectId=self.project_id, jobId=job_id)\
+                                             .execute(num_retries=self.num_retries)
+            except HttpError as err:
+                # the job keeps running; try again on the next poll
+                self.log.warning('\tcould not get the status of job %s: %s' % (job_id, err.content))
+                continue
+            status = result['status']
+            if status['state'] != 'DONE':
+                for error in status.get('errors') or []:
+                    self.log.warning('\terror while running job %s: %s' % (job_id, error))
+                continue
+            item = self.running.pop(job_id)
+            finished += 1
+            self.job_done(job_id, item, status)
+        return finished
+
+    def run_jobs(self):
+        """Submits and polls until all the jobs are done
+        """
+        poll_interval = self.min_poll_interval
+        self.submit_ready()
+        while self.running:
+            self.sleep(poll_interval)
+            changed = self.poll_running()
+            changed += self.submit_ready()
+            if changed:
+                poll_interval = self.min_poll_interval
+            else:
+                poll_interval = min(poll_interval * 2, self.max_poll_interval)
+                self.log.info('\twaiting for %s running jobs...' % (len(self.running)))
@@ -38,34 +38,23 @@ from googleapiclient import discovery
 from oauth2client.client import GoogleCredentials
 
 # [START load_table]
-def load_table(bigquery, project_id, dataset_id, table_name, source_schema,
-               source_path, source_format='NEWLINE_DELIMITED_JSON', num_retries=5, write_disposition='WRITE_EMPTY'):
+def load_job_data(project_id, dataset_id, table_name, source_schema, source_path,
+                  source_format='NEWLINE_DELIMITED_JSON', write_disposition='WRITE_EMPTY', job_id=None):
     """
-    Starts a job to load a bigquery table from CSV
-
-    Args:
-        bigquery: an initialized and authorized bigquery client
-        google-api-client object
-        source_schema: a valid bigquery schema,
-        see https://cloud.google.com/bigquery/docs/reference/v2/tables
-        source_csv: the fully qualified Google Cloud Storage location of
-        the data to load into your table
-
-    Returns: a bigquery load job, see
-    https://cloud.google.com/bigquery/docs/reference/v2/jobs#configuration.load
+    The body of a job loading a bigquery table from source_path (a
+    Google Cloud Storage location or a list of them); see load_table
     """
-
     # Generate a unique job_id so retries
     # don't accidentally duplicate query
     job_data = {
         'jobReference': {
             'projectId': project_id,
-            'job_id': str(uuid.uuid4())
+            'jobId': job_id or str(uuid.uuid4())
         },
         'configuration': {
             'load': {
                 'sourceFormat' : source_format,
-                'sourceUris': [source_path],
+                'sourceUris': source_path if isinstance(source_path, list) else [source_path],
                 'schema': {
                     'fields': source_schema
                 },
@@ -80,6 +69,26 @@ def load_table(bigquery, project_id, dataset_id, table_name, source_schema,
             }
         }
     }
+    return job_data
+
+def load_table(bigquery, project_id, dataset_id, table_name, source_schema,
+               source_path, source_format='NEWLINE_DELIMITED_JSON', num_retries=5, write_disposition='WRITE_EMPTY'):
+    """
+    Starts a job to load a bigquery table from CSV
+
+    Args:
+        bigquery: an initialized and authorized bigquery client
+        google-api-client object
+        source_schema: a valid bigquery schema,
+        see https://cloud.google.com/bigquery/docs/reference/v2/tables
+        source_path: the fully qualified Google Cloud Storage location of
+        the data to load into your table, or a list of them
+
+    Returns: a bigquery load job, see
+    https://cloud.google.com/bigquery/docs/reference/v2/jobs#configuration.load
+    """
+    job_data = load_job_data(project_id, dataset_id, table_name, source_schema, source_path,
+                             source_format, write_disposition)
     
     return bigquery.jobs().insert(
         projectId=project_id,
@@ -137,17 +146,36 @@ def __check_contents(data_path, project_id, batch_count):
         check_count += 1
 
 def run(project_id, batch_count, dataset_id, table_name, schema_file, data_path,
-         source_format='NEWLINE_DELIMITED_JSON', write_disposition='WRITE_EMPTY', num_retries=5, poll_interval=1):
+         source_format='NEWLINE_DELIMITED_JSON', write_disposition='WRITE_EMPTY', num_retries=5, poll_interval=1,
+         manifest=None):
+    """
+    manifest: list of the gs:// uris the transform stage produced (or a file
+        with one uri per line); when given, the uris are loaded directly
+        (in as many concurrent jobs as needed) instead of waiting for
+        batch_count files to show up under data_path
+    """
     # [START build_service]
     # Grab the application's default credentials from the environment.
     credentials = GoogleCredentials.get_application_default()
 
-    __check_contents(data_path, project_id, batch_count)
-    
     # Construct the service object for interacting with the BigQuery API.
     bigquery = discovery.build('bigquery', 'v2', credentials=credentials)
     # [END build_service]
 
+    if manifest is not None:
+        # imported here, load_orchestrator imports this module
+        from bigquery_etl.load.load_orchestrator import LoadOrchestrator, read_manifest
+        if isinstance(manifest, basestring):
+            manifest = read_manifest(manifest)
+        orchestrator = LoadOrchestrator(project_id, bigquery, num_retries=num_retries)
+        orchestrator.add_load(dataset_id, table_name, schema_file, manifest, source_format, write_disposition)
+        failed = orchestrator.run()
+        if failed:
+            raise RuntimeError(json.dumps(failed, indent=4))
+        return
+
+    __check_contents(data_path, project_id, batch_count)
+
     with open(schema_file, 'r') as f:
         schema = json.load(f)
 
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+# Copyright 2015, Institute for Systems Biology.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Concurrent BigQuery load orchestration
+
+Loads tables from an explicit manifest of the blobs the transform stage
+produced (no waiting for a bucket listing to reach an expected count).
+The URIs of a table are split into jobs of at most max_uris_per_job,
+many load jobs run at the same time, and a single poller tracks all of
+them, backing off exponentially while nothing changes. A failed job
+doesn't stop the others; the failures are reported once all the jobs
+are done.
+
+Example:
+    orchestrator = LoadOrchestrator(project_id, max_concurrent=20)
+    orchestrator.add_load('tcga_data', 'Protein', 'schemas/protein.json',
+                          read_manifest('etl-protein.manifest'))
+    orchestrator.add_load('tcga_data', 'Methylation', 'schemas/methylation.json',
+                          read_manifest('etl-methylation.manifest'), source_format='CSV')
+    failed = orchestrator.run()
+"""
+import json
+import time
+import logging
+from collections import deque
+from bigquery_etl.load.job_orchestrator import JobOrchestrator, new_job_id
+from bigquery_etl.load.load_data_from_file import load_job_data
+
+log = logging.getLogger(__name__)
+
+# limit of source URIs per BigQuery load job
+MAX_SOURCE_URIS = 10000
+
+def read_manifest(manifest_file, prefix=''):
+    """Reads a manifest: one gs:// URI per line; only the URIs that start
+    with prefix (a string or a tuple of them)
+    """
+    with open(manifest_file) as manifest:
+        uris = [line.strip() for line in manifest if line.strip()]
+    return [uri for uri in uris if uri.startswith(prefix)]
+
+def write_manifest(manifest_file, uris):
+    """Writes the URIs of the produced blobs, one per line
+    """
+    with open(manifest_file, 'w') as manifest:
+        for uri in uris:
+            manifest.write(uri + '\n')
+
+class TableLoad(object):
+    """The load jobs of one table; the first job runs with the requested
+    write disposition, the remaining batches append once it is done
+    """
+    def __init__(self, dataset_id, table_name, schema, uri_batches, source_format, write_disposition):
+        self.dataset_id = dataset_id
+        self.table_name = table_name
+        self.schema = schema
+        self.source_format = source_format
+        self.write_disposition = write_disposition
+        self.pending = deque(uri_batches)
+        self.first_done = False
+        self.running = 0
+        # descriptions of the failed jobs
+        self.errors = []
+
+    def name(self):
+        return '%s.%s' % (self.dataset_id, self.table_name)
+
+    def fail(self, error):
+        """Records the error; when the first job failed, the table was not
+        created (or not emptied) as asked, the other batches are dropped
+        """
+        self.errors.append(error)
+        if not self.first_done:
+            self.pending.clear()
+
+    def ready_batches(self):
+        """Number of batches that can be submitted now"""
+        if not self.first_done:
+            return 1 if self.pending and self.running == 0 else 0
+        return len(self.pending)
+
+    def next_disposition(self):
+        if self.first_done:
+            return 'WRITE_APPEND'
+        return self.write_disposition
+
+class LoadOrchestrator(JobOrchestrator):
+    """Runs the load jobs of many tables concurrently
+    """
+    def __init__(self, project_id, bigquery=None, max_concurrent=10, max_uris_per_job=MAX_SOURCE_URIS,
+                 min_poll_interval=1, max_poll_interval=30, num_retries=5, log=log, sleep=time.sleep):
+        super(LoadOrchestrator, self).__init__(project_id, bigquery, max_concurrent, min_poll_interval,
+                                               max_poll_interval, num_retries, log, sleep)
+        self.max_uris_per_job = max_uris_per_job
+        self.table_loads = []
+
+    def add_load(self, dataset_id, table_name, schema_file, uris,
+                 source_format='NEWLINE_DELIMITED_JSON', write_disposition='WRITE_EMPTY'):
+        """Adds a table to load from the manifest uris
+        """
+        if not uris:
+            raise ValueError('no source uris to load into %s.%s' % (dataset_id, table_name))
+        with open(schema_file, 'r') as f:
+            schema = json.load(f)
+        uri_batches = [uris[start:start + self.max_uris_per_job]
+                       for start in range(0, len(uris), self.max_uris_per_job)]
+        self.log.info('%s.%s: %s uris in %s load jobs' % (dataset_id, table_name, len(uris), len(uri_batches)))
+        self.table_loads.append(TableLoad(dataset_id, table_name, schema, uri_batches,
+                                          source_format, write_disposition))
+
+    def submit_ready(self):
+        """Submits jobs until max_concurrent are running; returns the number submitted
+        """
+        submitted = 0
+        for table_load in self.table_loads:
+            for _ in range(table_load.ready_batches()):
+                if not self.has_capacity():
+                    return submitted
+                uris = table_load.pending.popleft()
+                body = load_job_data(self.project_id, table_load.dataset_id, table_load.table_name,
+                                     table_load.schema, uris, table_load.source_format,
+                                     table_load.next_disposition(), new_job_id('load'))
+                if not self.insert_job(body, (table_load, len(uris))):
+                    table_load.fail('could not submit a load job of %s uris' % (len(uris)))
+                    break
+                table_load.running += 1
+                submitted += 1
+        return submitted
+
+    def job_done(self, job_id, item, status):
+        table_load, uri_count = item
+        table_load.running -= 1
+        if 'errorResult' in status:
+            self.log.error('load job %s for %s failed: %s' % (job_id, table_load.name(),
+                           json.dumps(status.get('errors'), indent=4)))
+            table_load.fail('load job %s of %s uris: %s' % (job_id, uri_count, status['errorResult']))
+            return
+        table_load.first_done = True
+        self.log.info('load job %s for %s done (%s uris)' % (job_id, table_load.name(), uri_count))
+
+    def run(self):
+        """Submits and polls until all the jobs are done; returns
+        {table name: [errors]} of the tables that failed
+        """
+        self.run_jobs()
+        failed = dict((table_load.name(), table_load.errors) for table_load in self.table_loads
+                      if table_load.errors)
+        for name, errors in failed.iteritems():
+            self.log.error('loading %s failed:\n\t%s' % (name, '\n\t'.join(errors)))
+        self.log.info('loaded %s tables, %s failed' % (len(self.table_loads) - len(failed), len(failed)))
+        return failed
+
+def load_from_manifest(project_id, manifest, loads, bigquery=None, max_concurrent=10, num_retries=5, log=log):
+    """Loads the tables from the URIs of the manifest written by the transform
+    stage (the file, or its list of URIs), all in one orchestrator; loads is a
+    list of (dataset_id, table_name, schema_file, uri prefix, source_format,
+    write_disposition), each table gets the URIs of the manifest under its
+    prefix (a string or a tuple of them).
+    Raises a RuntimeError listing the failed tables once all the jobs are done
+    """
+    if isinstance(manifest, basestring):
+        manifest = read_manifest(manifest)
+    orchestrator = LoadOrchestrator(project_id, bigquery, max_concurrent, num_retries=num_retries, log=log)
+    for dataset_id, table_name, schema_file, prefix, source_format, write_disposition in loads:
+        uris = [uri for uri in manifest if uri.startswith(prefix)]
+        if not uris:
+            log.warning('no uris under %s in the manifest, not loading %s.%s' % (prefix, dataset_id, table_name))
+            continue
+        orchestrator.add_load(dataset_id, table_name, schema_file, uris, source_format, write_disposition)
+    failed = orchestrator.run()
+    if failed:
+        raise RuntimeError('load failed for %s' % (', '.join(sorted(failed))))
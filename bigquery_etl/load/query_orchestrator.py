@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+# Copyright 2015, Institute for Systems Biology.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Concurrent BigQuery query jobs into destination tables
+
+Runs many queries (e.g. the per-chromosome splits of the methylation
+table) with one BigQuery client: up to max_concurrent jobs run at the
+same time and a single poller tracks all of them, backing off
+exponentially while nothing changes. A failed job is logged and
+reported, the other jobs keep running.
+
+Example:
+    orchestrator = QueryOrchestrator(project_id, max_concurrent=12)
+    for chromosome in chromosomes:
+        orchestrator.add_query('chr' + chromosome, query.format(chromosome),
+                               'tcga_data', 'Methylation_chr' + chromosome)
+    failed = orchestrator.run()
+"""
+import json
+import time
+import logging
+from collections import deque
+from bigquery_etl.load.job_orchestrator import JobOrchestrator, new_job_id
+
+log = logging.getLogger(__name__)
+
+class QueryJob(object):
+    """A query whose results go to a destination table
+    """
+    def __init__(self, name, query, dataset_id, table_id, use_legacy_sql=True,
+                 write_disposition='WRITE_EMPTY', create_disposition='CREATE_IF_NEEDED'):
+        self.name = name
+        self.query = query
+        self.dataset_id = dataset_id
+        self.table_id = table_id
+        self.use_legacy_sql = use_legacy_sql
+        self.write_disposition = write_disposition
+        self.create_disposition = create_disposition
+        self.job_id = None
+        self.status = None
+
+    def job_data(self, project_id):
+        # a job id of our own, so a retried insert doesn't run the query twice
+        self.job_id = new_job_id('query')
+        return {
+            'jobReference': {
+                'projectId': project_id,
+                'jobId': self.job_id
+            },
+            'configuration': {
+                'query': {
+                    'query': self.query,
+                    'useQueryCache': False,
+                    'useLegacySql': self.use_legacy_sql,
+                    'destinationTable': {
+                        'projectId': project_id,
+                        'datasetId': self.dataset_id,
+                        'tableId': self.table_id
+                    },
+                    'createDisposition': self.create_disposition,
+                    'writeDisposition': self.write_disposition,
+                    'allowLargeResults': True
+                }
+            }
+        }
+
+class QueryOrchestrator(JobOrchestrator):
+    """Runs query jobs concurrently, with one client and one poller
+    """
+    def __init__(self, project_id, bigquery=None, max_concurrent=12, min_poll_interval=1,
+                 max_poll_interval=30, num_retries=5, log=log, sleep=time.sleep):
+        super(QueryOrchestrator, self).__init__(project_id, bigquery, max_concurrent, min_poll_interval,
+                                                max_poll_interval, num_retries, log, sleep)
+        self.pending = deque()
+        self.done = []
+        self.failed = []
+
+    def add_query(self, name, query, dataset_id, table_id, use_legacy_sql=True, write_disposition='WRITE_EMPTY'):
+        """Adds a query to run into dataset_id.table_id
+        """
+        self.pending.append(QueryJob(name, query, dataset_id, table_id, use_legacy_sql, write_disposition))
+
+    def submit_ready(self):
+        """Submits jobs until max_concurrent are running; returns the number submitted
+        """
+        submitted = 0
+        while self.pending and self.has_capacity():
+            query_job = self.pending.popleft()
+            self.log.info('submitting %s into %s.%s\n%s' % (query_job.name, query_job.dataset_id,
+                          query_job.table_id, query_job.query))
+            if not self.insert_job(query_job.job_data(self.project_id), query_job):
+                self.log.error('could not submit %s' % (query_job.name))
+                self.failed.append(query_job)
+                continue
+            submitted += 1
+        return submitted
+
+    def job_done(self, job_id, query_job, status):
+        query_job.status = status
+        if status.get('errorResult'):
+            self.log.error('job %s for %s failed: %s' % (job_id, query_job.name,
+                           json.dumps(status['errorResult'], indent=4)))
+            self.failed.append(query_job)
+        else:
+            self.log.info('completed %s into %s.%s' % (query_job.name, query_job.dataset_id, query_job.table_id))
+            self.done.append(query_job)
+
+    def run(self):
+        """Submits and polls until all the jobs are done; returns the names of the failed jobs
+        """
+        self.run_jobs()
+        self.log.info('%s query jobs done, %s failed' % (len(self.done), len(self.failed)))
+        return [query_job.name for query_job in self.failed]
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+# Copyright 2015, Institute for Systems Biology.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark cleanup_dataframe against the previous cell-by-cell version
+on a methylation sized frame (485k probes); checks the outputs are identical
+
+usage: python -m bigquery_etl.tests.benchmark_cleanup_dataframe [num_rows]
+"""
+import sys
+import time
+import logging
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from bigquery_etl.transform.tools import cleanup_dataframe
+
+log = logging.getLogger(__name__)
+
+def cleanup_dataframe_applymap(df):
+    """The previous implementation of cleanup_dataframe (reference)
+    """
+    df = df.applymap(lambda x: np.nan if isinstance(x, basestring) and x.isspace() else x)
+    df = df.fillna("_mv_")
+    # the result of this one was discarded, but it still ran on every cell
+    df.replace(r'((^[\s"\'])|([\s"\']$))', '', regex=True)
+    df = df.replace(r'_mv_', np.nan)
+
+    replace_column_strings = OrderedDict((
+        (" ", "_"),
+        ("-", "_"),
+        (")", ""),
+        ("(", "_"),
+        ("+", "_"),
+        (".", "_"),
+        ("__", "_")
+    ))
+    df.columns = df.columns.map(lambda x: x.strip())
+    for repl in replace_column_strings:
+        df.columns = df.columns.map(lambda x: x.replace(repl, replace_column_strings[repl]))
+    return df
+
+def methylation_frame(num_rows):
+    """Builds a frame shaped like a level 3 methylation file, read as objects
+    """
+    random = np.random.RandomState(0)
+    beta_values = pd.Series(random.rand(num_rows)).map(str)
+    beta_values[random.rand(num_rows) < 0.05] = np.nan
+    gene_symbols = pd.Series(['GENE%d' % (n) for n in random.randint(0, 20000, num_rows)])
+    gene_symbols[random.rand(num_rows) < 0.1] = ' '
+    return pd.DataFrame(OrderedDict((
+        ('Composite Element REF', ['cg%08d' % (n) for n in range(num_rows)]),
+        ('Beta_value', beta_values),
+        ('Gene_Symbol', gene_symbols),
+        ('Chromosome', pd.Series(random.randint(1, 23, num_rows)).map(str)),
+        ('Genomic_Coordinate', pd.Series(random.randint(1, 10 ** 8, num_rows)).map(str)),
+    )), dtype='object')
+
+def timeit(f, df):
+    start = time.time()
+    result = f(df)
+    return result, time.time() - start
+
+def main(num_rows=485577):
+    data_df = methylation_frame(num_rows)
+    print 'frame: %s rows, %s cells' % (len(data_df), data_df.size)
+
+    reference_df, reference_time = timeit(cleanup_dataframe_applymap, data_df)
+    cleaned_df, cleaned_time = timeit(lambda df: cleanup_dataframe(df, log), data_df)
+
+    pd.util.testing.assert_frame_equal(reference_df, cleaned_df)
+    print 'applymap version:   %.2fs' % (reference_time)
+    print 'vectorized version: %.2fs (%.1fx)' % (cleaned_time, reference_time / cleaned_time)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+# Copyright 2015, Institute for Systems Biology.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark the per-file transform (casts, formatting and serialization) of
+methylation (485k probes, CSV) and CNV (NDJSON) against the previous
+per-value lambdas; checks the outputs are byte identical
+
+The specs are the ones of tcga_etl_pipeline/methylation/transform.py and
+tcga_etl_pipeline/cnv/transform.py.
+
+usage: python -m bigquery_etl.tests.benchmark_numeric_formatting [num_rows]
+"""
+import sys
+import time
+import numpy as np
+import pandas as pd
+from bigquery_etl.transform.transform_spec import TransformSpec, tcga_metadata_columns
+from bigquery_etl.transform.tools import convert_df_to_njson
+
+metadata = {
+    'AliquotBarcode': 'TCGA-02-0001-01C-01D-0186-05', 'SampleBarcode': 'TCGA-02-0001-01C',
+    'ParticipantBarcode': 'TCGA-02-0001', 'Study': 'gbm', 'SampleTypeLetterCode': 'TP',
+    'Platform': 'HumanMethylation450', 'Pipeline': 'cnv', 'DataCenterName': 'broad.mit.edu'
+}
+
+methylation_columns = ['Probe_Id', 'Beta_Value', 'Gene_Symbol', 'Chromosome', 'Genomic_Coordinate']
+methylation_output_columns = ['ParticipantBarcode', 'SampleBarcode', 'SampleTypeLetterCode',
+                              'AliquotBarcode', 'Platform', 'Study', 'Probe_Id', 'Beta_Value']
+
+methylation_spec = TransformSpec(
+    'methylation', skiprows=1, columns=methylation_columns,
+    notnull=['Beta_Value'], casts=[('Beta_Value', '%.2f')],
+    metadata_columns=tcga_metadata_columns[:6], output_columns=methylation_output_columns,
+    output_format='CSV', float_format='%.2f')
+
+cnv_spec = TransformSpec(
+    'cnv', casts=[('Segment_Mean', '%.4f'), ('Num_Probes', '%d'), ('Start', '%d'), ('End', '%d')])
+
+#------------------------------------------
+# previous implementations (reference)
+#------------------------------------------
+def add_metadata(data_df, metadata_columns):
+    for column, key, function in metadata_columns:
+        data_df[column] = function(metadata[key]) if function else metadata[key]
+    return data_df
+
+def methylation_lambdas(data_df):
+    data_df.columns = methylation_columns
+    data_df = add_metadata(data_df, tcga_metadata_columns[:6])
+    data_df = data_df[data_df.Beta_Value.notnull()]
+    data_df.loc[:, "Beta_Value"] = data_df["Beta_Value"]\
+                           .map(lambda beta_value: "{0:.2f}".format(float(beta_value)))
+    data_df = data_df[methylation_output_columns]
+    return data_df.to_csv(index=False, header=False, float_format='%.2f')
+
+def cnv_lambdas(data_df):
+    data_df['Segment_Mean'] = data_df['Segment_Mean'].map(lambda x: "{0:.4f}".format(float(x)))
+    data_df['Num_Probes'] = data_df['Num_Probes'].map(lambda x: str(int(float(x))))
+    data_df['Start'] = data_df['Start'].map(lambda x: str(int(float(x))))
+    data_df['End'] = data_df['End'].map(lambda x: str(int(float(x))))
+    data_df = add_metadata(data_df, tcga_metadata_columns)
+    return convert_df_to_njson(data_df)
+
+#------------------------------------------
+# frames shaped like the parsed files (objects, as read)
+#------------------------------------------
+def methylation_frame(num_rows):
+    random = np.random.RandomState(0)
+    beta_values = pd.Series(random.rand(num_rows)).map(str)
+    beta_values[random.rand(num_rows) < 0.05] = np.nan
+    return pd.DataFrame({
+        0: ['cg%08d' % (n) for n in range(num_rows)],
+        1: beta_values,
+        2: ['GENE%d' % (n) for n in random.randint(0, 20000, num_rows)],
+        3: pd.Series(random.randint(1, 23, num_rows)).map(str),
+        4: pd.Series(random.randint(1, 10 ** 8, num_rows)).map(str)
+    }, columns=range(5), dtype='object')
+
+def cnv_frame(num_rows):
+    random = np.random.RandomState(0)
+    starts = random.randint(1, 10 ** 8, num_rows)
+    return pd.DataFrame({
+        'Sample': metadata['SampleBarcode'],
+        'Chromosome': pd.Series(random.randint(1, 23, num_rows)).map(str),
+        'Start': pd.Series(starts).map(str),
+        'End': pd.Series(starts + random.randint(1, 10 ** 6, num_rows)).map(lambda end: '%.1f' % (end)),
+        'Num_Probes': pd.Series(random.randint(1, 5000, num_rows)).map(str),
+        'Segment_Mean': pd.Series(random.randn(num_rows)).map(str)
+    }, columns=['Sample', 'Chromosome', 'Start', 'End', 'Num_Probes', 'Segment_Mean'], dtype='object')
+
+def timeit(f, df):
+    start = time.time()
+    result = f(df.copy())
+    return result, time.time() - start
+
+def compare(name, reference, engine, data_df):
+    reference_output, reference_time = timeit(reference, data_df)
+    engine_output, engine_time = timeit(engine, data_df)
+    assert reference_output == engine_output, '%s outputs differ' % (name)
+    print '%s (%s rows, %s bytes of output, identical)' % (name, len(data_df), len(engine_output))
+    print '\tper-value lambdas: %.2fs' % (reference_time)
+    print '\tvectorized:        %.2fs (%.1fx)' % (engine_time, reference_time / engine_time)
+
+def main(num_rows=485577):
+    compare('methylation', methylation_lambdas,
+            lambda df: methylation_spec.to_csv(methylation_spec.apply(df, metadata)),
+            methylation_frame(num_rows))
+    compare('cnv', cnv_lambdas,
+            lambda df: convert_df_to_njson(cnv_spec.apply(df, metadata)),
+            cnv_frame(num_rows // 20))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+# Copyright 2015, Institute for Systems Biology.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Local fake of the BigQuery jobs service, to run the job orchestration offline
+
+FakeBigQuery answers jobs().insert() and jobs().get() like the discovery
+client; a job is RUNNING for its duration on a FakeClock, then DONE (with
+an errorResult for the failing jobs). The clock only moves when the
+orchestrator sleeps, so a run of hours of jobs takes milliseconds.
+Inserting a job id twice is a 409 (already exists), and the response of
+the first insert of a lost_inserts table is lost (a 503, retried by
+execute like the discovery client does), so that retry gets the 409.
+
+Run as a script, it splits a methylation table into the 24 chromosome
+tables through the QueryOrchestrator and compares the (simulated) time
+with the sequential split.
+
+usage: python -m bigquery_etl.tests.fake_bigquery [max_concurrent]
+"""
+import sys
+import json
+import logging
+import numpy as np
+from googleapiclient.errors import HttpError
+from bigquery_etl.load.query_orchestrator import QueryOrchestrator
+
+log = logging.getLogger(__name__)
+
+class FakeClock(object):
+    """Time that advances only on sleep()
+    """
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+class FakeResponse(dict):
+    """The http response of an HttpError (an httplib2.Response)
+    """
+    def __init__(self, status, reason):
+        self.status = status
+        self.reason = reason
+
+def http_error(status, reason, message):
+    return HttpError(FakeResponse(status, reason),
+                     json.dumps({'error': {'code': status, 'message': message}}))
+
+def destination_table(body):
+    """tableId of the destination of a query or load job
+    """
+    job_type, configuration = body['configuration'].items()[0]
+    return configuration['destinationTable']['tableId']
+
+class FakeRequest(object):
+    def __init__(self, response):
+        self.response = response
+
+    def execute(self, num_retries=0):
+        # like the discovery client, server errors are retried
+        for attempt in range(num_retries + 1):
+            try:
+                return self.response()
+            except HttpError as err:
+                if err.resp.status < 500 or attempt == num_retries:
+                    raise
+
+class FakeJobs(object):
+    def __init__(self, service):
+        self.service = service
+
+    def insert(self, projectId, body):
+        return FakeRequest(lambda: self.service.insert_job(projectId, body))
+
+    def get(self, projectId, jobId):
+        return FakeRequest(lambda: self.service.get_job(projectId, jobId))
+
+class FakeBigQuery(object):
+    """The jobs service: duration(body) gives the seconds a job runs,
+       the jobs whose destination table is in failing_tables end with an error,
+       the first insert into a table of lost_inserts starts the job but fails
+    """
+    def __init__(self, clock, duration=lambda body: 60, failing_tables=(), lost_inserts=()):
+        self.clock = clock
+        self.duration = duration
+        self.failing_tables = set(failing_tables)
+        self.lost_inserts = set(lost_inserts)
+        # job id -> (body, start, end)
+        self.jobs_by_id = {}
+        self.insert_calls = 0
+        self.get_calls = 0
+        self.max_running = 0
+
+    def jobs(self):
+        return FakeJobs(self)
+
+    def running_count(self):
+        now = self.clock.time()
+        return sum(1 for body, start, end in self.jobs_by_id.itervalues() if start <= now < end)
+
+    def insert_job(self, project_id, body):
+        self.insert_calls += 1
+        job_id = body['jobReference']['jobId']
+        if job_id in self.jobs_by_id:
+            raise http_error(409, 'Conflict', 'Already Exists: Job %s:%s' % (project_id, job_id))
+        start = self.clock.time()
+        self.jobs_by_id[job_id] = (body, start, start + self.duration(body))
+        self.max_running = max(self.max_running, self.running_count())
+        table_id = destination_table(body)
+        if table_id in self.lost_inserts:
+            self.lost_inserts.discard(table_id)
+            raise http_error(503, 'Service Unavailable', 'Backend Error')
+        return {'jobReference': body['jobReference'], 'status': {'state': 'PENDING'}}
+
+    def get_job(self, project_id, job_id):
+        self.get_calls += 1
+        body, start, end = self.jobs_by_id[job_id]
+        if self.clock.time() < end:
+            return {'jobReference': body['jobReference'], 'status': {'state': 'RUNNING'}}
+        status = {'state': 'DONE'}
+        table_id = destination_table(body)
+        if table_id in self.failing_tables:
+            status['errorResult'] = {'reason': 'invalidQuery', 'location': 'query',
+                                     'message': 'fake failure of %s' % (table_id)}
+            status['errors'] = [status['errorResult']]
+        return {'jobReference': body['jobReference'], 'status': status}
+
+def main(max_concurrent=12):
+    """Splits a fake methylation table by chromosome, one job per chromosome
+    """
+    random = np.random.RandomState(0)
+    chromosomes = map(str, range(1, 23)) + ['X', 'Y']
+    # seconds per chromosome
+    durations = dict(('Methylation_chr' + chromosome, float(random.randint(60, 600))) for chromosome in chromosomes)
+
+    clock = FakeClock()
+    bigquery = FakeBigQuery(clock, lambda body: durations[destination_table(body)],
+                            failing_tables=['Methylation_chrY'], lost_inserts=['Methylation_chr7'])
+    # polled like the methylation split (tcga_etl_pipeline/methylation/split_table.py)
+    orchestrator = QueryOrchestrator('fake-project', bigquery=bigquery, max_concurrent=max_concurrent,
+                                     min_poll_interval=10, sleep=clock.sleep)
+    for chromosome in chromosomes:
+        orchestrator.add_query('chromosome ' + chromosome, 'SELECT {0}'.format(chromosome),
+                               'tcga_data', 'Methylation_chr' + chromosome)
+    failed = orchestrator.run()
+
+    assert bigquery.max_running <= max_concurrent, 'more than %s jobs ran at once' % (max_concurrent)
+    assert failed == ['chromosome Y'], 'unexpected failures %s' % (failed)
+    assert len(orchestrator.done) == len(chromosomes) - 1
+    # the retried insert of chromosome 7 got a 409, its job was tracked
+    assert 'chromosome 7' in [query_job.name for query_job in orchestrator.done]
+    # sequential: each job, then polling every 20 seconds until it is done
+    sequential = sum(np.ceil(duration / 20.0) * 20 for duration in durations.itervalues())
+    print '%s jobs, at most %s at once: %.0fs (sequential split: %.0fs), %s status calls' % (
+        len(chromosomes), bigquery.max_running, clock.time(), sequential, bigquery.get_calls)
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
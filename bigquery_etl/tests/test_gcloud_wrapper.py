@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+# Copyright 2015, Institute for Systems Biology.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests the streamed blob reads: a stream that ends before its
+Content-Length raises, and convert_blob_to_dataframe then reads the
+file from a full download
+
+usage: python -m unittest bigquery_etl.tests.test_gcloud_wrapper
+"""
+import unittest
+from io import BytesIO
+from StringIO import StringIO
+from bigquery_etl.extract.gcloud_wrapper import BlobStream
+from bigquery_etl.extract.utils import convert_file_to_dataframe
+from bigquery_etl.utils import gcutils
+
+content = 'Hybridization REF\tBeta_Value\n' + ''.join('cg%08d\t0.%d\n' % (n, n) for n in range(5000))
+
+class FakeRaw(BytesIO):
+    """The raw urllib3 response: tell() is the number of bytes received
+    """
+
+class FakeGcs(object):
+    """Streams the first stream_bytes of the content, with the Content-Length of all of it
+    """
+    def __init__(self, stream_bytes):
+        self.stream_bytes = stream_bytes
+        self.downloads = 0
+
+    def open_blob_stream(self, filename):
+        return BlobStream(FakeRaw(content[:self.stream_bytes]), len(content))
+
+    def download_blob_to_file(self, filename, rollover=False):
+        self.downloads += 1
+        return StringIO(content)
+
+class BlobStreamTest(unittest.TestCase):
+    def test_complete_stream(self):
+        data_df = convert_file_to_dataframe(BlobStream(FakeRaw(content), len(content)))
+        self.assertEqual(len(data_df), 5000)
+
+    def test_truncated_stream(self):
+        stream = BlobStream(FakeRaw(content[:1000]), len(content))
+        self.assertEqual(len(stream.read(4096)), 1000)
+        self.assertRaises(IOError, stream.read, 4096)
+
+    def test_truncated_stream_parse(self):
+        stream = BlobStream(FakeRaw(content[:len(content) // 2]), len(content))
+        self.assertRaises(IOError, convert_file_to_dataframe, stream)
+
+    def test_truncated_stream_falls_back_to_download(self):
+        gcs = FakeGcs(len(content) // 2)
+        data_df = gcutils.convert_blob_to_dataframe(gcs, 'project', 'bucket', 'methylation.txt')
+        self.assertEqual(gcs.downloads, 1)
+        self.assertEqual(len(data_df), 5000)
+        self.assertEqual(data_df['Hybridization_REF'].iloc[-1], 'cg00004999')
+
+    def test_complete_stream_no_download(self):
+        gcs = FakeGcs(len(content))
+        data_df = gcutils.convert_blob_to_dataframe(gcs, 'project', 'bucket', 'methylation.txt')
+        self.assertEqual(gcs.downloads, 0)
+        self.assertEqual(len(data_df), 5000)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+# Copyright 2015, Institute for Systems Biology.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests the schema inference of generate_schema on records shaped like
+the outputs of the transforms (numbers written as strings)
+
+usage: python -m unittest bigquery_etl.tests.test_generate_schema
+"""
+import json
+import unittest
+from cStringIO import StringIO
+from bigquery_etl.utils.generate_schema import infer_schema
+
+# a CNV output record (tcga_etl_pipeline/cnv/transform.py)
+cnv_record = {
+    'AliquotBarcode': 'TCGA-02-0001-01C-01D-0186-05', 'SampleBarcode': 'TCGA-02-0001-01C',
+    'ParticipantBarcode': 'TCGA-02-0001', 'Study': 'GBM', 'SampleTypeLetterCode': 'TP',
+    'Platform': 'Genome_Wide_SNP_6', 'Pipeline': 'cnv', 'Center': 'broad.mit.edu',
+    'Chromosome': '7', 'Start': '100', 'End': '5000000', 'Num_Probes': '1234', 'Segment_Mean': '0.1234'
+}
+
+def schema_types(records, required=False):
+    filehandle = StringIO('\n'.join(json.dumps(record) for record in records) + '\n')
+    return dict((field['name'], (field['type'], field['mode'])) for field in infer_schema(filehandle, required))
+
+class GenerateSchemaTest(unittest.TestCase):
+    def test_cnv_numeric_strings(self):
+        other_record = dict(cnv_record, Chromosome='X', Start='5000001', Segment_Mean='-1.5e-3')
+        types = schema_types([cnv_record, other_record])
+        self.assertEqual(types['Start'], ('INTEGER', 'NULLABLE'))
+        self.assertEqual(types['End'], ('INTEGER', 'NULLABLE'))
+        self.assertEqual(types['Num_Probes'], ('INTEGER', 'NULLABLE'))
+        self.assertEqual(types['Segment_Mean'], ('FLOAT', 'NULLABLE'))
+        self.assertEqual(types['Chromosome'], ('STRING', 'NULLABLE'))
+        self.assertEqual(types['AliquotBarcode'], ('STRING', 'NULLABLE'))
+
+    def test_widening(self):
+        types = schema_types([{'a': '1', 'b': '2', 'c': 1, 'd': 'true'},
+                              {'a': '1.5', 'b': 'n/a', 'c': '', 'd': True},
+                              {'a': None, 'b': None, 'c': None, 'd': None}])
+        self.assertEqual(types['a'][0], 'FLOAT')
+        self.assertEqual(types['b'][0], 'STRING')
+        self.assertEqual(types['c'][0], 'STRING')
+        self.assertEqual(types['d'][0], 'STRING')
+
+    def test_timestamps(self):
+        types = schema_types([{'created_at': '2016-07-17 10:42:00', 'date': '2016-07-17', 'barcode_date': '2016-07-17'},
+                              {'created_at': '2016-07-18T01:02:03.5Z', 'date': '2016-07-18', 'barcode_date': '2016-07-18'}])
+        self.assertEqual(types['created_at'][0], 'TIMESTAMP')
+        self.assertEqual(types['date'][0], 'TIMESTAMP')
+        # only the date-like field names hold dates
+        self.assertEqual(types['barcode_date'][0], 'STRING')
+
+    def test_required(self):
+        records = [cnv_record, dict(cnv_record, Num_Probes=None)]
+        self.assertEqual(schema_types(records)['Start'], ('INTEGER', 'NULLABLE'))
+        types = schema_types(records, required=True)
+        self.assertEqual(types['Start'], ('INTEGER', 'REQUIRED'))
+        self.assertEqual(types['Num_Probes'], ('INTEGER', 'NULLABLE'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -14,7 +14,8 @@
 # limitations under the License.
 
 import pandas as pd
-from bigquery_etl.extract.gcloud_wrapper import GcsConnector
+from bigquery_etl.extract.bucket_index import BucketIndex
+from bigquery_etl.execution.post_etl_check import find_missing_blobs
 
 def assert_notnull_property(df, columns_list=[]):
     """
@@ -39,14 +40,16 @@ def assert_notnull_property(df, columns_list=[]):
     
     assert (null_row_count == 0), "Selected columns cannot have NULL/NaN values"
 
-def test_blob_exists(project_id, bucket_name, df):
+def test_blob_exists(project_id, bucket_name, df, index_db='bucket_index.db', refresh=True):
     """
-    Checks if the DataFileNameKey blob exists in the bucket
+    Checks if the DataFileNameKey blobs exist in the bucket
+    the names are compared to one listing of their prefixes (stored in index_db);
+    the prefixes are listed again unless refresh is False, so blobs
+    written or deleted since the last listing are seen
     """
-     # connect to the cloud bucket
-    gcs = GcsConnector(project_id, bucket_name)
-    for idx, row in df.iterrows():
-        records = row.to_dict()
-        print records['DatafileNameKey']
-        blob_status = gcs.check_blob_exists(records['DatafileNameKey'])
-        assert (blob_status is True), 'Blob doesnt exist'
+    bucket_index = BucketIndex(project_id, bucket_name, index_db)
+    try:
+        missing = find_missing_blobs(bucket_index, df['DatafileNameKey'], refresh=refresh)
+    finally:
+        bucket_index.close()
+    assert (not missing), 'Blobs dont exist: %s' % (missing)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+# Copyright 2015, Institute for Systems Biology.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Reference (lookup) tables, loaded once per process
+
+The tables a transform joins against (HGNC symbols, antibody maps, ...)
+are read and indexed on first use and kept for the next tasks of the
+worker; a table is reloaded when its file modification time changes.
+
+Example:
+    hgnc = get_reference_table('docs/hgnc_approved_symbols.txt', 'entrez_id', ['symbol'],
+                               sep='|', dtype='object')
+    data_df['HGNC_gene_symbol'] = hgnc.map(data_df['gene_id'], 'symbol')
+"""
+import os
+import logging
+import pandas as pd
+
+log = logging.getLogger(__name__)
+
+# (path, key column, value columns) -> (mtime, ReferenceTable)
+reference_tables = {}
+
+class ReferenceTable(object):
+    """Value columns indexed by the key column
+    """
+    def __init__(self, df, key_column, value_columns):
+        # a lookup needs unique keys; the last row of a key wins (like to_dict)
+        df = df.drop_duplicates(key_column, keep='last').set_index(key_column)
+        self.key_column = key_column
+        self.lookups = dict((column, df[column]) for column in value_columns)
+
+    def map(self, keys, column):
+        """Vectorized join: the column value of each key (nan when not found)
+        """
+        return keys.map(self.lookups[column])
+
+    def to_dict(self, column):
+        return self.lookups[column].to_dict()
+
+def get_reference_table(path, key_column, value_columns, **read_options):
+    """Returns the table of the file, reading it (pd.read_csv with read_options)
+       only the first time or when the file changed since
+    """
+    key = (path, key_column, tuple(value_columns))
+    mtime = os.path.getmtime(path)
+    entry = reference_tables.get(key)
+    if entry is None or entry[0] != mtime:
+        log.info('loading reference table %s' % (path))
+        df = pd.read_csv(path, usecols=[key_column] + list(value_columns), **read_options)
+        entry = (mtime, ReferenceTable(df, key_column, value_columns))
+        reference_tables[key] = entry
+    return entry[1]
@@ -16,6 +16,7 @@
 # -*- coding: utf-8 -*-
 import re
 from collections import OrderedDict
+from itertools import chain
 import pandas as pd
 import numpy as np
 from StringIO import StringIO
@@ -25,17 +26,40 @@ import chardet
 log = logging.getLogger(__name__)
 
 
+#--------------------------------------
+# Column name formatting for BigQuery
+#--------------------------------------
+# blank space, dash (BQ doesnt allow dashes), opening bracket, plus and dot to underscore
+column_name_chars = re.compile(r'[ \-(+.]')
+
+def format_column_name(name):
+    """Formats a column name for Bigquery input
+        - strip, delete closing brackets, replace non-desired characters
+          (space, dash, etc.) with underscore, double underscore to just underscore
+    """
+    name = column_name_chars.sub('_', name.strip().replace(')', ''))
+    return name.replace('__', '_')
+
+def soft_convert(df):
+    """Converts object columns to a better dtype if all their values allow it
+       (no string to number conversion)
+    """
+    # infer_objects replaced convert_objects in pandas 0.21
+    if hasattr(df, 'infer_objects'):
+        return df.infer_objects()
+    return df.convert_objects(convert_numeric=False)
+
 #--------------------------------------
 # Clean up the dataframe
 #--------------------------------------
 def cleanup_dataframe(df, caller_log = None):
     """Cleans the dataframe
-        - strips new lines, double, single quotes; None -> nan, etc
+        - whitespace only strings, '_mv_' and None -> nan
         - formats the column names for Bigquery input
     """
-    if caller_log:
-        log = caller_log
-        
+    # a plain assignment to log here would make it local (and unbound without caller_log)
+    log = caller_log if caller_log else logging.getLogger(__name__)
+
     log.info("Cleaning up the dataframe")
 
     if df.empty:
@@ -48,51 +72,58 @@ def cleanup_dataframe(df, caller_log = None):
 #     for rep in na_values:
 #         df = df.replace(rep, np.nan)
 
-    log.info('\tremove empty spaces(this removes more than 1 space)')
-    df = df.applymap(lambda x: np.nan if isinstance(x, basestring) and x.isspace() else x)
-
-    log.info('\tprevent problems with nan(numpy.nan) in the convert and strip step by replacing with \'_mv_\'')
-    df = df.fillna("_mv_")
-
-# this can also be specified on load of df from file
-#    log.info('\tconvert to utf-8')
-#     [df[column].str.encode('utf-8') for column in df.columns]
-
-    log.info('\tstrip spaces (including ^M) and quotes')
-    df.replace(r'((^[\s"\'])|([\s"\']$))', '', regex=True)
-    
-    log.info('\treplace back the np.nan')
-    df = df.replace(r'_mv_', np.nan)
-
-    #------------
-    # Fix columns
-    #------------
-    replace_column_strings = (
-        (" ", "_"), # blank space to underscore
-        ("-", "_"), # dashes to underscore (BQ doesnt allow dashes)
-        (")", ""),  # delete closing bracket
-        ("(", "_"), # opening bracket to underscore
-        ("+", "_"), # plus to underscore
-        (".", "_"), # dot to underscore
-        ("__", "_") # double underscore to just underscore
-    )
-    replace_column_strings = OrderedDict(replace_column_strings)
-
-    log.info('\tstrip column names')
-    df.columns = df.columns.map(lambda x: x.strip())
+    # work on positions, column names may be duplicated
+    columns = df.columns
+    df = df.copy()
+    df.columns = range(len(columns))
+
+    # only object columns can hold strings; numeric columns are left alone
+    log.info('\tnull-normalize the string columns (empty spaces, None and _mv_ to nan)')
+    for position in np.flatnonzero((df.dtypes == object).values):
+        values = df[position]
+        try:
+            blank = values.str.isspace().values == True
+        except AttributeError:
+            # no strings in the column
+            blank = np.zeros(len(values), dtype=bool)
+        missing = blank | values.isin(['_mv_']).values | pd.isnull(values.values)
+        if missing.any():
+            df[position] = values.mask(missing)
+    df = soft_convert(df)
 
     log.info('\treplace all non-desired characters(space, dash, etc.) in column names with underscore')
-    for repl in replace_column_strings:
-        df.columns = df.columns.map(lambda x: x.replace(repl, replace_column_strings[repl]))
+    df.columns = [format_column_name(column) for column in columns]
     
     log.info("Finished cleaning up the dataframe")
     return df
 
+#----------------------------------------
+# Write a dataframe as newline-delimited JSON
+#  -- encodes chunksize rows at a time, so the
+# whole document is never held in memory
+# sink: any file-like object (local file, gzip stream, upload buffer)
+#----------------------------------------
+def write_df_as_njson(df, sink, chunksize=10000):
+    """Writes the dataframe to sink as new-line delimited JSON, one block
+       of chunksize rows at a time; returns the number of rows written
+    """
+    datetime_columns = [column for column in df.columns if df[column].dtype == 'datetime64[ns]']
+    for start in range(0, len(df), chunksize):
+        chunk = soft_convert(df.iloc[start:start + chunksize])
+        if datetime_columns:
+            # BigQuery takes the timestamps as strings
+            for column in datetime_columns:
+                chunk[column] = chunk[column].apply(str)
+        chunk_json = chunk.to_json(orient='records', lines=True)
+        if not chunk_json.endswith('\n'):
+            chunk_json += '\n'
+        sink.write(chunk_json)
+    return len(df)
+
 #----------------------------------------
 # Convert a dataframe into newline-delimited JSON string
 #  -- should work for a small to medium files
-# if rollover_file is true
-# works only in a single bucket
+# use write_df_as_njson to write to a file instead
 #----------------------------------------
 def convert_df_to_njson(df):
     """Converting dataframe into a new-line delimited JSON
@@ -100,36 +131,98 @@ def convert_df_to_njson(df):
     log.info("Converting dataframe into a new-line delimited JSON file")
 
     file_to_upload = StringIO()
+    write_df_as_njson(df, file_to_upload)
+
+    return file_to_upload.getvalue()
 
-    for _, rec in df.iterrows():
-        file_to_upload.write(rec.convert_objects(convert_numeric=False).to_json() + "\n")
+#----------------------------------------
+# Convert a dataframe into CSV (no header, no index)
+#  -- the leading constant columns (metadata) are formatted once
+#----------------------------------------
+def convert_df_to_csv(df, constant_columns=[], float_format=None):
+    """Same string as df.to_csv(index=False, header=False, float_format=float_format);
+       the leading columns of df that are in constant_columns (one value in
+       all the rows) are written once and prefixed to the lines of the rest
+    """
+    leading = 0
+    for column in df.columns:
+        if column not in constant_columns:
+            break
+        leading += 1
+    if len(df) and 0 < leading < len(df.columns):
+        prefix = df.iloc[:1, :leading].to_csv(index=False, header=False, float_format=float_format)
+        body = df.iloc[:, leading:].to_csv(index=False, header=False, float_format=float_format)
+        # quoted fields can span lines (and quote differently alone); no shortcut then
+        if '"' not in prefix and '"' not in body:
+            prefix_line = prefix.rstrip('\r\n')
+            line_terminator = prefix[len(prefix_line):]
+            lines = body.split(line_terminator)[:-1]
+            prefix_line += ','
+            return prefix_line + (line_terminator + prefix_line).join(lines) + line_terminator
+    return df.to_csv(index=False, header=False, float_format=float_format)
 
-    file_to_upload.seek(0)
 
-    return file_to_upload.getvalue()
+#----------------------------------------
+# Duplicates
+#  -- the key columns are hashed once per frame (64 bit row hashes);
+# only the rows whose hash repeats are compared on the key columns
+#----------------------------------------
+def key_columns(columns):
+    return columns if isinstance(columns, list) else [columns]
 
+def hash_rows(df, columns):
+    """Returns a 64 bit hash per row of the columns, as int64
+    """
+    key_df = df[key_columns(columns)]
+    try:
+        from pandas.util import hash_pandas_object
+    except ImportError:
+        # pandas < 0.20
+        return key_df.apply(lambda row: hash(tuple(row)), axis=1).values.astype('int64')
+    return hash_pandas_object(key_df, index=False).values.view('int64')
+
+def duplicated_rows(df, columns, hashes, keep='first'):
+    """Same mask as df.duplicated(subset=columns, keep=keep): the rows whose
+       hash repeats (usually few) are compared on the key columns, so a hash
+       collision doesn't make two different keys duplicates
+    """
+    mask = np.zeros(len(df), dtype=bool)
+    repeated = pd.Series(hashes).duplicated(keep=False).values
+    if repeated.any():
+        mask[repeated] = df[repeated].duplicated(subset=key_columns(columns), keep=keep).values
+    return mask
+
+def duplicate_mask(df, unique_key):
+    """True for the rows to drop: repeats of an earlier row's key
+    """
+    return duplicated_rows(df, unique_key, hash_rows(df, unique_key))
 
 def remove_duplicates(df, unique_key):
     """Removes duplicates in a dataframe based on the unique combination of key
         unique_key accepts a list
     """
-    df['duplicated'] = df.duplicated(unique_key)
-    if not df[df.duplicated(unique_key)].empty:
-        log.debug("Found duplicate rows")
-        df = df.drop_duplicates(unique_key)
+    mask = duplicate_mask(df, unique_key)
+    if mask.any():
+        log.debug("Found %d duplicate rows" % (mask.sum()))
+        df = df[~mask]
         log.debug("Deleted")
-    return df
+    # the kept rows are the first of their key
+    return df.assign(duplicated=False)
+
+def duplicate_counts(values):
+    """Number of times each value appeared before it in values
+    """
+    codes = pd.factorize(np.asarray(values, dtype=object))[0]
+    return pd.Series(codes).groupby(codes).cumcount().values
 
 def mangle_dupe_cols(columns):
     """remove/mangle any duplicate columns (we are naming line a, a.1, a.2 etc if duplicates)
     """
-    counts = {}
-    for i, col in enumerate(columns):
-        cur_count = counts.get(col, 0)
-        if cur_count > 0:
-            columns[i] = '%s.%d' % (col, cur_count)
-            print ('mangle_dupe_col: Duplicate column name: ' + str(col))
-        counts[col] = cur_count + 1
+    counts = duplicate_counts(columns)
+    for i in np.flatnonzero(counts):
+        col = columns[i]
+        columns[i] = '%s.%d' % (col, counts[i])
+        print ('mangle_dupe_col: Duplicate column name: ' + str(col))
     return columns
 
 
@@ -137,16 +230,19 @@ def mangle_dupe_cols(columns):
 # format any duplicate values ( we are naming line dup1.a, dup2.a, etc if duplicates)
 #----------------------------------------------
 def format_dupe_values(values):
-    counts = {}
-    for i, val in enumerate(values):
-        cur_count = counts.get(val, 0)
-        if cur_count > 0:
-            values[i] = 'dup%d.%s' % (cur_count, val)
-            print ("format_dupe_values: Duplicate column name: " + str(val))
-        counts[val] = cur_count + 1
+    counts = duplicate_counts(values)
+    if isinstance(values, pd.Series):
+        values = values.copy()
+        positional = values.iloc
+    else:
+        positional = values
+    for i in np.flatnonzero(counts):
+        val = positional[i]
+        positional[i] = 'dup%d.%s' % (counts[i], val)
+        print ("format_dupe_values: Duplicate column name: " + str(val))
     return values
 
-def assert_notnull_property(df, columns_list):
+def assert_notnull_property(df, columns_list=[]):
     """
     checks if a dataframe column values are NULL/NaN;
     param columns_list accepts a list
@@ -162,27 +258,66 @@ def assert_notnull_property(df, columns_list):
                   a   b
                1  3 NaN
     """
-    null_row_count = len(df[columns_list].isnull().any(axis=1))
-    if null_row_count > 0:
-        null_rows_df = df[df.isnull().any(axis=1)]
+    if not len(columns_list):
+        columns_list = df.columns.values
+    null_rows_df = df[df[columns_list].isnull().any(axis=1)]
+    if len(null_rows_df) > 0:
         print null_rows_df
         raise Exception('Assert Property failed: Column values are null')
 
 
-def convert_encoding(text, new_coding='UTF-8'):
+#----------------------------------------
+# Encoding normalization
+#  -- chardet detection is very slow compared to decoding;
+# clean (ASCII or valid UTF-8) values skip it, and the encodings
+# detected in a file are tried first on its other values
+#----------------------------------------
+
+def decodes_as(text, encoding):
+    try:
+        text.decode(encoding)
+        return True
+    except UnicodeError:
+        return False
+
+def is_clean(text, new_coding='UTF-8'):
+    """True if the string needs no conversion: ascii, or already new_coding
+    """
+    if isinstance(text, unicode):
+        try:
+            text.encode('ascii')
+            return True
+        except UnicodeError:
+            return False
+    return decodes_as(text, 'ascii') or decodes_as(text, new_coding)
+
+def convert_encoding(text, new_coding='UTF-8', detected_encodings=None):
     """UTF-8 encode all strings
+        detected_encodings: list of the encodings detected so far in the
+        file the text comes from (kept by the caller, one per file); they
+        are tried before chardet, and a new detection is added to it
     """
     if isinstance(text, (int, float)):
         text = str(text)
 
-    if all([True if ord(i) < 128 else False for i in text]):
+    if is_clean(text, new_coding):
         return text
 
+    if isinstance(text, unicode):
+        return text.encode(new_coding)
+
+    # try the encodings detected earlier in the same file
+    for encoding in detected_encodings or []:
+        if decodes_as(text, encoding):
+            return text.decode(encoding).encode(new_coding)
+
     try:
         encoding = chardet.detect(text)['encoding']
         log.debug('Found {0} encoded string - {1}'.format(encoding, text))
+        if encoding and detected_encodings is not None and encoding not in detected_encodings:
+            detected_encodings.append(encoding)
         if new_coding.upper() != encoding.upper():
-            text = text.decode(encoding, text).encode(new_coding)
+            text = text.decode(encoding).encode(new_coding)
             log.debug('New {0} encoded string - {1}'.format(new_coding, text))
         return text
     except Exception as e:
@@ -198,42 +333,88 @@ def convert_encoding(text, new_coding='UTF-8'):
         text = re.sub(r'[^\x00-\x7F]+', ' ', text)
     return text
 
+def convert_column_encoding(values, new_coding='UTF-8', detected_encodings=None):
+    """Encodes the string values of a series with new_coding; a column
+       that is all ASCII (or valid new_coding) is returned as is, and only
+       the values failing the check go through convert_encoding
+    """
+    if values.dtype != object:
+        return values
+
+    # whole column check: one join (Series.str, nulls skipped) and one
+    # decode; the newline separator keeps a broken sequence from spanning
+    # two values. Columns with non-string values, or mixing non-ascii str
+    # and unicode, are checked value by value
+    try:
+        if is_clean(values.str.cat(sep='\n'), new_coding):
+            return values
+    except (AttributeError, TypeError, UnicodeError):
+        pass
+
+    is_string = values.map(lambda value: isinstance(value, basestring)).values
+    strings = values.values[is_string]
+    failing = np.array([not is_clean(text, new_coding) for text in strings], dtype=bool)
+    if not failing.any():
+        return values
+    converted = values.copy()
+    converted.iloc[np.flatnonzero(is_string)[failing]] = [convert_encoding(text, new_coding, detected_encodings)
+                                                          for text in strings[failing]]
+    return converted
+
+def convert_dataframe_encoding(df, new_coding='UTF-8', detected_encodings=None):
+    """Encodes the strings in the object columns of the dataframe
+        detected_encodings: see convert_encoding; a new list (this frame
+        only) when None
+    """
+    if detected_encodings is None:
+        detected_encodings = []
+    for position in np.flatnonzero((df.dtypes == object).values):
+        values = df.iloc[:, position]
+        converted = convert_column_encoding(values, new_coding, detected_encodings)
+        if converted is not values:
+            df.iloc[:, position] = converted
+    return df
+
 
 def split_df_column_values_into_multiple_rows(data_df, column_name, splitby=','):
     """Split pandas dataframe string entry to separate rows
+        the other columns are repeated for each value; column order and
+        dtypes are preserved, and the result has a fresh index
     """
-    concat_dict = []
-    data_df['__split_column__'] = data_df[column_name].str.split(splitby)
-    for _, row_df in data_df.iterrows():
-        row_dict = row_df.to_dict()
-        elements = row_dict['__split_column__']
-        if not isinstance(elements, float) and  pd.notnull(elements).all() and len(elements) > 1:
-            for item in elements:
-                row_dict = row_df.to_dict()
-                row_dict[column_name] = item
-                concat_dict.append(row_dict)
-                row_dict = {}
-        else:
-            concat_dict.append(row_dict)
-    concat_df = pd.DataFrame(concat_dict)
-    concat_df = concat_df.drop(['__split_column__'], axis=1)
+    values = data_df[column_name]
+    split_values = values.str.split(splitby)
+    # non-string entries (nan) stay as they are
+    counts = split_values.str.len().fillna(1).astype(int).values
+    positions = np.repeat(np.arange(len(data_df)), counts)
+
+    concat_df = data_df.iloc[positions].reset_index(drop=True)
+    multiple = counts > 1
+    if multiple.any():
+        column_values = values.values[positions].copy()
+        column_values[np.repeat(multiple, counts)] = list(chain.from_iterable(split_values.values[multiple]))
+        concat_df[column_name] = column_values
 
     return concat_df
 
 def normalize_json(y):
     """Converts a nested json string into a flat dict
+        nested keys are joined with underscores; the values of a list
+        are flattened under the key of the list (the last one wins);
+        numbers become strings, strings are left as they are: encode
+        the columns of the frame of the dicts (convert_dataframe_encoding)
     """
     out = {}
 
-    def flatten(x, name=''):
+    # depth first, without recursion; children are pushed in reverse
+    # so they are visited in their original order
+    stack = [(y, '')]
+    while stack:
+        x, name = stack.pop()
         if type(x) is dict:
-            for a in x:
-                flatten(x[a], name +  a + '_')
+            stack.extend([(x[a], name + a + '_') for a in x][::-1])
         elif type(x) is list:
-            for a in x:
-                flatten(a, name)
+            stack.extend([(a, name) for a in x][::-1])
         else:
-            out[str(name[:-1])] = convert_encoding(x)
-    flatten(y)
+            out[str(name[:-1])] = str(x) if isinstance(x, (int, float)) else x
     return out
 
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+# Copyright 2015, Institute for Systems Biology.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Declarative per-datatype transform specs and the engine that runs them
+
+A TransformSpec describes how a data file of one datatype becomes rows
+of its table: the input layout, the column renames, the derived columns,
+the null filters, the casts, the metadata columns and the output.
+run_transform() executes any spec the same way (download and parse,
+derive, vectorized casts, metadata, upload), so every datatype gets the
+same code path.
+
+Example:
+    cnv_spec = TransformSpec(
+        'cnv', log_file='logs/cnv_transform_{AliquotBarcode}.log',
+        casts=[('Segment_Mean', '%.4f'), ('Num_Probes', '%d')])
+    run_transform(cnv_spec, project_id, bucket_name, filename, outfilename, metadata)
+"""
+import logging
+import numpy as np
+import pandas as pd
+from bigquery_etl.utils import gcutils
+from bigquery_etl.execution.worker_context import get_worker_context
+from bigquery_etl.transform.tools import convert_df_to_csv, assert_notnull_property
+
+log = logging.getLogger(__name__)
+
+# the metadata columns of the TCGA tables: (column, metadata key, function of the value)
+tcga_metadata_columns = [
+    ('AliquotBarcode', 'AliquotBarcode', None),
+    ('SampleBarcode', 'SampleBarcode', None),
+    ('ParticipantBarcode', 'ParticipantBarcode', None),
+    ('Study', 'Study', lambda study: study.upper()),
+    ('SampleTypeLetterCode', 'SampleTypeLetterCode', None),
+    ('Platform', 'Platform', None),
+    ('Pipeline', 'Pipeline', None),
+    ('Center', 'DataCenterName', None)
+]
+
+class TransformSpec(object):
+    """How the data files of a datatype are transformed
+
+    name             -- logger name
+    log_file         -- log file name, formatted with the metadata
+    skiprows         -- lines to skip before the header
+    columns          -- names of the columns by position (replaces the header)
+    renames          -- {column: new name}
+    derived          -- functions data_df -> data_df, run in order (derived columns, row filters)
+    notnull          -- rows with a null in any of these columns are dropped
+    casts            -- [(column, format)]: '%d' or a float format such as '%.4f';
+                        the values are parsed as numbers and written back as strings
+    metadata_columns -- [(column, metadata key, function of the value or None)]
+    output_columns   -- the columns (and their order) of the output, None for all
+    required         -- columns that cannot have nulls in the output
+    output_format    -- 'NEWLINE_DELIMITED_JSON' or 'CSV' (no header)
+    float_format     -- float format of the CSV writer
+    shard_bytes      -- size of the output shards when the files are batched
+                        (see pipeline.make_batches); None for one output per file
+    upload_metadata  -- whether the metadata is set on the uploaded blob
+    """
+    def __init__(self, name, log_file=None, skiprows=0, columns=None, renames={}, derived=[], notnull=[],
+                 casts=[], metadata_columns=tcga_metadata_columns, output_columns=None, required=[],
+                 output_format='NEWLINE_DELIMITED_JSON', float_format=None, shard_bytes=None,
+                 upload_metadata=False):
+        if output_format not in ('NEWLINE_DELIMITED_JSON', 'CSV'):
+            raise ValueError('unknown output format %s' % (output_format))
+        self.name = name
+        self.log_file = log_file or ('logs/' + name + '_transform_{AliquotBarcode}.log')
+        self.skiprows = skiprows
+        self.columns = columns
+        self.renames = renames
+        self.derived = derived
+        self.notnull = notnull
+        self.casts = casts
+        self.metadata_columns = metadata_columns
+        self.output_columns = output_columns
+        self.required = required
+        self.output_format = output_format
+        self.float_format = float_format
+        self.shard_bytes = shard_bytes
+        self.upload_metadata = upload_metadata
+
+    def apply(self, data_df, metadata):
+        """Runs the steps of the spec on the parsed (and cleaned up) file
+        """
+        if self.columns is not None:
+            data_df.columns = self.columns
+        if self.renames:
+            data_df = data_df.rename(columns=self.renames)
+        for derive in self.derived:
+            data_df = derive(data_df)
+        if self.notnull:
+            data_df = data_df.dropna(subset=self.notnull)
+        # a copy (not a slice of the dropna or of the derived steps): the
+        # casts are assigned onto it
+        data_df = add_metadata_columns(data_df, self.metadata_columns, metadata)
+        for column, number_format in self.casts:
+            data_df[column] = format_numbers(data_df[column], number_format)
+        if self.output_columns is not None:
+            data_df = data_df[self.output_columns]
+        if self.required:
+            assert_notnull_property(data_df, columns_list=self.required)
+        return data_df
+
+    def upload(self, gcs, data_df, outfilename, metadata):
+        """Writes the transformed frame to outfilename
+        """
+        blob_metadata = metadata if self.upload_metadata else {}
+        if self.output_format == 'CSV':
+            return gcs.upload_blob_from_string(outfilename, self.to_csv(data_df), metadata=blob_metadata)
+        return gcs.convert_df_to_njson_and_upload(data_df, outfilename, metadata=blob_metadata)
+
+    def to_csv(self, data_df):
+        """The CSV output; the metadata columns hold one value, they are written once
+        """
+        constant_columns = [column for column, key, function in self.metadata_columns]
+        return convert_df_to_csv(data_df, constant_columns, float_format=self.float_format)
+
+#------------------------------------------
+# Vectorized casts
+#------------------------------------------
+def format_numbers(values, number_format):
+    """Formats a column of numbers (or numeric strings) as strings, with the
+       same results as str(int(float(x))) for '%d' and "{0:.4f}".format(float(x))
+       for '%.4f': the values are parsed in one typed cast (float() of each
+       value), then formatted from the float64 array in one pass
+    """
+    numbers = values.astype(np.float64).values
+    if number_format == '%d':
+        # int(float(x)) fails on nan and inf, the int64 cast doesn't
+        if not (np.abs(numbers) < 2.0 ** 63).all():
+            raise ValueError('cannot convert %s to integer (null or out of range values)' % (values.name))
+        formatted = [str(number) for number in numbers.astype(np.int64).tolist()]
+    else:
+        formatted = [number_format % number for number in numbers.tolist()]
+    return pd.Series(formatted, index=values.index, name=values.name, dtype=object)
+
+def add_metadata_columns(data_df, metadata_columns, metadata):
+    """Adds a constant column per metadata column, to a copy of the frame
+    """
+    data_df = data_df.copy()
+    for column, key, function in metadata_columns:
+        value = metadata[key]
+        data_df[column] = function(value) if function else value
+    return data_df
+
+#------------------------------------------
+# Engine
+#------------------------------------------
+def run_transform(spec, project_id, bucket_name, filename, outfilename, metadata):
+    """Download and convert blob into dataframe
+       Transform the file as described by the spec
+       Add Metadata information
+       Returns the frame when outfilename is None (batched files), the upload status otherwise
+    """
+    # setup logging (the log file of the aliquot; reconfigured only when it changes)
+    context = get_worker_context()
+    transform_log = context.get_logger(spec.name, spec.log_file.format(**metadata))
+    try:
+        transform_log.info('start transform of %s' % (metadata['AliquotBarcode']))
+        # connect to the cloud bucket (reused across tasks)
+        gcs = context.get_gcs_connector(project_id, bucket_name)
+
+        #main steps: download, convert to df, cleanup, transform, add metadata
+        data_df = gcutils.convert_blob_to_dataframe(gcs, project_id, bucket_name, filename,
+                                                    skiprows=spec.skiprows, log=transform_log)
+        transform_log.info('\tadd changes and metadata for %s' % (metadata['AliquotBarcode']))
+        data_df = spec.apply(data_df, metadata)
+
+        # batched (no outfilename): the frame goes into the shard of the batch
+        if outfilename is None:
+            transform_log.info('finished transform of %s' % (metadata['AliquotBarcode']))
+            return data_df
+
+        status = spec.upload(gcs, data_df, outfilename, metadata)
+        transform_log.info('finished transform of %s' % (metadata['AliquotBarcode']))
+    except Exception as e:
+        transform_log.exception('problem transforming %s' % (metadata['AliquotBarcode']))
+        raise e
+    return status
@@ -19,12 +19,15 @@ from bigquery_etl.utils import sync_query
 import pandas as pd
 import numpy as np
 
-def run(project_id, query):
-    """Runs a sync query and onverts the results to a dataframe
+def run(project_id, query, typed=False):
+    """Runs a sync query and converts the results to a dataframe
+       the dataframe is built page by page as the results are fetched
     """
     # query a table
-    results = sync_query.main(project_id, query, timeout=1, num_retries=5)
-    data_df = pd.DataFrame(results)
+    pages = sync_query.query_pages(project_id, query, timeout=1, num_retries=5)
+    data_frames = list(sync_query.iter_dataframes(pages, typed=typed))
+    if not data_frames:
+        return pd.DataFrame()
+    data_df = pd.concat(data_frames, ignore_index=True)
     data_df = data_df.fillna(value=np.nan)
     return data_df
-
@@ -19,6 +19,7 @@ from bigquery_etl.extract.utils import convert_file_to_dataframe
 from bigquery_etl.transform.tools import cleanup_dataframe
 from datetime import datetime
 import MySQLdb
+import MySQLdb.cursors
 import pandas as pd
 import os
 
@@ -35,20 +36,27 @@ def logit(log, message, level):
         elif 'EXCEPTION' == level.upper():
             log.exception(message)
 
-def convert_blob_to_dataframe(gcs, project_id, bucket_name, filename, skiprows=0, log = None):
+def convert_blob_to_dataframe(gcs, project_id, bucket_name, filename, skiprows=0, log = None, usecols=None):
     """
-    Function to connect to google cloud storage, download the file,
+    Function to connect to google cloud storage, stream the file
     and convert to a dataframe
+    the download is parsed as it arrives (no copy of the whole file in memory)
     """
 
     try:
-        logit(log, 'calling download_blob_to_file() for %s' % (filename), 'info')
-        filebuffer = gcs.download_blob_to_file(filename)
-        logit(log, 'done calling download_blob_to_file() for %s' % (filename), 'info')
+        logit(log, 'calling open_blob_stream() for %s' % (filename), 'info')
+        filebuffer = gcs.open_blob_stream(filename)
     
         # convert blob into dataframe
         logit(log, 'calling convert_file_to_dataframe() for %s' % (filename), 'info')
-        data_df = convert_file_to_dataframe(filebuffer, skiprows=skiprows)
+        try:
+            data_df = convert_file_to_dataframe(filebuffer, skiprows=skiprows, usecols=usecols)
+        except Exception as e:
+            # the stream can fail partway (e.g. truncated); read the file again from a full download
+            logit(log, 'problem reading the stream of %s (%s), downloading it instead' % (filename, e), 'warning')
+            filebuffer.close()
+            filebuffer = gcs.download_blob_to_file(filename)
+            data_df = convert_file_to_dataframe(filebuffer, skiprows=skiprows, usecols=usecols)
         logit(log, 'done calling convert_file_to_dataframe() for %s' % (filename), 'info')
     
         # clean-up dataframe
@@ -60,11 +68,41 @@ def convert_blob_to_dataframe(gcs, project_id, bucket_name, filename, skiprows=0
 
     return data_df
 
-def read_mysql_query(host, database, user, passwd, sqlquery):
-    """Reads CloudSQL database to get the metadata info for the
-       files in the bucket
-       Returns a dataframe with the metadata info
+def convert_blob_to_dataframe_chunks(gcs, filename, chunksize, skiprows=0, log = None, usecols=None):
+    """
+    Streams the file from google cloud storage and yields
+    cleaned up dataframes of chunksize rows
+    a read that fails partway raises (the chunks already yielded
+    can't be taken back): the caller transforms the whole file again
+    """
+    logit(log, 'calling open_blob_stream() for %s' % (filename), 'info')
+    filebuffer = gcs.open_blob_stream(filename)
+    try:
+        for data_df in convert_file_to_dataframe(filebuffer, skiprows=skiprows, usecols=usecols, chunksize=chunksize):
+            yield cleanup_dataframe(data_df, log)
+    finally:
+        filebuffer.close()
+
+#------------------------------------------
+# CloudSQL (MySQL) connections are kept open per process
+#  -- a query doesn't pay for a new SSL handshake
+#------------------------------------------
+# (pid, host, database, user) -> connection
+mysql_connections = {}
+
+def get_mysql_connection(host, database, user, passwd):
+    """Returns the SSL connection of this process to the database,
+       connecting on first use (or when the connection was lost)
     """
+    key = (os.getpid(), host, database, user)
+    mysql_connection = mysql_connections.get(key)
+    if mysql_connection is not None:
+        try:
+            mysql_connection.ping()
+            return mysql_connection
+        except MySQLdb.Error:
+            mysql_connections.pop(key, None)
+
     # connect db
     SSL_DIR = os.environ.get('SSL_DIR', '~/ssl_dir')
 
@@ -75,6 +113,37 @@ def read_mysql_query(host, database, user, passwd, sqlquery):
     }
 
     mysql_connection = MySQLdb.connect(host=host, db=database, user=user, passwd=passwd, ssl=ssl)
+    mysql_connections[key] = mysql_connection
+    return mysql_connection
+
+def read_mysql_query_chunks(host, database, user, passwd, sqlquery, chunksize=10000):
+    """Yields the result of the query as dataframes of chunksize rows;
+       the rows stay on the server (server side cursor) until fetched
+    """
+    mysql_connection = get_mysql_connection(host, database, user, passwd)
+    cursor = mysql_connection.cursor(MySQLdb.cursors.SSCursor)
+    try:
+        cursor.execute(sqlquery)
+        columns = [column[0] for column in cursor.description]
+        while True:
+            rows = cursor.fetchmany(chunksize)
+            if not rows:
+                break
+            yield pd.DataFrame(list(rows), columns=columns)
+    finally:
+        # the connection can't run another query before this one is read or closed
+        cursor.close()
+
+def read_mysql_query(host, database, user, passwd, sqlquery, chunksize=None):
+    """Reads CloudSQL database to get the metadata info for the
+       files in the bucket
+       Returns a dataframe with the metadata info (an iterator of
+       dataframes of chunksize rows, when chunksize is given)
+    """
+    if chunksize:
+        return read_mysql_query_chunks(host, database, user, passwd, sqlquery, chunksize)
+
+    mysql_connection = get_mysql_connection(host, database, user, passwd)
 
     df_rows = pd.read_sql_query(sqlquery, mysql_connection)
     return df_rows
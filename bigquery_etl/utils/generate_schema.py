@@ -13,31 +13,142 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import sys
-import pandas as pd
-import numpy as np
+"""Generates the BigQuery schema of a new line delimited JSON file
+
+The file is read one record at a time and the fields and their types
+are merged over every record as they go by, so memory doesn't grow with
+the file size. The fields are NULLABLE; with --required, a field that
+has a value in every record is REQUIRED.
+
+Like the pandas read_json the schema used to come from, strings holding
+numbers are typed as numbers (the transforms write the numbers as
+strings, e.g. the CNV Segment_Mean "0.1234" is FLOAT and Start "100"
+INTEGER), and date strings in the date-like fields (see is_date_field)
+are TIMESTAMP.
+
+usage: python generate_schema.py file.json [--required] > schema.json
+"""
+import re
 import json
-from pandas.io import gbq
-from google.cloud import storage
-from cStringIO import StringIO
+import argparse
+from collections import OrderedDict
 
 #------------------------------------------
-# This script reads the new line demilited JSON file 
-#  and tries to generate the schema based on the column values
+# Type lattice: a field holding different types
+#  is widened to the smallest type that holds them all
+#  BOOLEAN -> STRING, INTEGER -> FLOAT -> STRING, TIMESTAMP -> STRING
 #------------------------------------------
-filename = sys.argv[1]
-filehandle = open(filename, "r")
+integer_pattern = re.compile(r'^[-+]?\d+$')
+float_pattern = re.compile(r'^[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?$')
+# YYYY-MM-DD, with an optional time, fraction and timezone
+timestamp_pattern = re.compile(r'^\d{4}-\d{2}-\d{2}'
+                               r'(?:[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?(?:Z|[-+]\d{2}:?\d{2})?)?$')
+
+def is_date_field(name):
+    """The fields whose strings can be dates (the default date columns of pandas read_json)
+    """
+    name = name.lower()
+    return (name.endswith('_at') or name.endswith('_time') or name.startswith('timestamp')
+            or name in ('modified', 'date', 'datetime'))
+
+def string_type(text, date_field=False):
+    """BigQuery type of the value a string holds
+    """
+    text = text.strip()
+    if integer_pattern.match(text):
+        # out of the INTEGER range, the number is a FLOAT
+        return 'INTEGER' if abs(int(text)) < 2 ** 63 else 'FLOAT'
+    if float_pattern.match(text):
+        return 'FLOAT'
+    if date_field and timestamp_pattern.match(text):
+        return 'TIMESTAMP'
+    return 'STRING'
+
+def value_type(value, date_field=False):
+    """BigQuery type of a JSON value (None for null)
+    """
+    if value is None:
+        return None
+    # bool is a subclass of int, check it first
+    if isinstance(value, bool):
+        return 'BOOLEAN'
+    if isinstance(value, (int, long)):
+        return 'INTEGER'
+    if isinstance(value, float):
+        return 'FLOAT'
+    if isinstance(value, basestring):
+        return string_type(value, date_field)
+    # nested objects or arrays (kept as strings)
+    return 'STRING'
+
+def merge_types(current, new):
+    if current is None or current == new:
+        return new
+    if new is None:
+        return current
+    if set([current, new]) == set(['INTEGER', 'FLOAT']):
+        return 'FLOAT'
+    return 'STRING'
+
+class SchemaInferencer(object):
+    """Merges the field types of the records it is given
+    """
+    def __init__(self, default_type='STRING'):
+        self.default_type = default_type
+        self.num_records = 0
+        # field name -> [type, number of records with a value]
+        self.fields = OrderedDict()
+        # field name -> whether its strings can be dates
+        self.date_fields = {}
 
-# convert new line JSON into dict; 
-json_string = '[%s]' % ','.join(filehandle.readlines())
+    def add(self, record):
+        self.num_records += 1
+        for name, value in record.iteritems():
+            field = self.fields.setdefault(name, [None, 0])
+            date_field = self.date_fields.get(name)
+            if date_field is None:
+                date_field = self.date_fields[name] = is_date_field(name)
+            field_type = value_type(value, date_field)
+            if field_type is not None:
+                field[0] = merge_types(field[0], field_type)
+                field[1] += 1
 
-# a little time consuming, but is worth converting into dataframe
-df = pd.read_json(json_string)  # this can be replaced by read_csv for tab-demilited files
+    def schema(self, required=False):
+        """The schema fields (name, type and mode); the fields are NULLABLE,
+           with required a field is REQUIRED when every record has a value for it
+        """
+        schema = []
+        for name, (field_type, count) in self.fields.iteritems():
+            field = OrderedDict((('name', name), ('type', field_type or self.default_type)))
+            field['mode'] = 'REQUIRED' if required and count == self.num_records else 'NULLABLE'
+            schema.append(field)
+        return schema
 
-filehandle.close()
+def iter_records(filehandle):
+    for line in filehandle:
+        if line.strip():
+            yield json.loads(line)
 
-# use gbq generate bq schema
-schema = gbq.generate_bq_schema(df, default_type='STRING')["fields"]
+def infer_schema(filehandle, required=False, default_type='STRING'):
+    """Returns the schema fields of the new line delimited JSON records
+       (see SchemaInferencer.schema for required)
+    """
+    inferencer = SchemaInferencer(default_type)
+    for record in iter_records(filehandle):
+        inferencer.add(record)
+    return inferencer.schema(required)
 
-print json.dumps(schema, indent=4)
+def main(filename, required=False):
+    with open(filename, 'r') as filehandle:
+        schema = infer_schema(filehandle, required)
+    print json.dumps(schema, indent=4)
 
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('filename', help='New line delimited JSON file')
+    parser.add_argument('--required', action='store_true', default=False,
+                        help='Mark the fields that have a value in every record REQUIRED (default: all NULLABLE)')
+    args = parser.parse_args()
+    main(args.filename, args.required)
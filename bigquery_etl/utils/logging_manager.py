@@ -13,12 +13,164 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import sys
+import time
 import logging
 import logging.config
 import inspect
+import multiprocessing
+from Queue import Empty
+from collections import OrderedDict
 from colorlog import ColoredFormatter
 
+standard_format = '[%(levelname)s %(asctime)s %(name)s %(processName)s] %(message)s'
+standard_datefmt = "%Y-%m-%d-%H:%M:%S"
+
+#------------------------------------------
+# Queue based logging
+#  -- the processes (and threads) only put their records on a
+# multiprocessing queue; one listener process does all the file and
+# console writes, buffered, into the file each record is tagged with
+#------------------------------------------
+# the listener of the run; inherited by the forked worker processes
+log_listener = None
+
+class QueueHandler(logging.Handler):
+    """Formats the records and puts them on the listener queue,
+    tagged with the log file they belong to
+    """
+    def __init__(self, queue, log_filename=None):
+        logging.Handler.__init__(self)
+        self.queue = queue
+        self.log_filename = log_filename
+
+    def emit(self, record):
+        try:
+            # only the formatted line is sent, args and tracebacks may not pickle
+            self.queue.put_nowait((self.log_filename, self.format(record)))
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        # the listener closes the file of a handler that is done
+        if self.log_filename is not None:
+            try:
+                self.queue.put_nowait((self.log_filename, None))
+            except Exception:
+                pass
+        logging.Handler.close(self)
+
+def listen(queue, log_filename, console, flush_interval, max_open_files=64):
+    """Listener process: writes the lines to their files until a None item;
+    at most max_open_files stay open, the least recently written is closed
+    (and appended to if it gets lines again)
+    """
+    # least recently written first
+    files = OrderedDict()
+    # files opened before are appended to when a handler reopens them
+    opened = set()
+    last_flush = time.time()
+    while True:
+        try:
+            item = queue.get(timeout=flush_interval)
+        except Empty:
+            item = ()
+        if item is None:
+            break
+        if item:
+            filename, line = item
+            filename = filename or log_filename
+            if line is None:
+                if filename in files:
+                    files.pop(filename).close()
+            else:
+                if filename in files:
+                    logfile = files.pop(filename)
+                else:
+                    if len(files) >= max_open_files:
+                        files.popitem(last=False)[1].close()
+                    logfile = open(filename, 'a' if filename in opened else 'w', 1 << 16)
+                    opened.add(filename)
+                files[filename] = logfile
+                logfile.write(line + '\n')
+                if console:
+                    sys.stderr.write(line + '\n')
+        if time.time() - last_flush >= flush_interval:
+            for logfile in files.itervalues():
+                logfile.flush()
+            last_flush = time.time()
+    for logfile in files.itervalues():
+        logfile.close()
+
+class LogListener(object):
+    """Starts the listener process; configure_logging (and get_queue_logger)
+    then log through it in this process and in the processes forked from it
+
+    Example:
+        listener = LogListener('etl_protein.log').start()
+        log = configure_logging('etl_protein', 'etl_protein.log')
+        ...
+        listener.stop()
+    """
+    def __init__(self, log_filename, console=True, flush_interval=2, max_open_files=64):
+        self.queue = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=listen, name='LogListener',
+                                               args=(self.queue, log_filename, console, flush_interval,
+                                                     max_open_files))
+        self.process.daemon = True
+
+    def start(self):
+        global log_listener
+        self.process.start()
+        log_listener = self
+        return self
+
+    def stop(self):
+        global log_listener
+        self.queue.put(None)
+        self.process.join()
+        if log_listener is self:
+            log_listener = None
+
+def get_queue_handler(logger):
+    for handler in logger.handlers:
+        if isinstance(handler, QueueHandler):
+            return handler
+    return None
+
+def configure_queue_logging(name, log_filename, level='DEBUG'):
+    """Root logger to the listener queue; the handler is set up once per
+    process, later calls only switch the log file the records go to
+    """
+    root = logging.getLogger()
+    handler = get_queue_handler(root)
+    if handler is None:
+        for old_handler in root.handlers[:]:
+            root.removeHandler(old_handler)
+        handler = QueueHandler(log_listener.queue)
+        handler.setFormatter(logging.Formatter(standard_format, standard_datefmt))
+        root.addHandler(handler)
+        logging.captureWarnings(True)
+    handler.log_filename = log_filename
+    root.setLevel(level)
+    return logging.getLogger(name)
+
+def get_queue_logger(name, log_filename, log_format, level=logging.DEBUG):
+    """Named logger writing to its own file through the listener queue
+    """
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    handler = QueueHandler(log_listener.queue, log_filename)
+    handler.setFormatter(logging.Formatter(log_format))
+    logger.addHandler(handler)
+    return logger
+
 def configure_logging(name, log_filename, level='DEBUG'):
+    """Logs to the console and log_filename; through the listener
+    process when one was started (see LogListener)
+    """
+    if log_listener is not None:
+        return configure_queue_logging(name, log_filename, level)
 
     LOGGING = {
         'version': 1,
@@ -27,8 +179,8 @@ def configure_logging(name, log_filename, level='DEBUG'):
             'standard': {
                 #'format':  '%(levelname)s %(asctime)s %(name)s %(module)s.%(funcName)s.%(lineno)d %(processName)s -  %(message)s',
                 #'format':  '[%(levelname)s %(asctime)s %(name)s %(module)s %(processName)-8s] %(message)s',
-                'format':  '[%(levelname)s %(asctime)s %(name)s %(processName)s] %(message)s',
-                'datefmt': "%Y-%m-%d-%H:%M:%S"
+                'format':  standard_format,
+                'datefmt': standard_datefmt
             },
             'colored': {
                     '()': 'colorlog.ColoredFormatter',
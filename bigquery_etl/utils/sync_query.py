@@ -28,6 +28,8 @@ For more information, see the README.md under /bigquery.
 
 import argparse
 import json
+import time
+import concurrent.futures
 import pandas as pd
 from googleapiclient import discovery
 from oauth2client.client import GoogleCredentials
@@ -44,12 +46,86 @@ def sync_query(bigquery, project_id, query, timeout=10000, num_retries=5):
         body=query_data).execute(num_retries=num_retries)
 
 
-def main(project_id, query, timeout, num_retries):
+def build_service():
     # Grab the application's default credentials from the environment.
     credentials = GoogleCredentials.get_application_default()
 
     # Construct the service object for interacting with the BigQuery API.
-    bigquery = discovery.build('bigquery', 'v2', credentials=credentials)
+    return discovery.build('bigquery', 'v2', credentials=credentials)
+
+def iter_result_pages(bigquery, job_reference, num_retries=2, poll_interval=1):
+    """Yields the result pages of a query job; the next page is fetched on
+       a background thread while the caller works on the current one
+    """
+    def fetch(page_token):
+        while True:
+            page = bigquery.jobs().getQueryResults(
+                pageToken=page_token,
+                **job_reference).execute(num_retries=num_retries)
+            # the query may still be running (sync_query timed out)
+            if page.get('jobComplete', True):
+                return page
+            time.sleep(poll_interval)
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    try:
+        future = executor.submit(fetch, None)
+        while future is not None:
+            page = future.result()
+            page_token = page.get('pageToken')
+            future = executor.submit(fetch, page_token) if page_token else None
+            yield page
+    finally:
+        executor.shutdown(wait=False)
+
+# BigQuery returns all the values as strings
+type_converters = {
+    'INTEGER': int,
+    'FLOAT': float,
+    'BOOLEAN': lambda value: value.lower() == 'true',
+    'TIMESTAMP': float,
+}
+
+def iter_rows(pages, typed=False):
+    """Yields the rows of the result pages as dicts; typed converts the
+       INTEGER, FLOAT, BOOLEAN and TIMESTAMP (epoch seconds) values
+    """
+    for page in pages:
+        fields = page['schema']['fields']
+        names = [field['name'] for field in fields]
+        if typed:
+            converters = [type_converters.get(field['type'], None) for field in fields]
+        for row in page.get('rows', []):
+            values = [cell['v'] for cell in row['f']]
+            if typed:
+                values = [value if converter is None or value is None else converter(value)
+                          for converter, value in zip(converters, values)]
+            yield dict(zip(names, values))
+
+def iter_dataframes(pages, typed=False):
+    """Yields one dataframe per result page; typed converts the INTEGER,
+       FLOAT and TIMESTAMP columns with pd.to_numeric
+    """
+    for page in pages:
+        fields = page['schema']['fields']
+        names = [field['name'] for field in fields]
+        rows = page.get('rows', [])
+        if not rows:
+            continue
+        data_df = pd.DataFrame([[cell['v'] for cell in row['f']] for row in rows], columns=names)
+        if typed:
+            for field in fields:
+                if field['type'] in ('INTEGER', 'FLOAT', 'TIMESTAMP'):
+                    data_df[field['name']] = pd.to_numeric(data_df[field['name']])
+                elif field['type'] == 'BOOLEAN':
+                    data_df[field['name']] = data_df[field['name']].map({'true': True, 'false': False})
+        yield data_df
+
+def query_pages(project_id, query, timeout, num_retries, bigquery=None):
+    """Runs the query and returns the iterator over its result pages
+    """
+    if bigquery is None:
+        bigquery = build_service()
 
     query_job = sync_query(
         bigquery,
@@ -58,35 +134,15 @@ def main(project_id, query, timeout, num_retries):
         timeout,
         num_retries)
 
-    # Page through the result set and print all results.
-    results = list()
-    page_token = None
     print ('Paging through the results..')
-    while True:
-        page = bigquery.jobs().getQueryResults(
-            pageToken=page_token,
-            **query_job['jobReference']).execute(num_retries=2)
-
-        page_results = process_results(page)
-        results = results + page_results
-        page_token = page.get('pageToken')
-        if not page_token:
-            break
+    return iter_result_pages(bigquery, query_job['jobReference'])
 
-    return results
+def main(project_id, query, timeout, num_retries):
+    # Page through the result set and return all results.
+    return list(iter_rows(query_pages(project_id, query, timeout, num_retries)))
 
 def process_results(results):
-    fields = results['schema']['fields']
-    rows = results['rows']
-    results = []
-    for row in rows:
-        row_results = {}
-        for i in xrange(0, len(fields)):
-            cell = row['f'][i]
-            field = fields[i]
-            row_results[field['name']] = cell['v']
-        results.append(row_results)
-    return results
+    return list(iter_rows([results]))
 
 
 if __name__ == '__main__':
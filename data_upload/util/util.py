@@ -21,7 +21,6 @@ limitations under the License.
 '''
 # import boto
 import base64
-from copy import deepcopy
 from cStringIO import StringIO
 import importlib
 import json
@@ -36,6 +35,8 @@ import traceback
 import urllib2
 
 gcs_wrapper = None 
+# set by start_log_listener
+log_listener = None
 
 backoff = 0
 lock = Lock()
@@ -234,19 +235,42 @@ def _download_file(url, file_path, log, user, password):
 
 # def upload_files(archive_path, key_path):
 #    
+def start_log_listener(log_dir):
+    '''
+    from here on, the logs made by create_log only queue their records and one
+    listener process does the file and console writes
+    '''
+    global log_listener
+    from bigquery_etl.utils.logging_manager import LogListener
+    if not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+    log_listener = LogListener(log_dir + 'untagged.txt').start()
+    return log_listener
+
+def stop_log_listener():
+    global log_listener
+    if log_listener is not None:
+        log_listener.stop()
+        log_listener = None
+
 def create_log(log_dir, log_name):
     try:
         # creates the logs for the run
         with lock:
             if not os.path.isdir(log_dir):
                 os.makedirs(log_dir)
+            log_format = '%(asctime)s - %(levelname)s - %(threadName)s - %(message)s'
+            if log_listener is not None:
+                from bigquery_etl.utils.logging_manager import get_queue_logger
+                get_queue_logger(log_name, log_dir + log_name + '.txt', log_format)
+                return log_name
             logger = logging.getLogger(log_name)
             logger.setLevel(logging.DEBUG)
             log = logging.FileHandler(log_dir + log_name + '.txt', 'w')
             log.setLevel(logging.DEBUG)
             slog = logging.StreamHandler()
             slog.setLevel(logging.DEBUG)
-            formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(threadName)s - %(message)s')
+            formatter = logging.Formatter(log_format)
             log.setFormatter(formatter)
             slog.setFormatter(formatter)
             logger.addHandler(log)
@@ -321,109 +345,178 @@ def print_list_synopsis(fulllist, label, log, count = 2):
     else:
         log.info("%s: size %d\n%s\n\t...\n%s\n\n" % (label, len(fulllist), json.dumps (fulllist[:count], indent=4), json.dumps (fulllist[-count:], indent=4)))
 
-def __recurse_filter_map(retmap, origmap, thefilter):
+#------------------------------------------
+# the filter configurations are compiled once into plans: lists of
+# steps that each copy one configured field into the row being built.
+# applying a plan to a record doesn't interpret the configuration again
+#------------------------------------------
+# id(filter) -> (filter, plan); the filter is kept so its id isn't reused
+__filter_plans = {}
+__flatten_plans = {}
+
+def __cached_plan(plans, thefilter, compile_plan):
+    entry = plans.get(id(thefilter))
+    if entry is None or entry[0] is not thefilter:
+        entry = (thefilter, compile_plan(thefilter))
+        plans[id(thefilter)] = entry
+    return entry[1]
+
+def __compile_filter_plan(thefilter):
+    steps = []
     if 'value' in thefilter:
-        for value in thefilter['value']:
-            if value in origmap:
-                newlabel = thefilter['value'][value]
-                retmap[newlabel] = origmap[value]
+        for value, newlabel in thefilter['value'].iteritems():
+            steps += [('value', value, newlabel, None)]
     
-    # TODO: map might have a list might have nested fields so might return multiple rows
     if 'list' in thefilter:
-        for value in thefilter['list']:
-            if value in origmap:
-                newlabel = thefilter['list'][value]
-                retmap[newlabel] = deepcopy(origmap[value])
+        for value, newlabel in thefilter['list'].iteritems():
+            steps += [('list', value, newlabel, None)]
     
     if 'map' in thefilter:
-        for value in thefilter['map']:
-            if value in origmap:
-                newlabel = thefilter['map'][value][value]
-                retmap[newlabel] = __recurse_filter_map({}, origmap[value], thefilter['map'][value])
+        for value, newfilter in thefilter['map'].iteritems():
+            steps += [('map', value, newfilter[value], __compile_filter_plan(newfilter))]
     
     if 'map_list' in thefilter:
-        for value in thefilter['map_list']:
+        for value, newfilter in thefilter['map_list'].iteritems():
+            steps += [('map_list', value, newfilter[value], __compile_filter_plan(newfilter))]
+    return steps
+
+def __apply_filter_plan(steps, origmap):
+    retmap = {}
+    for kind, value, newlabel, subplan in steps:
+        if value not in origmap:
+            continue
+        if 'value' == kind:
+            retmap[newlabel] = origmap[value]
+        elif 'list' == kind:
+            # a new list so the result doesn't share it with the record
+            retmap[newlabel] = list(origmap[value])
+        elif 'map' == kind:
+            retmap[newlabel] = __apply_filter_plan(subplan, origmap[value])
+        else:
+            retmap[newlabel] = [__apply_filter_plan(subplan, nextmap) for nextmap in origmap[value]]
+    return retmap
+
+def compile_filter_map(thefilter):
+    return __cached_plan(__filter_plans, thefilter, __compile_filter_plan)
+
+def filter_map(origmap, thefilter):
+    return __apply_filter_plan(compile_filter_map(thefilter), origmap)
+
+class FlattenPlan(object):
+    '''
+    compiled flatten_map filter: steps fill the row of a record, in the
+    order of the filter sections; fanouts are the 'map_list' sections,
+    where each element of the list creates rows merged with the row
+    '''
+    def __init__(self, steps, fanouts):
+        self.steps = steps
+        self.fanouts = fanouts
+
+    def fill(self, origmap, initmap):
+        for step in self.steps:
+            step(origmap, initmap)
+
+    def apply(self, origmap):
+        initmap = {}
+        self.fill(origmap, initmap)
+        if not self.fanouts:
+            return [initmap]
+
+        retlist = []
+        for value, subplan in self.fanouts:
             if value in origmap:
-                newfilter = thefilter['map_list'][value]
-                newlabel = newfilter[value]
-                retmap[newlabel] = []
                 for nextmap in origmap[value]:
-                    retmap[newlabel] += [__recurse_filter_map({}, nextmap, newfilter)]
+                    for newmap in subplan.apply(nextmap):
+                        row = dict(initmap)
+                        row.update(newmap)
+                        retlist += [row]
+        if 0 == len(retlist):
+            retlist += [initmap]
+        return retlist
 
-    return retmap
+def __value_step(value, spec):
+    fields = spec.split(',')
+    if 1 == len(fields):
+        def step(origmap, initmap):
+            if value in origmap:
+                initmap[spec] = origmap[value]
+    elif 'substr' == fields[0]:
+        start, end, newlabel = int(fields[1]), int(fields[2]), fields[3]
+        def step(origmap, initmap):
+            if value in origmap:
+                initmap[newlabel] = origmap[value][start:end] if origmap[value] is not None else None
+    elif 'list2str' == fields[0]:
+        newlabel = fields[1]
+        def step(origmap, initmap):
+            if value in origmap:
+                initmap[newlabel] = ','.join(origmap[value])
+    else:
+        def step(origmap, initmap):
+            if value in origmap:
+                raise ValueError('unknown operation specification: %s %s' % (origmap[value], spec))
+    return step
 
-def filter_map(origmap, thefilter):
-    return __recurse_filter_map({}, origmap, thefilter)
+def __map_list_first_step(value, subplan):
+    def step(origmap, initmap):
+        if value in origmap:
+            # flatten the key/values from the nested map with the top level key/values
+            if len(origmap[value]) > 1:
+                print 'found more than one %s for %s' % (value, origmap['file_id'])
+            initmap.update(subplan.apply(origmap[value][0])[0])
+    return step
+
+def __map_step(value, subplan):
+    if subplan.fanouts:
+        def step(origmap, initmap):
+            if value in origmap:
+                initmap.update(subplan.apply(origmap[value])[0])
+    else:
+        # no rows to fan out: the nested fields go straight into the row
+        def step(origmap, initmap):
+            if value in origmap:
+                subplan.fill(origmap[value], initmap)
+    return step
 
-def __recurse_flatten_map(origmap, thefilter):
-    initmap = {}
+def __list_step(label, newlabel):
+    def step(origmap, initmap):
+        initmap[newlabel] = ', '.join(origmap[label])
+    return step
+
+def __compile_flatten_plan(thefilter):
+    steps = []
     if 'value' in thefilter:
         for value in thefilter['value']:
-            if value in origmap:
-                fields = thefilter['value'][value].split(',')
-                if 1 == len(fields):
-                    newlabel = thefilter['value'][value]
-                    initmap[newlabel] = origmap[value]
-                elif 'substr' == fields[0]:
-                    if origmap[value] is not None:
-                        substr = origmap[value][int(fields[1]):int(fields[2])]
-                        initmap[fields[3]] = substr
-                    else:
-                        initmap[fields[3]] = None
-                elif 'list2str' == fields[0]:
-                    string = ','.join(origmap[value])
-                    initmap[fields[1]] = string
-                else:
-                    raise ValueError('unknown operation specification: %s %s' % (origmap[value], thefilter['value'][value]))
+            steps += [__value_step(value, thefilter['value'][value])]
     
     # TODO: map might have a list might have nested fields so might return multiple rows
-    # maplists = []
     if 'map_list_first' in thefilter:
         for value in thefilter['map_list_first']:
-            if value in origmap:
-                # flatten the key/values from the nested map with the top level key/values
-                if len(origmap[value]) > 1:
-                    print 'found more than one %s for %s' % (value, origmap['file_id'])
-                initmap.update(__recurse_flatten_map(origmap[value][0], thefilter['map_list_first'][value])[0])
+            steps += [__map_list_first_step(value, __compile_flatten_plan(thefilter['map_list_first'][value]))]
     
     # TODO: map might have a list or have nested fields so might return multiple rows
-    # maplists = []
     if 'map' in thefilter:
         for value in thefilter['map']:
-            if value in origmap:
-                # flatten the key/values from the nested map with the top level key/values
-                initmap.update(__recurse_flatten_map(origmap[value], thefilter['map'][value])[0])
+            steps += [__map_step(value, __compile_flatten_plan(thefilter['map'][value]))]
     
     # for every value on the list, a new row needs to be created in the returned list
     # TODO: currently finding lists with one value so for now just concatenating, need cross product?
     if 'list' in thefilter:
         for label in thefilter['list']:
-            newlabel = thefilter['list'][label]
-            # flatten the key/values from the nested map with the top level key/values
-            initmap[newlabel] = ', '.join(origmap[label])
-                
+            steps += [__list_step(label, thefilter['list'][label])]
+    
     # for every map on the list, each row needs to be merged in the returned list
     # TODO: if creating lists above is ever implemented, must implement here
+    fanouts = []
     if 'map_list' in thefilter:
-        retlist = []
         for value in thefilter['map_list']:
-            newfilter = thefilter['map_list'][value]
-            if value in origmap:
-                for nextmap in origmap[value]:
-                    newmaps = __recurse_flatten_map(nextmap, newfilter)
-                    for nextmap in newmaps:
-                        newmap = dict(initmap)
-                        newmap.update(nextmap)
-                        retlist += [newmap]
-        if 0 == len(retlist):
-            retlist += [initmap]
-    else:
-        retlist = [initmap]
-    
-    return retlist
+            fanouts += [(value, __compile_flatten_plan(thefilter['map_list'][value]))]
+    return FlattenPlan(steps, fanouts)
+
+def compile_flatten_map(thefilter):
+    return __cached_plan(__flatten_plans, thefilter, __compile_flatten_plan)
 
 def flatten_map(origmap, thefilter):
-    return __recurse_flatten_map(origmap, thefilter)
+    return compile_flatten_map(thefilter).apply(origmap)
 
 def order4insert(curorder, dborder, rows):
     if len(curorder) != len(dborder):
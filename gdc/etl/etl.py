@@ -22,7 +22,7 @@ import pandas as pd
 
 from bigquery_etl.extract.gcloud_wrapper import GcsConnector
 from bigquery_etl.extract.utils import convert_file_to_dataframe
-from bigquery_etl.load import load_data_from_file
+from bigquery_etl.load.load_orchestrator import load_from_manifest
 from bigquery_etl.transform.tools import cleanup_dataframe
 from util import flatten_map
 
@@ -40,6 +40,15 @@ class Etl(object):
     def data_type_specific(self, config, file_df):
         return
     
+    def add_to_manifest(self, uri):
+        '''
+        records an uploaded etl file; load() loads the files of the manifest
+        '''
+        # the subclasses don't call the base constructor
+        if not hasattr(self, 'manifest'):
+            self.manifest = []
+        self.manifest.append(uri)
+    
     def add_metadata(self, file_df, data_type, info, program_name, project, config):
         """Add metadata info to the dataframe
         """
@@ -142,6 +151,7 @@ class Etl(object):
                 keyname = config['buckets']['folders']['base_run_folder'] + 'etl/%s/%s/%s/%s' % (endpt_type, project, data_type, paths[0].replace('/', '_'))
                 log.info('\t\tstart convert and upload %s to the cloud' % (keyname))
                 gcs.convert_df_to_njson_and_upload(complete_df, keyname, logparam = log)
+                self.add_to_manifest('gs://' + config['buckets']['open'] + '/' + keyname)
                 log.info('\t\tfinished convert and upload %s to the cloud' % (keyname))
             else:
                 etl_uploaded = False
@@ -155,21 +165,43 @@ class Etl(object):
     def load(self, project_id, bq_datasets, bq_tables, schema_files, gcs_file_paths, write_dispositions, batch_count, log):
         """
         Load the bigquery table
-        load_data_from_file accepts following params:
-        project_id, dataset_id, table_name, schema_file, data_path,
-              source_format, write_disposition, poll_interval, num_retries
+        from the etl files uploaded by this instance under gcs_file_paths (see add_to_manifest),
+        all the tables at once; batch_count is the number of uploaded batches.
+        When this instance uploaded none under a path (a load only run, or the upload ran
+        in another process), the etl files are listed from the bucket instead
+        load_from_manifest accepts following params:
+        project_id, manifest (file or list of uris), [(dataset_id, table_name, schema_file, uri prefix,
+              source_format, write_disposition)]
         """
         log.info('\tbegin load of %s data into bigquery' % (gcs_file_paths))
         
-        sep = ''
+        manifest = list(getattr(self, 'manifest', []))
+        log.info('\t\t%d etl files uploaded in %d batches' % (len(manifest), batch_count))
+        loads = []
         for index in range(len(bq_datasets)):
-            log.info("%s\t\tLoading %s table into BigQuery.." % (sep, bq_datasets[index]))
-            load_data_from_file.run(project_id, batch_count, bq_datasets[index], bq_tables[index], schema_files[index], 
-                                gcs_file_paths[index] + '/*', 'NEWLINE_DELIMITED_JSON', write_dispositions[index])
-            sep = '\n\t\t"*"*30\n'
+            prefix = gcs_file_paths[index] + '/'
+            if not any(uri.startswith(prefix) for uri in manifest):
+                uris = self.list_etl_files(project_id, prefix, log)
+                if not uris:
+                    raise RuntimeError('no etl files under %s to load into %s' % (prefix, bq_tables[index]))
+                manifest.extend(uris)
+            log.info("\t\tLoading %s table into BigQuery.." % (bq_datasets[index]))
+            loads.append((bq_datasets[index], bq_tables[index], schema_files[index], prefix,
+                          'NEWLINE_DELIMITED_JSON', write_dispositions[index]))
+        load_from_manifest(project_id, manifest, loads, log=log)
     
         log.info('done load %s of data into bigquery' % (gcs_file_paths))
 
+    def list_etl_files(self, project_id, prefix, log):
+        """
+        the uris of the etl files in the bucket under prefix (gs://bucket/path/)
+        """
+        bucket_name, path = prefix[len('gs://'):].split('/', 1)
+        gcs = GcsConnector(project_id, bucket_name)
+        uris = ['gs://%s/%s' % (bucket_name, blob.name) for blob in gcs.bucket.list_blobs(prefix=path)]
+        log.info('\t\tno etl files uploaded under %s by this run, found %d in the bucket' % (prefix, len(uris)))
+        return uris
+
     def finish_etl(self, config, endpt_type, program_name, project, data_type, batch_count, log):
         log.info('\tstart finish_etl() for %s %s' % (project, data_type))
         try:
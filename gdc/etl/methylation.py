@@ -17,14 +17,10 @@ limitations under the License.
 
 @author: michael
 '''
-import pprint
-import time
-
-from apiclient.errors import HttpError
 from googleapiclient import discovery
-from oauth2client.client import AccessTokenRefreshError 
 from oauth2client.client import GoogleCredentials
 
+from bigquery_etl.load.query_orchestrator import QueryOrchestrator
 from gdc.etl import etl
 
 class Methylation(etl.Etl):
@@ -82,76 +78,45 @@ class Methylation(etl.Etl):
     
         return bigquery
     
-    def split_table_by_chr(self, chromosome, project_id, dataset_id, table_name, log):
-        # this is a new connection to the new project
-        bigquery_service = self.get_service()
-        jobCollection = bigquery_service.jobs()
-    
-        try:
-            query_request = bigquery_service.jobs()
-            # using standard SQL to avoid an 'exceeded resources' error caused using legacy sql.  if that error starts to appear with 
-            # standard sql, using an in-clause for the annotation table would likely work, but be slower.
-            query = """
-                SELECT data.sample_barcode AS sample_barcode, data.probe_id AS probe_id, data.beta_value AS beta_value, data.project_short_name AS project_short_name, data.program_name AS program_name, 
-                    data.sample_type_code AS sample_type_code, data.file_name AS file_name, data.file_gdc_id as file_gdc_id, data.aliquot_barcode as aliquot_barcode, data.case_barcode as case_barcode, 
-                    data.case_gdc_id as case_gdc_id, data.sample_gdc_id as sample_gdc_id, data.aliquot_gdc_id as aliquot_gdc_id
-                FROM 
-                    ( 
-                      SELECT CpG_probe_id 
-                      FROM platform_reference.GDC_hg38_methylation_annotation
-                      WHERE ( chromosome = "chr{0}")
-                    ) AS ids 
-                JOIN 
-                    (
-                      SELECT * 
-                      FROM {1}.{2} 
-                    ) AS data 
-                ON ids.CpG_probe_id = data.probe_id""".format(chromosome, dataset_id, table_name)
-    
-            log.info('importing chromosome %s\n%s' % (chromosome, query))
+    def chromosome_query(self, chromosome, dataset_id, table_name):
+        # using standard SQL to avoid an 'exceeded resources' error caused using legacy sql.  if that error starts to appear with 
+        # standard sql, using an in-clause for the annotation table would likely work, but be slower.
+        query = """
+            SELECT data.sample_barcode AS sample_barcode, data.probe_id AS probe_id, data.beta_value AS beta_value, data.project_short_name AS project_short_name, data.program_name AS program_name, 
+                data.sample_type_code AS sample_type_code, data.file_name AS file_name, data.file_gdc_id as file_gdc_id, data.aliquot_barcode as aliquot_barcode, data.case_barcode as case_barcode, 
+                data.case_gdc_id as case_gdc_id, data.sample_gdc_id as sample_gdc_id, data.aliquot_gdc_id as aliquot_gdc_id
+            FROM 
+                ( 
+                  SELECT CpG_probe_id 
+                  FROM platform_reference.GDC_hg38_methylation_annotation
+                  WHERE ( chromosome = "chr{0}")
+                ) AS ids 
+            JOIN 
+                (
+                  SELECT * 
+                  FROM {1}.{2} 
+                ) AS data 
+            ON ids.CpG_probe_id = data.probe_id""".format(chromosome, dataset_id, table_name)
+        return query
 
-            query_data = {
-                  'configuration': {
-                  'query': {
-                    'query': query,
-                    'useQueryCache': False,
-                    'useLegacySql': False,
-                    'destinationTable': {
-                        'projectId': project_id,
-                        'datasetId': dataset_id,
-                        'tableId': '{0}_chr{1}'.format(table_name, chromosome)
-                    },
-                    'createDisposition': 'CREATE_IF_NEEDED',
-                    'writeDisposition': 'WRITE_APPEND',
-                    'allowLargeResults': True
-                  }
-                }
-            }
-            insertResponse = query_request.insert(projectId=project_id, body=query_data).execute()
-            # Ping for status until it is done, with a short pause between calls.
-            while True:
-                result = jobCollection.get(projectId=project_id,
-                                         jobId=insertResponse['jobReference']['jobId']).execute()
-                status = result['status']
-                if 'DONE' == status['state']:
-                    if 'errorResult' in status and status['errorResult']:
-                        log.error('an error occurred completing import at \'%s\': %s \'%s\' for chormosome %s' % 
-                            (status['errorResult']['location'], status['errorResult']['reason'], status['errorResult']['message'], chromosome))
-                    else:
-                        log.info('completed import chromosome %s' % (chromosome))
-                    break
-                if 'errors' in status and status['errors'] and 0 < len(status['errors']):
-                    for error in status['errors']:
-                        log.warning('\terror while importing chromosome %s: %s' % (chromosome, error))
-                log.info('\tWaiting for the import to complete for chromosome %s...' % (chromosome))
-                time.sleep(20)
-    
-        except HttpError as err:
-            print 'Error:', pprint.pprint(err.content)
-    
-        except AccessTokenRefreshError:
-            print ("Credentials have been revoked or expired, please re-run"
-               "the application to re-authorize")
+    def split_tables_by_chr(self, chromosomes, project_id, dataset_id, table_name, log, max_concurrent=12, bigquery=None):
+        '''
+        runs the queries of the chromosomes concurrently (up to max_concurrent) with one client
+        and one poller; returns the chromosomes that failed
+        '''
+        if bigquery is None:
+            bigquery = self.get_service()
+        # the queries take minutes; polled every 10 to 30 seconds
+        orchestrator = QueryOrchestrator(project_id, bigquery=bigquery, max_concurrent=max_concurrent,
+                                         min_poll_interval=10, log=log)
+        for chromosome in chromosomes:
+            orchestrator.add_query(chromosome, self.chromosome_query(chromosome, dataset_id, table_name), dataset_id,
+                                   '{0}_chr{1}'.format(table_name, chromosome), use_legacy_sql=False,
+                                   write_disposition='WRITE_APPEND')
+        return orchestrator.run()
+
+    def split_table_by_chr(self, chromosome, project_id, dataset_id, table_name, log):
+        return self.split_tables_by_chr([chromosome], project_id, dataset_id, table_name, log)
     
     def finalize(self, config, program_name, log): 
         # now create the tables per chromosome
@@ -159,9 +124,11 @@ class Methylation(etl.Etl):
         project_id = config['cloud_projects']['open']
         dataset_id = config[program_name]['process_files']['datatype2bqscript']['Methylation Beta Value']['bq_dataset']
         table_name = config[program_name]['process_files']['datatype2bqscript']['Methylation Beta Value']['bq_table']
+        # concurrent query jobs (the BigQuery limit for concurrent queries is 50)
+        max_concurrent = config[program_name]['process_files']['datatype2bqscript']['Methylation Beta Value'].get('split_max_concurrent', 12)
         chromosomes = map(str,range(1,23)) + ['X', 'Y']
-    #    chromosomes = map(lambda orig_string: 'chr' + orig_string, chr_nums)
-        for chromosome in chromosomes:
-            self.split_table_by_chr(chromosome, project_id, dataset_id, table_name, log)
+        failed = self.split_tables_by_chr(chromosomes, project_id, dataset_id, table_name, log, max_concurrent)
+        if failed:
+            log.error('splitting failed for chromosomes %s' % (', '.join(failed)))
         log.info('done splitting methylation data by chromosome')
 
@@ -173,7 +173,9 @@ class miRNA_matrix(Isoform_expression_quantification):
                 df = convert_file_to_dataframe(buf)
                 df = cleanup_dataframe(df, log)
                 gcs = GcsConnector(config['cloud_projects']['open'], config['buckets']['open'])
-                gcs.convert_df_to_njson_and_upload(df, config[program_name]['process_files']['datatype2bqscript']['Isoform Expression Quantification']['gcs_output_path'] + file_name, logparam=log)
+                keyname = config[program_name]['process_files']['datatype2bqscript']['Isoform Expression Quantification']['gcs_output_path'] + file_name
+                gcs.convert_df_to_njson_and_upload(df, keyname, logparam=log)
+                self.add_to_manifest('gs://' + config['buckets']['open'] + '/' + keyname)
                 buf = StringIO()
                 buf.write("sample_barcode	mirna_id	mirna_accession	normalized_count	platform	project_short_name	program_name	sample_type_code" +
                           "	file_name	file_gdc_id	aliquot_barcode	case_barcode	case_gdc_id	sample_gdc_id	aliquot_gdc_id\n")
@@ -186,7 +188,7 @@ class miRNA_matrix(Isoform_expression_quantification):
     
 
     def load_isoform_matrix(self, config, program_name, write_disposition, log):
-        # TODO: add batch_count parameter
+        # loads the files melt_matrix() uploaded (see Etl.add_to_manifest)
         bq_dataset = config[program_name]['process_files']['datatype2bqscript']['Isoform Expression Quantification']['bq_dataset']
         bq_table = config[program_name]['process_files']['datatype2bqscript']['Isoform Expression Quantification']['matrix_bq_table']
         schema_file = config[program_name]['process_files']['datatype2bqscript']['Isoform Expression Quantification']['matrix_schema_file']
@@ -12,6 +12,8 @@ from urllib2 import urlopen
 
 from google.cloud import storage
 
+from bigquery_etl.extract.bucket_index import BucketIndex
+
 def getplace(lat, lon):
     url = "http://maps.googleapis.com/maps/api/geocode/json?"
     url += "latlng=%s,%s&sensor=false" % (lat, lon)
@@ -25,7 +27,7 @@ def getplace(lat, lon):
             break
     return country
 
-def main(path):
+def main(path, index_db='bucket_index.db', refresh=False):
     location2country = {
         'US': 'United States',
         'AUSTRALIA': 'Australia'
@@ -55,13 +57,15 @@ def main(path):
         country = getplace(lat, lon)
         if not country:
             raise ValueError('unable to establish a zone or country to determine egress charges')
-    blobs = bucket.list_blobs(max_results=None, page_token=None, prefix=None, delimiter=None, versions=None, projection='noAcl', fields=None, client=None)
-    count = 0
-    total_size = 0
-    for blob in blobs:
-        count += 1
-        total_size += blob.size
+    # the listing is kept in a local index; reruns don't list the bucket again
+    index = BucketIndex('isb-cgc', path, index_db)
+    blobs = index.list_blobs([''], refresh=refresh)
+    index.close()
+    count = len(blobs)
+    total_size = int(blobs['size'].sum())
     print '\n\tlocation: {}\n\tloc country: {}\n\tcountry: {}\n\tzone: {}\n\tblobs({}): combined size: {}'.format(location, loc_country, country, zone, count, total_size)
 
 if __name__ == '__main__':
-    main(argv[1])
+    # usage: estimate_egress.py bucket [--refresh]
+    #   --refresh relists the bucket instead of using the cached listing
+    main(argv[1], refresh='--refresh' in argv[2:])
@@ -57,7 +57,7 @@ from gdc.util.process_cases import process_cases
 from gdc.util.process_data_type import process_data_type
 from gdc.util.process_images import process_images
 
-from util import close_log, create_log, import_module
+from util import close_log, create_log, import_module, start_log_listener, stop_log_listener
 
 
 ##
@@ -328,6 +328,8 @@ def uploadGDC():
             config = json.load(configFile)
         
         log_dir = str(date.today()).replace('-', '_') + '_' + config['log_dir_tag'] + '/'
+        # all the logs of the run are written by one listener process
+        start_log_listener(log_dir)
         log_name = create_log(log_dir, 'top_processing')
         log = logging.getLogger(log_name)
         
@@ -348,13 +350,15 @@ def uploadGDC():
                 log.warning('\n\t====================\n\tnot processing annotations this run!\n\t====================')
             process_programs(config, endpt_type, log_dir, log)
         finalize(config, log)
+        log.info('finished uploadGDC()')
     except:
         raise
     finally:
         if gcs_wrapper:
             gcs_wrapper.close_connection()
+        # flushes and closes the log files
+        stop_log_listener()
 
-    log.info('finished uploadGDC()')
     print datetime.now(), 'finished uploadGDC()'
 
 ## -=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
@@ -10,6 +10,7 @@ from HTMLParser import HTMLParser
 import datetime
 import os.path
 from google.cloud import storage
+from bigquery_etl.extract.bucket_index import BucketIndex
 from lxml import etree
 from collections import Counter
 
@@ -29,9 +30,14 @@ all_elements = {}
 #--------------------------------------
 bucket = storage.get_bucket('isb-cgc-open')
 
-for k in bucket.list_blobs(prefix="tcga/"):
+# list the clinical xml files from the local bucket index (cached between runs;
+# --refresh relists the bucket)
+index = BucketIndex('isb-cgc', 'isb-cgc-open', 'bucket_index.db')
+clinical_files = index.list_blobs(["tcga/"], ['.xml', 'clinical'], refresh='--refresh' in sys.argv[1:])
+index.close()
 
-   if '.xml' in k.name and 'clinical' in k.name:
+for name in clinical_files['name']:
+      k = bucket.blob(name)
       print k.name
       disease_type = k.name.split("/")[1]
 
@@ -17,7 +17,7 @@
 To run: python load.py config_file
 """
 import sys
-from bigquery_etl.load import load_data_from_file
+from bigquery_etl.load.load_orchestrator import load_from_manifest
 import json
 import os
 
@@ -26,9 +26,10 @@ from bigquery_etl.utils.logging_manager import configure_logging
 def load(config):
     """
     Load the bigquery table
-    load_data_from_file accepts following params:
-    project_id, dataset_id, table_name, schema_file, data_path,
-          source_format, write_disposition, poll_interval, num_retries
+    from the outputs listed in the manifest of the pipeline run (etl-cnv.manifest);
+    load_from_manifest accepts following params:
+    project_id, manifest_file, [(dataset_id, table_name, schema_file, uri prefix,
+          source_format, write_disposition)]
     """
     log = configure_logging('cnv_load', 'logs/cnv_load.log')
     log.info('begin load of cnv into bigquery')
@@ -48,19 +49,16 @@ def load(config):
     #)
     dir_prefix = config['cnv']['output_dir_prefix']
     dir_suffixes = config['cnv']['output_dir_suffixes']
-    for dir_suffix in dir_suffixes:
-        log.info("\tLoading CNV data into BigQuery from %s..." % (dir_prefix + dir_suffix))
-        load_data_from_file.run(
-            config['project_id'],
-            config['bq_dataset'],
-            config['cnv']['bq_table'],
-            schemas_dir + config['cnv']['schema_file'],
-            'gs://' + config['buckets']['open'] + '/' +\
-                dir_prefix + dir_suffix + '*',
-            'NEWLINE_DELIMITED_JSON',
-            'WRITE_APPEND'
-        )
-        log.info("*"*30)
+    log.info("\tLoading CNV data into BigQuery from %s..." % (', '.join(dir_prefix + dir_suffix for dir_suffix in dir_suffixes)))
+    load_from_manifest(config['project_id'], 'etl-cnv.manifest', [(
+        config['bq_dataset'],
+        config['cnv']['bq_table'],
+        schemas_dir + config['cnv']['schema_file'],
+        tuple('gs://' + config['buckets']['open'] + '/' + dir_prefix + dir_suffix for dir_suffix in dir_suffixes),
+        'NEWLINE_DELIMITED_JSON',
+        'WRITE_APPEND'
+    )])
+    log.info("*"*30)
 
     log.info('finished load of CNV into bigquery')
 
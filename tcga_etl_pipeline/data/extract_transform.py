@@ -19,10 +19,12 @@ run stand alone since it combines the extract and transform steps into one.
 """
 import sys
 import json
+import tempfile
 
 from bigquery_etl.utils.logging_manager import configure_logging
 from bigquery_etl.extract.gcloud_wrapper import GcsConnector
 from bigquery_etl.utils.gcutils import read_mysql_query
+from bigquery_etl.transform.tools import write_df_as_njson
 
 def identify_data(config):
     """Gets the metadata info from database
@@ -87,18 +89,23 @@ def identify_data(config):
             AND IncludeForAnalysis='yes'
         """
 
+    project_id = config['project_id']
+    bucket_name = config['buckets']['open']
+    gcs = GcsConnector(project_id, bucket_name)
+
     studies = config['all_tumor_types']
     for study in studies:
-        # connect to db and get results in a dataframe
+        # connect to db and stream the results, in dataframes of chunksize rows, to a local njson file
         log.info("\tselect data records from db for %s" % (study))
-        metadata_df = read_mysql_query(host, database, user, passwd, sqlquery % (study))
-        log.info("\tFound {0} rows, columns." .format(str(metadata_df.shape)))
-    
-        project_id = config['project_id']
-        bucket_name = config['buckets']['open']
-        gcs = GcsConnector(project_id, bucket_name)
-        log.info("\tupload data to GCS.")
-        gcs.convert_df_to_njson_and_upload(metadata_df, config['data']['output_dir'] + config['data']['bq_table'] + '_%s.json' % (study))
+        with tempfile.TemporaryFile() as njson_file:
+            row_count = 0
+            for metadata_df in read_mysql_query(host, database, user, passwd, sqlquery % (study), chunksize=50000):
+                row_count += write_df_as_njson(metadata_df, njson_file)
+            log.info("\tFound {0} rows." .format(row_count))
+
+            log.info("\tupload data to GCS.")
+            gcs.upload_from_file_resumable(config['data']['output_dir'] + config['data']['bq_table'] + '_%s.json' % (study),
+                                           njson_file, logparam=log)
     
     log.info('finished extract and transform')
 
@@ -17,7 +17,7 @@
 To run: python load.py config_file
 """
 import sys
-from bigquery_etl.load import load_data_from_file
+from bigquery_etl.load.load_orchestrator import load_from_manifest
 import json
 import os
 
@@ -27,9 +27,10 @@ from methylation.split_table import main
 def load(config):
     """
     Load the bigquery table
-    load_data_from_file accepts following params:
-    project_id, dataset_id, table_name, schema_file, data_path,
-          source_format, write_disposition, poll_interval, num_retries
+    from the outputs listed in the manifest of the pipeline run (etl-methylation.manifest);
+    load_from_manifest accepts following params:
+    project_id, manifest_file, [(dataset_id, table_name, schema_file, uri prefix,
+          source_format, write_disposition)]
     """
     log = configure_logging('methylation_split', 'logs/methylation_load.log')
     log.info('begin load of methylation into bigquery')
@@ -48,16 +49,15 @@ def load(config):
     #    'WRITE_EMPTY'
     #)
     log.info("\tLoading Methylation data into BigQuery...")
-    load_data_from_file.run(
-        config['project_id'],
+    load_from_manifest(config['project_id'], 'etl-methylation.manifest', [(
         config['bq_dataset'],
         config['methylation']['bq_table'],
         schemas_dir + config['methylation']['schema_file'],
         'gs://' + config['buckets']['open'] + '/' +\
-            config['methylation']['output_dir'] + '*',
+            config['methylation']['output_dir'],
         'CSV',
         'WRITE_APPEND'
-    )
+    )])
     
     main(config, log)
     
@@ -15,16 +15,16 @@
 '''
     Split methylation BigQuery table into chromosomes
 '''
-import pprint
 import sys
 import json
-from apiclient.errors import HttpError
 from googleapiclient import discovery
 from oauth2client.client import GoogleCredentials
-from oauth2client.client import AccessTokenRefreshError 
-import time
 
+from bigquery_etl.load.query_orchestrator import QueryOrchestrator
 from bigquery_etl.utils.logging_manager import configure_logging
+
+chromosomes = map(str,range(1,23)) + ['X', 'Y']
+
 # TODO change this to single auth script (GOOGLE_APPLICATION_CREDENTIALS)
 # still is still in progress
 def get_service():
@@ -36,82 +36,51 @@ def get_service():
 
     return bigquery
 
-def split_table_by_chr(chromosome, project_id, dataset_id, log):
-    # this is a new connection to the new project
-    bigquery_service = get_service()
-    jobCollection = bigquery_service.jobs()
-
-    try:
-        query_request = bigquery_service.jobs()
-        # maybe there is a nice way to format this one?
-        query = """\
-            SELECT data.ParticipantBarcode AS ParticipantBarcode, data.SampleBarcode AS SampleBarcode, data.SampleTypeLetterCode AS SampleTypeLetterCode, \
-                data.AliquotBarcode AS AliquotBarcode, data.Platform AS Platform, data.Study AS Study, data.Probe_Id AS Probe_Id, data.Beta_Value as Beta_Value 
-            FROM \
-                ( \
-                  SELECT IlmnID \
-                  FROM [platform_reference.methylation_annotation] \
-                  WHERE ( CHR == "{0}")\
-                ) AS ids \
-            JOIN EACH \
-                (\
-                  SELECT * \
-                  FROM [{1}.Methylation] \
-                ) AS data \
-            ON ids.IlmnID == data.Probe_Id""".format(chromosome, dataset_id)
+def chromosome_query(chromosome, dataset_id):
+    # maybe there is a nice way to format this one?
+    query = """\
+        SELECT data.ParticipantBarcode AS ParticipantBarcode, data.SampleBarcode AS SampleBarcode, data.SampleTypeLetterCode AS SampleTypeLetterCode, \
+            data.AliquotBarcode AS AliquotBarcode, data.Platform AS Platform, data.Study AS Study, data.Probe_Id AS Probe_Id, data.Beta_Value as Beta_Value 
+        FROM \
+            ( \
+              SELECT IlmnID \
+              FROM [platform_reference.methylation_annotation] \
+              WHERE ( CHR == "{0}")\
+            ) AS ids \
+        JOIN EACH \
+            (\
+              SELECT * \
+              FROM [{1}.Methylation] \
+            ) AS data \
+        ON ids.IlmnID == data.Probe_Id""".format(chromosome, dataset_id)
+    return query
 
-        log.info('importing chromosome %s\n%s' % (chromosome, query))
-#        query_data = {'query': query}
-        query_data = {
-              'configuration': {
-              'query': {
-                'query': query,
-                'useQueryCache': False,
-                'destinationTable': {
-                    'projectId': project_id,
-                    'datasetId': dataset_id,
-                    'tableId': 'Methylation_chr{0}'.format(chromosome)
-                },
-                'createDisposition': 'CREATE_IF_NEEDED',
-                'writeDisposition': 'WRITE_EMPTY',
-                'allowLargeResults': True
-              }
-            }
-        }
-        insertResponse = query_request.insert(projectId=project_id, body=query_data).execute()
-        # Ping for status until it is done, with a short pause between calls.
-        while True:
-            result = jobCollection.get(projectId=project_id,
-                                     jobId=insertResponse['jobReference']['jobId']).execute()
-            status = result['status']
-            if 'DONE' == status['state']:
-                if 'errorResult' in status and status['errorResult']:
-                    log.error('an error occurred completing import at \'%s\': %s \'%s\' for chormosome %s' % 
-                        (status['errorResult']['location'], status['errorResult']['reason'], status['errorResult']['message'], chromosome))
-                else:
-                    log.info('completed import chromosome %s' % (chromosome))
-                break
-            if 'errors' in status and status['errors'] and 0 < len(status['errors']):
-                for error in status['errors']:
-                    log.warning('\terror while importing chromosome %s: %s' % (chromosome, error))
-            log.info('\tWaiting for the import to complete for chromosome %s...' % (chromosome))
-            time.sleep(20)
-
-    except HttpError as err:
-        print 'Error:', pprint.pprint(err.content)
+def split_tables_by_chr(chromosomes, project_id, dataset_id, log, max_concurrent=12, bigquery=None):
+    """Runs the queries of the chromosomes concurrently (up to max_concurrent),
+       with one client; returns the chromosomes that failed
+    """
+    if bigquery is None:
+        bigquery = get_service()
+    # the queries take minutes; polled every 10 to 30 seconds
+    orchestrator = QueryOrchestrator(project_id, bigquery=bigquery, max_concurrent=max_concurrent,
+                                     min_poll_interval=10, log=log)
+    for chromosome in chromosomes:
+        orchestrator.add_query(chromosome, chromosome_query(chromosome, dataset_id),
+                               dataset_id, 'Methylation_chr{0}'.format(chromosome))
+    return orchestrator.run()
 
-    except AccessTokenRefreshError:
-        print ("Credentials have been revoked or expired, please re-run"
-           "the application to re-authorize")
+def split_table_by_chr(chromosome, project_id, dataset_id, log):
+    return split_tables_by_chr([chromosome], project_id, dataset_id, log)
 
 def main(config, log):
     log.info('start splitting methylation data by chromosome')
     project_id = config['project_id']
     dataset_id = config['bq_dataset']
-    chromosomes = map(str,range(1,23)) + ['X', 'Y']
-#    chromosomes = map(lambda orig_string: 'chr' + orig_string, chr_nums)
-    for chromosome in chromosomes:
-        split_table_by_chr(chromosome, project_id, dataset_id, log)
+    # concurrent query jobs (the BigQuery limit for concurrent queries is 50)
+    max_concurrent = config.get('split_max_concurrent', 12)
+    failed = split_tables_by_chr(chromosomes, project_id, dataset_id, log, max_concurrent)
+    if failed:
+        log.error('splitting failed for chromosomes %s' % (', '.join(failed)))
     log.info('done splitting methylation data by chromosome')
 
 if __name__ == '__main__':
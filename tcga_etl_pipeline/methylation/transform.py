@@ -15,59 +15,26 @@
 
 """Script to parse methylation file
 """
-from bigquery_etl.utils import gcutils
-from bigquery_etl.extract.gcloud_wrapper import GcsConnector
-from bigquery_etl.utils.logging_manager import configure_logging
+from bigquery_etl.transform.transform_spec import TransformSpec, tcga_metadata_columns, run_transform
+
+methylation_spec = TransformSpec(
+    'methylation',
+    log_file='logs/methylation_transform_{AliquotBarcode}.log',
+    skiprows=1,
+    columns=['Probe_Id', "Beta_Value", "Gene_Symbol", "Chromosome", "Genomic_Coordinate"],
+    # filer based on the beta_value to remove NULL values
+    notnull=['Beta_Value'],
+    casts=[('Beta_Value', '%.2f')],
+    # no Pipeline and Center columns
+    metadata_columns=tcga_metadata_columns[:6],
+    output_columns=['ParticipantBarcode', 'SampleBarcode', 'SampleTypeLetterCode',
+                    'AliquotBarcode', 'Platform', 'Study', 'Probe_Id', "Beta_Value"],
+    output_format='CSV',
+    float_format='%.2f')
 
 def parse_methylation(project_id, bucket_name, filename, outfilename, metadata):
     """Download and convert blob into dataframe
        Transform the file: includes data cleaning
        Add Metadata information
     """
-    # setup logging
-    log = configure_logging('mirna.isoform', "logs/methylation_transform_" + metadata['AliquotBarcode'] + '.log')
-    try:
-        log.info('start transform of %s' % (metadata['AliquotBarcode']))
-        # connect to the cloud bucket
-        gcs = GcsConnector(project_id, bucket_name)
-    
-        #main steps: download, convert to df, cleanup, transform, add metadata
-        data_df = gcutils.convert_blob_to_dataframe(gcs, project_id, bucket_name, filename, skiprows=1, log=log)
-        data_df.columns = ['Probe_Id', "Beta_Value", "Gene_Symbol", "Chromosome", "Genomic_Coordinate"]
-    
-        log.info('\tadd changes and metadata for %s' % (metadata['AliquotBarcode']))
-        data_df = add_metadata(data_df, metadata)
-        data_df = additional_changes(data_df)
-    
-        # upload the contents of the dataframe in njson format
-        df_string = data_df.to_csv(index=False, header=False, float_format='%.2f')
-        status = gcs.upload_blob_from_string(outfilename, df_string)
-        log.info('finished transform of %s' % (metadata['AliquotBarcode']))
-    except Exception as e:
-        log.exception('problem transforming %s' % (metadata['AliquotBarcode']))
-        raise e
-    return status
-
-def additional_changes(data_df):
-    """Make additional data transformations on the dataframe
-    """
-    # filer based on the beta_value to remove NULL values
-    data_df = data_df[data_df.Beta_Value.notnull()]
-    data_df.loc[:, "Beta_Value"] = data_df["Beta_Value"]\
-                           .map(lambda beta_value: "{0:.2f}".format(float(beta_value)))
-    filter_columns = ['ParticipantBarcode', 'SampleBarcode', 'SampleTypeLetterCode',\
-                                 'AliquotBarcode', 'Platform', 'Study', 'Probe_Id', "Beta_Value"]
-#    filter_columns = ['ParticipantBarcode']
-    data_df = data_df[filter_columns]
-    return data_df
-
-def add_metadata(data_df, metadata):
-    """Add metadata info to the dataframe
-    """
-    data_df['AliquotBarcode'] = metadata['AliquotBarcode']
-    data_df['SampleBarcode'] = metadata['SampleBarcode']
-    data_df['ParticipantBarcode'] = metadata['ParticipantBarcode']
-    data_df['Study'] = metadata['Study'].upper()
-    data_df['SampleTypeLetterCode'] = metadata['SampleTypeLetterCode']
-    data_df['Platform'] = metadata['Platform']
-    return data_df
+    return run_transform(methylation_spec, project_id, bucket_name, filename, outfilename, metadata)
@@ -17,7 +17,7 @@
 To run: python load.py config_file
 """
 import sys
-from bigquery_etl.load import load_data_from_file
+from bigquery_etl.load.load_orchestrator import load_from_manifest
 import json
 import os
 
@@ -26,38 +26,24 @@ from bigquery_etl.utils.logging_manager import configure_logging
 def load(config):
     """
     Load the bigquery table
-    load_data_from_file accepts following params:
-    project_id, dataset_id, table_name, schema_file, data_path,
-          source_format, write_disposition, poll_interval, num_retries
+    from the outputs listed in the manifest of the pipeline run (etl-mirna_isoform.manifest);
+    load_from_manifest accepts following params:
+    project_id, manifest_file, [(dataset_id, table_name, schema_file, uri prefix,
+          source_format, write_disposition)]
     """
     log = configure_logging('mirna_isoform_load', 'logs/mirna_isoform_load.log')
     log.info('begin load of mirna isoform into bigquery')
 
     schemas_dir = os.environ.get('SCHEMA_DIR', 'schemas/')
 
-    log.info("\tLoading Isoform HiSeq data into BigQuery..")
-    load_data_from_file.run(
-        config['project_id'],
-        config['bq_dataset'],
-        config['mirna']['isoform']['bq_table_hiseq'],
-        schemas_dir + config['mirna']['isoform']['schema_file'],
-        'gs://' + config['buckets']['open'] + '/' +\
-            config['mirna']['isoform']['output_dir'] + 'IlluminaHiSeq/*',
-        'NEWLINE_DELIMITED_JSON',
-        'WRITE_EMPTY'
-    )
-    log.info("*"*30)
-    log.info("\tLoading Isoform GA data into BigQuery..")
-    load_data_from_file.run(
-        config['project_id'],
-        config['bq_dataset'],
-        config['mirna']['isoform']['bq_table_ga'],
-        schemas_dir + config['mirna']['isoform']['schema_file'],
-        'gs://' + config['buckets']['open'] + '/' +\
-            config['mirna']['isoform']['output_dir'] + 'IlluminaGA/*',
-        'NEWLINE_DELIMITED_JSON',
-        'WRITE_EMPTY'
-    )
+    log.info("\tLoading Isoform HiSeq and GA data into BigQuery..")
+    bucket_dir = 'gs://' + config['buckets']['open'] + '/' + config['mirna']['isoform']['output_dir']
+    load_from_manifest(config['project_id'], 'etl-mirna_isoform.manifest', [
+        (config['bq_dataset'], config['mirna']['isoform']['bq_table_hiseq'], schemas_dir + config['mirna']['isoform']['schema_file'],
+         bucket_dir + 'IlluminaHiSeq/', 'NEWLINE_DELIMITED_JSON', 'WRITE_EMPTY'),
+        (config['bq_dataset'], config['mirna']['isoform']['bq_table_ga'], schemas_dir + config['mirna']['isoform']['schema_file'],
+         bucket_dir + 'IlluminaGA/', 'NEWLINE_DELIMITED_JSON', 'WRITE_EMPTY')
+    ])
 
     log.info('done load of mirna isoform into bigquery')
 
@@ -15,57 +15,19 @@
 
 """Script to parse mirna/mirna files
 """
-from bigquery_etl.utils import gcutils
-from bigquery_etl.extract.gcloud_wrapper import GcsConnector
-from bigquery_etl.utils.logging_manager import configure_logging
+from bigquery_etl.transform.transform_spec import TransformSpec, run_transform
 import sys
 
+mirna_spec = TransformSpec(
+    'mirna.mirna.transform',
+    log_file='logs/mirna_mirna_transform_{AliquotBarcode}.log')
+
 def parse_mirna(project_id, bucket_name, filename, outfilename, metadata):
     """Download and convert blob into dataframe
        Transform the file: includes data cleaning
        Add Metadata information
     """
-    # setup logging
-    log = configure_logging('mirna.mirna.transform', "logs/mirna_mirna_transform_" + metadata['AliquotBarcode'] + '.log')
-
-    try:
-        log.info('start transform of %s' % (metadata['AliquotBarcode']))
-        # connect to the cloud bucket
-        gcs = GcsConnector(project_id, bucket_name)
-    
-        #main steps: download, convert to df, cleanup, transform, add metadata
-        log.info('\tadd changes and metadata for %s' % (metadata['AliquotBarcode']))
-        data_df = gcutils.convert_blob_to_dataframe(gcs, project_id, bucket_name, filename, log=log)
-        data_df = additional_changes(data_df)
-        data_df = add_metadata(data_df, metadata)
-    
-        # upload the contents of the dataframe in njson format
-        status = gcs.convert_df_to_njson_and_upload(data_df, outfilename)
-        log.info('finished transform of %s' % (metadata['AliquotBarcode']))
-    except Exception as e:
-        log.exception('problem transforming %s' % (metadata['AliquotBarcode']))
-        raise e
-    return status
-
-def additional_changes(data_df):
-    """Make additional data transformations on the dataframe
-    """
-    # Placeholder for any changes
-    return data_df
-
-def add_metadata(data_df, metadata):
-    """Add metadata info to the dataframe
-    """
-    data_df['AliquotBarcode'] = metadata['AliquotBarcode']
-    data_df['SampleBarcode'] = metadata['SampleBarcode']
-    data_df['ParticipantBarcode'] = metadata['ParticipantBarcode']
-    data_df['Study'] = metadata['Study'].upper()
-    data_df['SampleTypeLetterCode'] = metadata['SampleTypeLetterCode']
-    data_df['Platform'] = metadata['Platform']
-    data_df['Pipeline'] = metadata['Pipeline']
-    data_df['Center'] = metadata['DataCenterName']
-
-    return data_df
+    return run_transform(mirna_spec, project_id, bucket_name, filename, outfilename, metadata)
 
 if __name__ == '__main__':
     project_id = sys.argv[1]
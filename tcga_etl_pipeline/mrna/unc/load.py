@@ -17,43 +17,29 @@
 To run: python load.py config_file
 """
 import sys
-from bigquery_etl.load import load_data_from_file
+from bigquery_etl.load.load_orchestrator import load_from_manifest
 import json
 import os
 
 def load(config):
     """
     Load the bigquery table
-    load_data_from_file accepts following params:
-    project_id, dataset_id, table_name, schema_file, data_path,
-          source_format, write_disposition, poll_interval, num_retries
+    from the outputs listed in the manifest of the pipeline run (etl-mrna_unc.manifest);
+    load_from_manifest accepts following params:
+    project_id, manifest_file, [(dataset_id, table_name, schema_file, uri prefix,
+          source_format, write_disposition)]
     """
 
     schemas_dir = os.environ.get('SCHEMA_DIR', 'schemas/')
 
-    print "Loading mRNA unc HiSeq data into BigQuery.."
-    load_data_from_file.run(
-        config['project_id'],
-        config['bq_dataset'],
-        config['mrna']['unc']['bq_table_hiseq'],
-        schemas_dir + config['mrna']['unc']['schema_file'],
-        'gs://' + config['buckets']['open'] + '/' +\
-            config['mrna']['unc']['output_dir'] + 'IlluminaHiSeq/*',
-        'NEWLINE_DELIMITED_JSON',
-        'WRITE_EMPTY'
-    )
-    print "*"*30
-    print "Loading mRNA unc GA data into BigQuery.."
-    load_data_from_file.run(
-        config['project_id'],
-        config['bq_dataset'],
-        config['mrna']['unc']['bq_table_ga'],
-        schemas_dir + config['mrna']['unc']['schema_file'],
-        'gs://' + config['buckets']['open'] + '/' +\
-            config['mrna']['unc']['output_dir'] + 'IlluminaGA/*',
-        'NEWLINE_DELIMITED_JSON',
-        'WRITE_EMPTY'
-    )
+    print "Loading mRNA unc HiSeq and GA data into BigQuery.."
+    bucket_dir = 'gs://' + config['buckets']['open'] + '/' + config['mrna']['unc']['output_dir']
+    load_from_manifest(config['project_id'], 'etl-mrna_unc.manifest', [
+        (config['bq_dataset'], config['mrna']['unc']['bq_table_hiseq'], schemas_dir + config['mrna']['unc']['schema_file'],
+         bucket_dir + 'IlluminaHiSeq/', 'NEWLINE_DELIMITED_JSON', 'WRITE_EMPTY'),
+        (config['bq_dataset'], config['mrna']['unc']['bq_table_ga'], schemas_dir + config['mrna']['unc']['schema_file'],
+         bucket_dir + 'IlluminaGA/', 'NEWLINE_DELIMITED_JSON', 'WRITE_EMPTY')
+    ])
 
 
 if __name__ == '__main__':
@@ -15,40 +15,20 @@
 
 """Script to parse mrna/unc files
 """
-from bigquery_etl.utils import gcutils
-from bigquery_etl.extract.gcloud_wrapper import GcsConnector
-from bigquery_etl.utils.logging_manager import configure_logging
+from bigquery_etl.transform.transform_spec import TransformSpec, run_transform
+from bigquery_etl.transform.reference_tables import get_reference_table
 import sys
 import numpy as np
 import pandas as pd
 
-def parse_unc(project_id, bucket_name, filename, outfilename, metadata):
-    """Download and convert blob into dataframe
-       Transform the file: includes data cleaning
-       Add Metadata information
-    """
-    # setup logging
-    configure_logging('mrna.unc', "logs/" + metadata['AliquotBarcode'] + '.log')
-
-    # connect to the cloud bucket
-    gcs = GcsConnector(project_id, bucket_name)
-
-    #main steps: download, convert to df, cleanup, transform, add metadata
-    data_df = gcutils.convert_blob_to_dataframe(gcs, project_id, bucket_name, filename)
-    data_df = additional_changes(data_df)
-    data_df = add_metadata(data_df, metadata)
-
-    # upload the contents of the dataframe in njson format
-    status = gcs.convert_df_to_njson_and_upload(data_df, outfilename)
-    return status
-
 def additional_changes(data_df):
     """Make additional data transformations on the dataframe
     """
     # the file must be docs/" could move this hardcoded link to config
     hgnc_approved_symbols_file = 'docs/hgnc_approved_symbols.txt'
-    hgnc_approved_symbols_df = pd.read_table(hgnc_approved_symbols_file, sep="|", dtype='object')
-    hgnc_approved_symbols = hgnc_approved_symbols_df.set_index('entrez_id')['symbol'].to_dict()
+    # read once per worker process (reloaded if the file changes)
+    hgnc_approved_symbols = get_reference_table(hgnc_approved_symbols_file, 'entrez_id', ['symbol'],
+                                                sep='|', dtype='object')
 
     # split the column mirna_region into mirna_transcript and mirna_accession
     gene_info = data_df['gene_id'].str.split('|', n=1)
@@ -56,23 +36,21 @@ def additional_changes(data_df):
     data_df['original_gene_symbol'] = gene_info.str[0]
     data_df['original_gene_symbol'] = data_df['original_gene_symbol'].replace(r'?', np.nan)
     data_df['gene_id'] = gene_info.str[1]
-    data_df['HGNC_gene_symbol'] = data_df['gene_id'].map(lambda x: hgnc_approved_symbols.get(str(x), np.nan))
+    data_df['HGNC_gene_symbol'] = hgnc_approved_symbols.map(data_df['gene_id'].astype(str), 'symbol')
 
     return data_df
 
-def add_metadata(data_df, metadata):
-    """Add metadata info to the dataframe
-    """
-    data_df['AliquotBarcode'] = metadata['AliquotBarcode']
-    data_df['SampleBarcode'] = metadata['SampleBarcode']
-    data_df['ParticipantBarcode'] = metadata['ParticipantBarcode']
-    data_df['Study'] = metadata['Study'].upper()
-    data_df['SampleTypeLetterCode'] = metadata['SampleTypeLetterCode']
-    data_df['Platform'] = metadata['Platform']
-    data_df['Pipeline'] = metadata['Pipeline']
-    data_df['Center'] = metadata['DataCenterName']
+unc_spec = TransformSpec(
+    'mrna.unc',
+    log_file='logs/{AliquotBarcode}.log',
+    derived=[additional_changes])
 
-    return data_df
+def parse_unc(project_id, bucket_name, filename, outfilename, metadata):
+    """Download and convert blob into dataframe
+       Transform the file: includes data cleaning
+       Add Metadata information
+    """
+    return run_transform(unc_spec, project_id, bucket_name, filename, outfilename, metadata)
 
 if __name__ == '__main__':
     project_id = sys.argv[1]
@@ -34,12 +34,17 @@ import mrna.bcgsc.transform
 import mrna.unc.transform
 import sqlite3
 import time
+import hashlib
+import logging
 from bigquery_etl.execution import process_manager
+from bigquery_etl.execution.worker_context import get_worker_context
+from bigquery_etl.execution.post_etl_check import blob_prefixes
+from bigquery_etl.extract.bucket_index import BucketIndex
+from bigquery_etl.load.load_orchestrator import write_manifest
 from bigquery_etl.tests import tests
 import pandas as pd
 import argparse
-import random
-from bigquery_etl.utils.logging_manager import configure_logging
+from bigquery_etl.utils.logging_manager import configure_logging, LogListener
 
 # extract functions
 extract_functions = {
@@ -62,6 +67,114 @@ transform_functions = {
     'mrna_unc': mrna.unc.transform.parse_unc
 }
 
+# transform specs (see bigquery_etl.transform.transform_spec): output format and shard size
+transform_specs = {
+    'protein': protein.transform.protein_spec,
+    'mirna_mirna':  mirna.mirna.transform.mirna_spec,
+    'mirna_isoform': mirna.isoform.transform.isoform_spec,
+    'methylation': methylation.transform.methylation_spec,
+    'cnv': cnv.transform.cnv_spec,
+    'mrna_bcgsc': mrna.bcgsc.transform.bcgsc_spec,
+    'mrna_unc': mrna.unc.transform.unc_spec
+}
+
+def init_transform_worker(context, datatype):
+    """
+     Worker initializer - runs once in each worker process; sets up the
+     per-process log file (each transform then logs into the file of its spec)
+    """
+    context.get_logger('etl_{0}_transform'.format(datatype),
+                       'logs/{0}_transform_{1}.log'.format(datatype, os.getpid()))
+
+# datatypes whose transforms can return the frame (NDJSON output), for batching;
+# not the ones that set the metadata of their file on the uploaded blob
+# (upload_metadata), a shard of many files cannot carry it
+batch_datatypes = [datatype for datatype, spec in transform_specs.items()
+                   if spec.output_format == 'NEWLINE_DELIMITED_JSON' and not spec.upload_metadata]
+
+def transform_batch(transform, project_id, bucket_name, outfilename, metadata_list):
+    """
+     Transforms a batch of files into one NDJSON shard (outfilename)
+     Returns the error of each file (None for success), in the batch order,
+     as strings (exceptions don't always pickle back from the worker);
+     the files that fail are left out of the shard and retried on resume
+    """
+    batch_log = logging.getLogger('etl_transform_batch')
+    gcs = get_worker_context().get_gcs_connector(project_id, bucket_name)
+    data_dfs = []
+    errors = []
+    for metadata in metadata_list:
+        try:
+            data_dfs.append(transform(project_id, bucket_name, metadata['DatafileNameKey'], None, metadata))
+            errors.append(None)
+        except Exception as e:
+            batch_log.exception('problem transforming %s in batch %s' % (metadata['DatafileNameKey'], outfilename))
+            errors.append(str(e))
+    if data_dfs:
+        gcs.convert_df_to_njson_and_upload(pd.concat(data_dfs, ignore_index=True), outfilename)
+    return errors
+
+def get_file_sizes(project_id, bucket_name, filenames, index_db, refresh=False):
+    """
+     Sizes of the files, from the (cached) bucket listing; refresh relists the bucket
+    """
+    index = BucketIndex(project_id, bucket_name, index_db)
+    try:
+        listed_df = index.list_blobs(blob_prefixes(filenames), refresh=refresh)
+    finally:
+        index.close()
+    return listed_df.drop_duplicates('name').set_index('name')['size']
+
+def make_batches(queue_df, sizes, batch_bytes, max_batch_files):
+    """
+     Groups the files (sorted by name) of each output directory into batches
+     of up to batch_bytes and max_batch_files; returns (shard name, metadata list)
+     The shard name is a hash of the files of the batch, and it replaces the
+     OutDatafileNameKey of their metadata: the status row of each file records
+     the shard its rows went to (see write_output_manifest), whatever the
+     batching of earlier runs
+    """
+    batches = []
+    queue_df = queue_df.sort_values('DatafileNameKey')
+    queue_df = queue_df.assign(
+        _size=queue_df['DatafileNameKey'].map(sizes).fillna(batch_bytes).values,
+        _outdir=queue_df['OutDatafileNameKey'].map(os.path.dirname).values)
+    for outdir, group_df in queue_df.groupby('_outdir', sort=False):
+        group_sizes = group_df['_size'].tolist()
+        group_metadata = group_df.drop(['_size', '_outdir'], axis=1).to_dict('records')
+        batch, batch_size = [], 0
+        for metadata, size in zip(group_metadata, group_sizes):
+            if batch and (batch_size + size > batch_bytes or len(batch) == max_batch_files):
+                batches.append(batch)
+                batch, batch_size = [], 0
+            batch.append(metadata)
+            batch_size += size
+        if batch:
+            batches.append(batch)
+
+    shards = []
+    for batch in batches:
+        batch_hash = hashlib.md5('|'.join(sorted(metadata['DatafileNameKey'] for metadata in batch))).hexdigest()
+        outdir = os.path.dirname(batch[0]['OutDatafileNameKey'])
+        outfilename = outdir + '/batch_{0}.json'.format(batch_hash)
+        shards.append((outfilename, [dict(metadata, OutDatafileNameKey=outfilename) for metadata in batch]))
+    return shards
+
+def write_output_manifest(conn, table_task_queue_status, bucket_name, manifest_filename, log):
+    """
+     Writes the manifest the load stage reads (see load_orchestrator.load_from_manifest):
+     the gs:// uris of the outputs of the completed files, as recorded in their
+     status rows (their own output, or the shard of their batch)
+    """
+    sql = 'SELECT * FROM sqlite_master WHERE name ="{0}" and type="table";'.format(table_task_queue_status)
+    if len(pd.read_sql_query(sql, conn)) == 1:
+        sql = 'SELECT DISTINCT OutDatafileNameKey from {0} where errors="None"'.format(table_task_queue_status)
+        outfilenames = sorted(pd.read_sql_query(sql, conn)['OutDatafileNameKey'])
+    else:
+        outfilenames = []
+    write_manifest(manifest_filename, ['gs://{0}/{1}'.format(bucket_name, outfilename) for outfilename in outfilenames])
+    log.info('wrote %s output uris to %s' % (len(outfilenames), manifest_filename))
+
 def submit_to_queue(queue_df, conn, table_name):
     """
      Submit to queue - sqllite database
@@ -85,7 +198,8 @@ def validate_and_get_diff(conn, queue_df, table_task_queue_status):
         print 'Not completed: ', len(queue_df)
     return queue_df
 
-def main(datatype, config_file, max_workers, dry_run, create_new, debug):
+def main(datatype, config_file, max_workers, dry_run, create_new, debug, max_in_flight=None,
+         batch_bytes=None, max_batch_files=200, index_db='bucket_index.db', refresh_index=False):
     """
     Pipeline
     """
@@ -96,6 +210,8 @@ def main(datatype, config_file, max_workers, dry_run, create_new, debug):
     table_task_queue = 'task_queue'
     table_task_queue_status = 'task_queue_status' 
     db_filename = 'etl-{0}.db'.format(datatype)
+    # read by the load of the datatype (e.g. protein/load.py)
+    manifest_filename = 'etl-{0}.manifest'.format(datatype)
     log_filename = 'etl_{0}.log'.format(datatype)
     log_name = 'etl_{0}'.format(datatype)
 
@@ -142,7 +258,33 @@ def main(datatype, config_file, max_workers, dry_run, create_new, debug):
     #--------------------------------------------
     # Execution
     #------------------------------------------------------
-    pmr = process_manager.ProcessManager(max_workers=max_workers, db=db_filename, table=table_task_queue_status, log=log)
+    # submission blocks once max_in_flight tasks are outstanding
+    if not max_in_flight:
+        max_in_flight = 2 * max_workers
+    pmr = process_manager.ProcessManager(max_workers=max_workers, db=db_filename, table=table_task_queue_status,
+                                         log=log, max_in_flight=max_in_flight,
+                                         initializer=init_transform_worker, initargs=(datatype,))
+    if batch_bytes is None:
+        # the shard size the spec of the datatype asks for, if any
+        batch_bytes = transform_specs[datatype].shard_bytes
+    if batch_bytes and datatype not in batch_datatypes:
+        log.warning('batching is not available for %s, running one task per file' % (datatype))
+        batch_bytes = None
+    if batch_bytes:
+        # small files are transformed together, into one shard per batch;
+        # each file still gets its own status row (see ProcessManager.status_records),
+        # naming the shard it went to. Only the files left to do are batched: the
+        # shards of the completed files stay as they are, and the manifest lists the
+        # outputs of the status rows, so the batching can change between runs
+        sizes = get_file_sizes(project_id, bucket_name, queue_df['DatafileNameKey'].tolist(), index_db,
+                               refresh=refresh_index)
+        shards = make_batches(queue_df, sizes, batch_bytes, max_batch_files)
+        log.info('%s files in %s batches of up to %s bytes' % (len(queue_df), len(shards), batch_bytes))
+        for outfilename, metadata_list in shards:
+            pmr.submit(transform_batch, transform_functions[datatype], project_id, bucket_name,
+                       outfilename, metadata_list)
+        queue_df = queue_df.iloc[:0]
+
     for index, row in queue_df.iterrows():
         metadata = row.to_dict()
         inputfilename = metadata['DatafileNameKey']
@@ -152,12 +294,9 @@ def main(datatype, config_file, max_workers, dry_run, create_new, debug):
         #                inputfilename, outputfilename, metadata)
         future = pmr.submit(transform_functions[datatype], project_id, bucket_name,\
                         inputfilename, outputfilename, metadata)
-    
-        time.sleep(0.1 + 0.5  * random.random())
-        if index % 100 == 0:
-            time.sleep(5)
 
     pmr.start()
+    write_output_manifest(conn, table_task_queue_status, bucket_name, manifest_filename, log)
     log.info('finished pipeline for %s' % (datatype))
 
 if __name__ == '__main__':
@@ -175,6 +314,30 @@ if __name__ == '__main__':
         help='Number of threads to execute calls (default: 100)',
         type=int,
         default=100)
+    parser.add_argument(
+        '--max_in_flight',
+        help='Maximum number of submitted tasks outstanding at once; submission blocks\
+              until tasks complete (default: 2 * max_workers)',
+        type=int,
+        default=None)
+    parser.add_argument(
+        '--batch_bytes',
+        help='Transform the files in batches of up to this many bytes (by blob size), each\
+              batch writing one NDJSON shard; for datatypes with many small files\
+              (default: the shard_bytes of the transform spec, off when not set)',
+        type=int,
+        default=None)
+    parser.add_argument(
+        '--max_batch_files',
+        help='Maximum number of files in a batch (default: 200)',
+        type=int,
+        default=200)
+    parser.add_argument(
+        '--refresh_index',
+        help='Relist the bucket instead of using the cached listing of the bucket index\
+              (bucket_index.db), e.g. after new files were uploaded (default: False)',
+        action='store_true',
+        default=False)
     parser.add_argument(
         '--dry_run',
         help='Doesnt run the job, just returns statistics about the job such as how many files are\
@@ -198,14 +361,23 @@ if __name__ == '__main__':
 
     log_filename = 'etl_{0}.log'.format(args.datatype)
     log_name = 'etl_{0}'.format(args.datatype)
+    # the pipeline and its workers only queue their log records,
+    # the listener process writes them
+    log_listener = LogListener(log_filename).start()
     log = configure_logging(log_name, log_filename)
 
-
-    results = main(
-        args.datatype,
-        args.config_file,
-        args.max_workers,
-        args.dry_run,
-        args.create_new,
-        args.debug
-    )
+    try:
+        results = main(
+            args.datatype,
+            args.config_file,
+            args.max_workers,
+            args.dry_run,
+            args.create_new,
+            args.debug,
+            args.max_in_flight,
+            args.batch_bytes,
+            args.max_batch_files,
+            refresh_index=args.refresh_index
+        )
+    finally:
+        log_listener.stop()
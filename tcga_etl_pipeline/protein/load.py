@@ -17,29 +17,29 @@
 To run: python load.py config_file
 """
 import sys
-from bigquery_etl.load import load_data_from_file
+from bigquery_etl.load.load_orchestrator import load_from_manifest
 import json
 import os
 
 def load(config):
     """
     Load the bigquery table
-    load_data_from_file accepts following params:
-    project_id, dataset_id, table_name, schema_file, data_path,
-          source_format, write_disposition, poll_interval, num_retries
+    from the outputs listed in the manifest of the pipeline run (etl-protein.manifest);
+    load_from_manifest accepts following params:
+    project_id, manifest_file, [(dataset_id, table_name, schema_file, uri prefix,
+          source_format, write_disposition)]
     """
 
     schemas_dir = os.environ.get('SCHEMA_DIR', 'schemas/')
 
-    load_data_from_file.run(
-        config['project_id'],
+    load_from_manifest(config['project_id'], 'etl-protein.manifest', [(
         config['bq_dataset'],
         config['protein']['bq_table'],
         schemas_dir + config['protein']['schema_file'],
-        'gs://' + config['buckets']['open'] + '/' + config['protein']['output_dir'] + '*',
+        'gs://' + config['buckets']['open'] + '/' + config['protein']['output_dir'],
         'NEWLINE_DELIMITED_JSON',
         'WRITE_EMPTY'
-    )
+    )])
 
 
 if __name__ == '__main__':
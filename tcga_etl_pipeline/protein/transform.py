@@ -15,98 +15,67 @@
 
 """Script to parse Protein files
 """
-from bigquery_etl.utils import gcutils
-from bigquery_etl.extract.gcloud_wrapper import GcsConnector
-from bigquery_etl.utils.logging_manager import configure_logging
+from bigquery_etl.transform.transform_spec import TransformSpec, run_transform
+from bigquery_etl.transform.reference_tables import get_reference_table
 from bigquery_etl.transform.tools import split_df_column_values_into_multiple_rows
 import sys
 import pandas as pd
-import numpy as np
-from bigquery_etl.tests import tests
 import re
 
-def parse_protein(project_id, bucket_name, filename, outfilename, metadata):
-    """Download and convert blob into dataframe
-       Transform the file: includes data cleaning
-       Add Metadata information
-    """
-    # setup logging
-    log = configure_logging('protein', "logs/protein_transform_" + metadata['AliquotBarcode'] + '.log')
-    try:
-        log.info('start transform of %s' % (metadata['AliquotBarcode']))
-        # connect to the cloud bucket
-        gcs = GcsConnector(project_id, bucket_name)
-    
-        #main steps: download, convert to df, cleanup, transform, add metadata
-        data_df = gcutils.convert_blob_to_dataframe(gcs, project_id, bucket_name, filename, skiprows=1, log=log)
-        log.info('\tadd changes and metadata for %s' % (metadata['AliquotBarcode']))
-        data_df = additional_changes(data_df)
-        data_df = add_metadata(data_df, metadata)
-    
-        # validation
-        tests.assert_notnull_property(data_df, columns_list=['Protein_Name'])
-    
-        # upload the contents of the dataframe in njson format
-        status = gcs.convert_df_to_njson_and_upload(data_df, outfilename, metadata=metadata)
-        log.info('finished transform of %s' % (metadata['AliquotBarcode']))
-    except Exception as e:
-        log.exception('problem transforming %s' % (metadata['AliquotBarcode']))
-        raise e
-    return status
-
 def additional_changes(data_df):
     """Make additional data transformations on the dataframe
     """
     # need to change the curated file loading logic
     # antibody annotation mapping
     manual_curated_file = 'protein/antibody-gene-protein-map/2016_07_17_antibody-gene-protein-map.txt' # bad hardcoded link
-    aa_df = pd.read_csv(manual_curated_file, delimiter='\t', header=0, keep_default_na=False)
-    aa_df = aa_df.set_index('composite_element_ref')
-
-    aa_mapping_geneName = aa_df['final_gene_name'].to_dict()
-    aa_mapping_proteinName = aa_df['final_protein_name'].to_dict()
+    # read once per worker process (reloaded if the file changes)
+    aa_mapping = get_reference_table(manual_curated_file, 'composite_element_ref',
+                                     ['final_gene_name', 'final_protein_name'],
+                                     delimiter='\t', header=0, keep_default_na=False)
 
     # add gene and protein name
-    data_df['Gene_Name'] = data_df['Composite_Element_REF'].map(lambda x: aa_mapping_geneName.get(x, np.nan))
-    data_df['Protein_Name'] = data_df['Composite_Element_REF'].map(lambda x: aa_mapping_proteinName.get(x, np.nan))
+    data_df['Gene_Name'] = aa_mapping.map(data_df['Composite_Element_REF'], 'final_gene_name')
+    data_df['Protein_Name'] = aa_mapping.map(data_df['Composite_Element_REF'], 'final_protein_name')
 
     # split the gene column values into multiple rows
     data_df = split_df_column_values_into_multiple_rows(data_df, 'Gene_Name')
 
-    protein_info = data_df['Protein_Name'].str.split('_p', n=1, expand=True)
-    data_df['Protein_Basename'] = protein_info[0]
-    data_df['Phospho'] = protein_info[1].map(lambda x: "p"+ str(x))
-    data_df['Phospho'] = data_df['Phospho'].replace('pNone', np.nan)
+    # protein basename and phospho site (split at the first '_p')
+    protein_info = data_df['Protein_Name'].str.extract(protein_name_pattern, expand=True)
+    data_df['Protein_Basename'] = protein_info['basename']
+    data_df['Phospho'] = 'p' + protein_info['phospho']
     # get protein suffixes
-    data_df['antibodySource'] = map(lambda x: get_protein_suffixes(x).strip('-').split('-')[0], data_df['Composite_Element_REF'])
-    data_df['validationStatus'] = map(lambda x: get_protein_suffixes(x).strip('-').split('-')[1], data_df['Composite_Element_REF'])
+    suffix_info = data_df['Composite_Element_REF'].str.extract(protein_suffix_pattern, expand=True)
+    data_df['antibodySource'] = suffix_info['antibodySource']
+    data_df['validationStatus'] = suffix_info['validationStatus']
     return data_df
 
-def add_metadata(data_df, metadata):
-    """Add metadata info to the dataframe
-    """
-    data_df['AliquotBarcode'] = metadata['AliquotBarcode']
-    data_df['SampleBarcode'] = metadata['SampleBarcode']
-    data_df['ParticipantBarcode'] = metadata['ParticipantBarcode']
-    data_df['Study'] = metadata['Study'].upper()
-    data_df['SampleTypeLetterCode'] = metadata['SampleTypeLetterCode']
-    data_df['Platform'] = metadata['Platform']
-    data_df['Pipeline'] = metadata['Pipeline']
-    data_df['Center'] = metadata['DataCenterName']
-    return data_df
+#------------------------------------------
+# Patterns, compiled once
+#------------------------------------------
+protein_name_pattern = re.compile(r'^(?P<basename>.*?)(?:_p(?P<phospho>.*))?$')
+
+# element ref suffix: -<antibody source>-<validation status>...
+antibodySource = ['M', 'R', 'G']
+validationStatus = ['V', 'C', 'NA', 'E', 'QC']
+# the source, and the status up to the next dash, of the first suffix
+protein_suffix_pattern = re.compile('-(?P<antibodySource>{0})-(?P<validationStatus>(?:{1})[^-]*)'.format(
+                                    '|'.join(antibodySource), '|'.join(validationStatus)))
 
+protein_spec = TransformSpec(
+    'protein',
+    log_file='logs/protein_transform_{AliquotBarcode}.log',
+    skiprows=1,
+    derived=[additional_changes],
+    required=['Protein_Name'],
+    upload_metadata=True)
 
-def get_protein_suffixes(element_ref):
-    antibodySource = ['M', 'R', 'G']
-    validationStatus = ['V', 'C', 'NA', 'E', 'QC']
-    substrings = ["-".join(["", ads, vds + ".*"]) for ads in antibodySource for vds in validationStatus]
-    protein_substrings = re.compile("|".join(substrings))
-    suffix_search = re.search(protein_substrings, element_ref)
-    if suffix_search:
-        suffix = suffix_search.group(0)
-    else:
-        suffix = np.nan
-    return suffix
+def parse_protein(project_id, bucket_name, filename, outfilename, metadata):
+    """Download and convert blob into dataframe
+       Transform the file: includes data cleaning
+       Add Metadata information
+    """
+    return run_transform(protein_spec, project_id, bucket_name, filename, outfilename, metadata)
 
 if __name__ == '__main__':
     project_id = sys.argv[1]
@@ -122,4 +91,4 @@ if __name__ == '__main__':
         'Platform':'Platform'
     }
 #    parse_protein(project_id, bucket_name, filename, outfilename, metadata)
-    print get_protein_suffixes('PARP_cleaved-M-QC').strip('-').split('-')[0]
+    print protein_suffix_pattern.search('PARP_cleaved-M-QC').group('antibodySource')
@@ -22,7 +22,7 @@ from urllib2 import Request, urlopen
 import json
 from bigquery_etl.extract.gcloud_wrapper import GcsConnector
 import sys
-from bigquery_etl.transform.tools import normalize_json, cleanup_dataframe
+from bigquery_etl.transform.tools import normalize_json, convert_dataframe_encoding, cleanup_dataframe
 import pandas as pd
 
 def parse_annotations(config):
@@ -62,6 +62,8 @@ def parse_annotations(config):
     # transform
     #------------
     data_df = pd.DataFrame(all_annotations)
+    # UTF-8 encode the strings, a column at a time
+    data_df = convert_dataframe_encoding(data_df)
     # clean up the dataframe to upload to BigQuery
     data_df = cleanup_dataframe(data_df)
     # rename columns